@@ -0,0 +1,333 @@
+"""End-to-end book throughput against the local Leonardo stand-in.
+
+Starts `src.leonardo_standin` in its own process, then runs whole books at
+each concurrency level and reports books per minute, p50/p95 book latency and
+the peak RSS of the process tree doing the work (including render workers):
+
+- `direct`: `generate_story` from threads in this process;
+- `api`: `python -m src.serve` in a subprocess, driven through
+  `POST /api/generate` and `GET /api/jobs/<id>`.
+
+Everything (database, cache, PDFs) goes to a temp dir that is removed at the
+end. Client-side rate limits are off unless `--rate-limits` is given, so the
+numbers show the pipeline rather than the quota:
+
+    python bench/book_bench.py --concurrency 1,2,4 --books 4 --latency 5
+    python bench/book_bench.py --mode api --concurrency 1,2,4 --throttle-rate 0.05
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TextIO
+
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(url: str, process: subprocess.Popen, seconds: float = 30) -> None:
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {seconds:.0f}s")
+
+
+def _stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def _process_tree(root: int) -> list[int]:
+    children: dict[int, list[int]] = {}
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            ppid = int(stat.read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(stat.parent.name))
+    pids, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+
+def _tree_rss(root: int, exclude: set[int]) -> int:
+    total = 0
+    for pid in _process_tree(root):
+        if pid in exclude:
+            continue
+        try:
+            total += int(Path(f"/proc/{pid}/statm").read_text().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+class RssSampler:
+    """Peak resident memory of a process and its children, sampled on a thread.
+
+    Without /proc (macOS), falls back to this process's lifetime peak.
+    """
+
+    def __init__(self, root: int, exclude: set[int] | None = None, interval: float = 0.1) -> None:
+        self.root = root
+        self.exclude = exclude or set()
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _tree_rss(self.root, self.exclude))
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        if Path("/proc/self/statm").exists():
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        else:
+            # ru_maxrss is KiB on Linux, bytes on macOS.
+            scale = 1 if sys.platform == "darwin" else 1024
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+@dataclass
+class LevelResult:
+    mode: str
+    concurrency: int
+    latencies: list[float]
+    failures: int
+    elapsed: float
+    peak_rss: int
+
+    def row(self) -> str:
+        samples = sorted(self.latencies)
+        books_per_minute = len(samples) / self.elapsed * 60 if self.elapsed else 0.0
+        return (
+            f"| {self.mode} | {self.concurrency} | {len(samples)}/{len(samples) + self.failures} "
+            f"| {books_per_minute:.2f} | {_percentile(samples, 0.50):.1f} s | {_percentile(samples, 0.95):.1f} s "
+            f"| {self.peak_rss / 2**20:.0f} MB |"
+        )
+
+
+def _run_level(
+    mode: str, concurrency: int, books: int, run_book, rss_root: int, exclude: set[int], log: TextIO
+) -> LevelResult:
+    latencies: list[float] = []
+    failures = 0
+    lock = threading.Lock()
+
+    def _one(index: int) -> None:
+        nonlocal failures
+        started = time.perf_counter()
+        try:
+            run_book(f"Bench{mode.title()}{concurrency}x{index}")
+        except Exception as exc:  # noqa: BLE001
+            print(f"Book {index} failed: {exc}")
+            with lock:
+                failures += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    with RssSampler(rss_root, exclude) as sampler, contextlib.redirect_stdout(log):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(_one, range(books)))
+        elapsed = time.perf_counter() - started
+    return LevelResult(mode, concurrency, latencies, failures, elapsed, sampler.peak)
+
+
+def _direct_runner(story: str, preview: bool):
+    from src.generate_story import generate_story
+
+    def _run(child_name: str) -> None:
+        generate_story(story, child_name, use_cache=False, preview=preview)
+
+    return _run
+
+
+def _api_runner(url: str, story: str, preview: bool, timeout: float):
+    def _run(child_name: str) -> None:
+        session = requests.Session()
+        resp = session.post(
+            f"{url}/api/generate",
+            data={"story": story, "child_name": child_name, "preview": "1" if preview else ""},
+            timeout=30,
+        )
+        resp.raise_for_status()
+        status_url = url + resp.json()["status_url"]
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = session.get(status_url, timeout=30).json()
+            if job["state"] == "complete":
+                return
+            if job["state"] == "failed":
+                raise RuntimeError(job.get("error") or "job failed")
+            time.sleep(0.25)
+        raise RuntimeError(f"job did not finish within {timeout:.0f}s")
+
+    return _run
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark whole books against the Leonardo stand-in.")
+    parser.add_argument("--mode", choices=["direct", "api", "both"], default="direct")
+    parser.add_argument("--concurrency", default="1,2,4", help="Comma-separated books in flight")
+    parser.add_argument("--books", type=int, help="Books per level (default: 2 x concurrency)")
+    parser.add_argument("--story", default="dragons", help="Catalog story key")
+    parser.add_argument("--preview", action="store_true", help="Run preview books (smaller images)")
+    parser.add_argument("--rate-limits", action="store_true", help="Keep the LEONARDO_*_RPS limits")
+    parser.add_argument("--backend", default="waitress", choices=["waitress", "gunicorn"], help="api mode")
+    parser.add_argument("--serve-workers", type=int, default=1, help="api mode: gunicorn workers")
+    parser.add_argument("--timeout", type=float, default=1800, help="Seconds per book before giving up")
+    standin = parser.add_argument_group("stand-in")
+    standin.add_argument("--url", help="Use a running stand-in (API base URL) instead of starting one")
+    standin.add_argument("--latency", type=float, default=5.0)
+    standin.add_argument("--jitter", type=float, default=1.0)
+    standin.add_argument("--fail-rate", type=float, default=0.0)
+    standin.add_argument("--error-rate", type=float, default=0.0)
+    standin.add_argument("--throttle-rate", type=float, default=0.0)
+    standin.add_argument("--download-error-rate", type=float, default=0.0)
+    standin.add_argument("--image-size", type=int)
+    args = parser.parse_args(argv)
+    levels = [int(value) for value in args.concurrency.split(",") if value.strip()]
+    modes = ["direct", "api"] if args.mode == "both" else [args.mode]
+
+    with tempfile.TemporaryDirectory(prefix="book_bench_") as tmp:
+        standin_process = None
+        base_url = args.url
+        if base_url is None:
+            port = _free_port()
+            command = [sys.executable, "-m", "src.leonardo_standin", "--port", str(port)]
+            for option in ("latency", "jitter", "fail_rate", "error_rate", "throttle_rate", "download_error_rate"):
+                command += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+            if args.image_size:
+                command += ["--image-size", str(args.image_size)]
+            standin_process = subprocess.Popen(
+                command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            base_url = f"http://127.0.0.1:{port}/api/rest/v1"
+            _wait_until_up(f"http://127.0.0.1:{port}/stats", standin_process)
+
+        # Read at import time by src.*, so set before the first import below.
+        # Never let a bench book touch the real database, cache or output folder.
+        os.environ.update(
+            {
+                "LEONARDO_BASE_URL": base_url,
+                "LEONARDO_API_KEY": "standin",
+                "STORY_DB_PATH": str(Path(tmp) / "app.db"),
+                "STORY_CACHE_DIR": str(Path(tmp) / "cache"),
+                "STORY_OUTPUT_DIR": str(Path(tmp) / "output"),
+            }
+        )
+        tuning = {
+            "LEONARDO_POLL_INTERVAL": "0.5",
+            "LEONARDO_RETRY_BASE_DELAY": "0.2",
+            "STORY_JOB_WORKERS": str(max(levels)),
+        }
+        if not args.rate_limits:
+            tuning.update({f"LEONARDO_{kind}_RPS": "0" for kind in ("SUBMIT", "POLL", "DOWNLOAD")})
+        for key, value in tuning.items():
+            os.environ.setdefault(key, value)
+        # Pipeline output (poll and page logs) goes here instead of the terminal.
+        log_path = Path(tmp) / "bench.log"
+        log = open(log_path, "a", encoding="utf-8")
+
+        exclude = {standin_process.pid} if standin_process else set()
+        results: list[LevelResult] = []
+        try:
+            for mode in modes:
+                server = None
+                if mode == "api":
+                    port = _free_port()
+                    command = [sys.executable, "-m", "src.serve", "--bind", f"127.0.0.1:{port}"]
+                    command += ["--backend", args.backend, "--workers", str(args.serve_workers)]
+                    server = subprocess.Popen(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+                    url = f"http://127.0.0.1:{port}"
+                    _wait_until_up(f"{url}/api/templates", server)
+                    run_book, rss_root = _api_runner(url, args.story, args.preview, args.timeout), server.pid
+                else:
+                    run_book, rss_root = _direct_runner(args.story, args.preview), os.getpid()
+                try:
+                    for concurrency in levels:
+                        books = args.books or 2 * concurrency
+                        print(f"{mode}: {books} book(s), {concurrency} at a time ...", flush=True)
+                        result = _run_level(mode, concurrency, books, run_book, rss_root, exclude, log)
+                        results.append(result)
+                        print(result.row(), flush=True)
+                finally:
+                    if server is not None:
+                        _stop(server)
+            if standin_process is not None:
+                stats = requests.get(base_url.split("/api/")[0] + "/stats", timeout=5).json()
+                print(f"Stand-in: {stats}")
+        finally:
+            if standin_process is not None:
+                _stop(standin_process)
+            if "src.render_pool" in sys.modules:
+                from src.render_pool import shutdown_render_pool
+
+                shutdown_render_pool()
+            log.close()
+            if any(result.failures for result in results):
+                print("Some books failed. Last lines of the pipeline log:")
+                print("".join(log_path.read_text(encoding="utf-8").splitlines(keepends=True)[-20:]))
+
+    print(f"\n{args.story}, latency {args.latency:g}s +/- {args.jitter:g}s, {os.cpu_count()} CPU(s)")
+    print("| Mode | Concurrency | Books ok | Books/min | p50 | p95 | Peak RSS |")
+    print("| --- | --- | --- | --- | --- | --- | --- |")
+    for result in results:
+        print(result.row())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Concurrent throughput benchmark for `src/db.py`.
+
+Runs a mix of auth checks (`get_user_by_token`), story listings and story
+inserts from several threads against a scratch database and prints queries
+per second. `--connect-per-call` closes the thread's connection after every
+query, which approximates the old open/close-per-call behaviour:
+
+    python bench/db_bench.py --threads 8 --seconds 5
+    python bench/db_bench.py --threads 8 --seconds 5 --connect-per-call --no-token-cache
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from src import db
+
+
+def _seed(users: int, stories_per_user: int) -> list[str]:
+    tokens = []
+    for n in range(users):
+        user_id = db.create_user(f"bench{n}@example.com", "secret")
+        tokens.append(db.create_token(user_id))
+        for s in range(stories_per_user):
+            db.save_story_meta(user_id, f"Story {s}", "bench", f"output/{n}_{s}.pdf", 20)
+    return tokens
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark concurrent access to the SQLite layer.")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--stories-per-user", type=int, default=10)
+    parser.add_argument(
+        "--write-ratio", type=float, default=0.05, help="Share of operations that insert a story."
+    )
+    parser.add_argument(
+        "--connect-per-call",
+        action="store_true",
+        help="Close the connection after every query (the old behaviour).",
+    )
+    parser.add_argument(
+        "--no-token-cache", action="store_true", help="Send every auth check to SQLite."
+    )
+    args = parser.parse_args(argv)
+    if args.no_token_cache:
+        db.token_cache.max_entries = 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = Path(tmp) / "bench.db"
+        db.init_db()
+        tokens = _seed(args.users, args.stories_per_user)
+        db.close_connection()
+
+        counts = [0] * args.threads
+        errors: list[str] = []
+        deadline = time.perf_counter() + args.seconds
+
+        def _worker(index: int) -> None:
+            rng = random.Random(index)
+            done = 0
+            try:
+                while time.perf_counter() < deadline:
+                    roll = rng.random()
+                    if roll < args.write_ratio:
+                        user = db.get_user_by_token(rng.choice(tokens))
+                        db.save_story_meta(user["id"], "New story", "bench", "output/new.pdf", 20)
+                    elif roll < 0.25:
+                        db.list_story_meta(rng.randint(1, args.users))
+                    else:
+                        db.get_user_by_token(rng.choice(tokens))
+                    done += 1
+                    if args.connect_per_call:
+                        db.close_connection()
+            except Exception as exc:  # noqa: BLE001
+                errors.append(str(exc))
+            finally:
+                counts[index] = done
+                db.close_connection()
+
+        threads = [threading.Thread(target=_worker, args=(i,)) for i in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    mode = "connect-per-call" if args.connect_per_call else "pooled"
+    if not args.no_token_cache:
+        mode += " + token cache"
+    total = sum(counts)
+    print(f"{mode}: {args.threads} threads, {total} ops in {elapsed:.2f}s = {total / elapsed:,.0f} ops/s")
+    if errors:
+        print(f"{len(errors)} thread(s) failed, first error: {errors[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""HTTP load test for the read-only API endpoints.
+
+Each client thread keeps one keep-alive session and cycles through the paths
+for a fixed duration; the script reports requests per second and latency
+percentiles. Start the server first (`python -m src.serve`), then:
+
+    python bench/load_test.py --url http://127.0.0.1:5000 --concurrency 16 --seconds 15
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import threading
+import time
+
+import requests
+
+DEFAULT_PATHS = ["/api/templates", "/api/models"]
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Load test the storybook API.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--path", action="append", dest="paths", help="Path to request (repeatable)")
+    args = parser.parse_args(argv)
+    paths = args.paths or DEFAULT_PATHS
+
+    latencies: list[list[float]] = [[] for _ in range(args.concurrency)]
+    errors = [0] * args.concurrency
+    deadline = time.perf_counter() + args.seconds
+
+    def _client(index: int) -> None:
+        session = requests.Session()
+        n = index
+        while time.perf_counter() < deadline:
+            url = args.url.rstrip("/") + paths[n % len(paths)]
+            n += 1
+            started = time.perf_counter()
+            try:
+                resp = session.get(url, timeout=30)
+                resp.content
+                ok = resp.status_code == 200
+            except requests.RequestException:
+                ok = False
+            if ok:
+                latencies[index].append(time.perf_counter() - started)
+            else:
+                errors[index] += 1
+        session.close()
+
+    threads = [threading.Thread(target=_client, args=(i,)) for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = sorted(value for per_thread in latencies for value in per_thread)
+    print(f"{args.url} {', '.join(paths)}: {args.concurrency} clients for {elapsed:.1f}s")
+    print(f"  requests : {len(samples)} ok, {sum(errors)} failed")
+    print(f"  throughput: {len(samples) / elapsed:,.0f} req/s")
+    if samples:
+        print(
+            "  latency  : "
+            f"mean {statistics.fmean(samples) * 1000:.1f} ms, "
+            f"p50 {_percentile(samples, 0.50) * 1000:.1f} ms, "
+            f"p95 {_percentile(samples, 0.95) * 1000:.1f} ms, "
+            f"p99 {_percentile(samples, 0.99) * 1000:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,7 @@ from config.models import (
     STORY_VARIANTS,
     STYLE_PRESETS,
 )
+from src.http_session import api_session
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -34,14 +35,6 @@ def load_api_key() -> str:
     )
 
 
-def build_headers(api_key: str) -> Dict[str, str]:
-    return {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "accept": "application/json",
-    }
-
-
 def _parse_json_response(resp: requests.Response, context: str) -> Dict[str, Any]:
     content_type = resp.headers.get("content-type", "")
     if "text/html" in content_type.lower():
@@ -139,19 +132,13 @@ def _resolve_style(character: str, story: str) -> Dict[str, Any]:
 def start_generation(payload: Dict[str, Any]) -> str:
     """Kick off a generation using the provided payload."""
 
-    api_key = load_api_key()
-    headers = build_headers(api_key)
+    session = api_session(load_api_key())
 
     print("POST /generations payload:")
     print(json.dumps(payload, indent=2))
 
     try:
-        resp = requests.post(
-            f"{BASE_URL}/generations",
-            headers=headers,
-            json=payload,
-            timeout=60,
-        )
+        resp = session.post(f"{BASE_URL}/generations", json=payload, timeout=60)
     except requests.exceptions.RequestException as exc:  # noqa: BLE001
         raise RuntimeError(
             "Could not reach Leonardo. Check your internet connection, VPN/proxy, or DNS settings."
@@ -168,14 +155,13 @@ def start_generation(payload: Dict[str, Any]) -> str:
 
 
 def poll_generation(generation_id: str, interval_seconds: int = 5, max_attempts: int = 30) -> Dict[str, Any]:
-    api_key = load_api_key()
-    headers = build_headers(api_key)
+    session = api_session(load_api_key())
     url = f"{BASE_URL}/generations/{generation_id}"
 
     for attempt in range(1, max_attempts + 1):
         time.sleep(interval_seconds)
         try:
-            resp = requests.get(url, headers=headers, timeout=60)
+            resp = session.get(url, timeout=60)
         except requests.exceptions.RequestException as exc:  # noqa: BLE001
             raise RuntimeError(
                 "Could not reach Leonardo while polling. Check connectivity, VPN/proxy, or DNS."
@@ -1,6 +1,11 @@
 const storySelect = document.getElementById("storySelect");
 const modelSelect = document.getElementById("modelSelect");
 const generateBtn = document.getElementById("generateBtn");
+const approveBtn = document.getElementById("approveBtn");
+const previewToggle = document.getElementById("previewToggle");
+const swapRow = document.getElementById("swapRow");
+const swapPageInput = document.getElementById("swapPage");
+const swapBtn = document.getElementById("swapBtn");
 const childNameInput = document.getElementById("childName");
 // const imageInput = document.getElementById("imageInput");
 const logEl = document.getElementById("log");
@@ -8,6 +13,10 @@ const progress = document.getElementById("progress");
 const progressBar = document.getElementById("progressBar");
 
 let templateOptions = [];
+// Status URL of the last finished preview, for the approve button.
+let previewStatusUrl = null;
+// Status URL and label of the last finished book, for page swaps.
+let lastBook = null;
 
 function log(msg) {
   if (logEl) logEl.textContent = msg;
@@ -54,48 +63,178 @@ async function loadTemplates() {
   }
 }
 
-async function generate() {
-  const story = storySelect.value;
-  const childName = childNameInput.value.trim();
-  // const file = imageInput.files[0];
-  if (!story || !childName) {
-    log("Story and child name are required.");
-    return;
+const JOB_POLL_MS = 2000;
+
+function setProgress(fraction) {
+  if (progressBar) progressBar.style.width = `${Math.round(Math.max(0, Math.min(1, fraction)) * 100)}%`;
+}
+
+function sleep(ms) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+function showJobProgress(job) {
+  const total = job.page_count || 0;
+  if (total) setProgress(0.05 + 0.9 * (job.pages_done / total));
+  log(job.state === "queued" ? "Queued..." : `Generating... ${job.pages_done}/${total || "?"} pages`);
+}
+
+async function pollJob(statusUrl) {
+  while (true) {
+    const res = await fetch(statusUrl);
+    const job = await res.json();
+    if (!res.ok) throw new Error(job.error || "Could not load job status");
+    if (job.state === "complete") return job;
+    if (job.state === "failed") throw new Error(job.error || "Generation failed");
+    showJobProgress(job);
+    await sleep(JOB_POLL_MS);
   }
-  const form = new FormData();
-  form.append("story", story);
-  form.append("model", modelSelect ? modelSelect.value : "");
-  form.append("child_name", childName);
+}
+
+function streamJob(statusUrl) {
+  // Live per-page events from the server; falls back to polling if the
+  // stream cannot be opened or drops.
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(`${statusUrl}/events`);
+    const job = { state: "queued", page_count: 0, pages_done: 0, pages: {} };
+    const finish = (fn, value) => {
+      source.close();
+      fn(value);
+    };
+    source.addEventListener("snapshot", (e) => {
+      Object.assign(job, JSON.parse(e.data));
+      if (job.state === "complete") finish(resolve, job);
+      else if (job.state === "failed") finish(reject, new Error(job.error || "Generation failed"));
+      else showJobProgress(job);
+    });
+    source.addEventListener("progress", (e) => {
+      const event = JSON.parse(e.data);
+      if (event.status === "complete") {
+        job.result = event.result;
+        finish(resolve, job);
+        return;
+      }
+      if (event.status === "failed") {
+        finish(reject, new Error(event.error || "Generation failed"));
+        return;
+      }
+      if (event.page_count) job.page_count = event.page_count;
+      if (event.status === "running") job.state = "running";
+      if (event.page && event.status !== "poll") job.pages[event.page] = event.status;
+      job.pages_done = Object.values(job.pages).filter((s) => s === "rendered" || s === "reused").length;
+      showJobProgress(job);
+    });
+    source.onerror = () => finish(resolve, pollJob(statusUrl));
+  });
+}
+
+async function waitForJob(statusUrl) {
+  if (typeof EventSource === "undefined") return pollJob(statusUrl);
+  return streamJob(statusUrl);
+}
+
+async function runJob(request, doneLabel) {
   if (progress) progress.style.display = "block";
-  if (progressBar) progressBar.style.width = "20%";
+  setProgress(0.05);
   generateBtn.disabled = true;
-  log("Generating...");
+  if (approveBtn) approveBtn.style.display = "none";
+  if (swapRow) swapRow.style.display = "none";
+  lastBook = null;
+  log("Submitting...");
   try {
-    const res = await fetch("/api/generate", { method: "POST", body: form });
+    const res = await request();
     const text = await res.text();
     let data = null;
     try {
       data = JSON.parse(text);
     } catch {}
-    if (progressBar) progressBar.style.width = "80%";
-    if (!res.ok) {
+    if (!res.ok || !data) {
       log((data && data.error) || text || "Generation failed");
-    } else {
-      log(`Done! PDF: ${data.pdf}`);
+      return null;
     }
+    const job = await waitForJob(data.status_url);
+    showDownload(job.result, doneLabel);
+    lastBook = { statusUrl: data.status_url, label: doneLabel };
+    if (swapRow) swapRow.style.display = "";
+    return data.status_url;
   } catch (err) {
-    log(`Error: ${err}`);
+    log(`Error: ${err.message || err}`);
+    return null;
   } finally {
-    if (progressBar) progressBar.style.width = "100%";
+    setProgress(1);
     setTimeout(() => {
       if (progress) progress.style.display = "none";
-      if (progressBar) progressBar.style.width = "0%";
+      setProgress(0);
     }, 600);
     generateBtn.disabled = false;
   }
 }
 
+function showDownload(result, label) {
+  if (!logEl) return;
+  logEl.textContent = `${label} `;
+  const link = document.createElement("a");
+  link.href = result.download_url;
+  link.textContent = `Download ${result.pdf}`;
+  logEl.appendChild(link);
+}
+
+async function swapPage() {
+  // Swaps in a candidate Leonardo already made for this page; no new generation.
+  const page = parseInt(swapPageInput ? swapPageInput.value : "", 10);
+  if (!lastBook || !page) {
+    log("Enter the page number to change.");
+    return;
+  }
+  swapBtn.disabled = true;
+  log(`Swapping page ${page}...`);
+  try {
+    const res = await fetch(`${lastBook.statusUrl}/pages/${page}/swap`, { method: "POST" });
+    const data = await res.json();
+    if (!res.ok) {
+      log(data.error || "Could not swap the page");
+      return;
+    }
+    showDownload(data, `${lastBook.label} Page ${page} updated.`);
+  } catch (err) {
+    log(`Error: ${err.message || err}`);
+  } finally {
+    swapBtn.disabled = false;
+  }
+}
+
+async function approve() {
+  if (!previewStatusUrl) return;
+  const url = `${previewStatusUrl}/approve`;
+  previewStatusUrl = null;
+  await runJob(() => fetch(url, { method: "POST" }), "Done! Full-resolution");
+}
+
+async function generate() {
+  const story = storySelect.value;
+  const childName = childNameInput.value.trim();
+  // const file = imageInput.files[0];
+  if (!story || !childName) {
+    log("Story and child name are required.");
+    return;
+  }
+  const form = new FormData();
+  form.append("story", story);
+  form.append("model", modelSelect ? modelSelect.value : "");
+  form.append("child_name", childName);
+  const preview = Boolean(previewToggle && previewToggle.checked);
+  if (preview) form.append("preview", "1");
+  const statusUrl = await runJob(
+    () => fetch("/api/generate", { method: "POST", body: form }),
+    preview ? "Preview ready!" : "Done!"
+  );
+  previewStatusUrl = preview ? statusUrl : null;
+  if (previewStatusUrl && approveBtn) approveBtn.style.display = "";
+}
+
 if (generateBtn) generateBtn.addEventListener("click", generate);
+if (approveBtn) approveBtn.addEventListener("click", approve);
+if (swapBtn) swapBtn.addEventListener("click", swapPage);
 if (childNameInput) {
   childNameInput.addEventListener("input", (event) => {
     renderStoryOptions(event.target.value);
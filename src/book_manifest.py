@@ -0,0 +1,126 @@
+"""Per-book checkpoint manifest.
+
+Each `output/<child>_<story>/manifest.json` records, per page, the prompt and
+model that produced the image, the Leonardo generation ID, the file's SHA-256
+and whether the page is done or failed. `generate_story` consults it so a rerun
+only regenerates missing, failed or changed pages, and `--pdf-only` can rebuild
+the PDF without calling Leonardo at all.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any
+
+MANIFEST_NAME = "manifest.json"
+
+STATUS_PENDING = "pending"
+STATUS_SUBMITTED = "submitted"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BookManifest:
+    """Thread-safe view of one book's `manifest.json`."""
+
+    def __init__(self, output_dir: Path, data: dict[str, Any] | None = None) -> None:
+        self.output_dir = output_dir
+        self.path = output_dir / MANIFEST_NAME
+        self.data: dict[str, Any] = data or {"pages": {}}
+        self.data.setdefault("pages", {})
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, output_dir: Path) -> "BookManifest":
+        try:
+            data = json.loads((output_dir / MANIFEST_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = None
+        return cls(output_dir, data)
+
+    def save(self) -> None:
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        tmp.write_text(json.dumps(self.data, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def update_book(self, **fields: Any) -> None:
+        with self._lock:
+            self.data.update(fields)
+            self.data["updated_at"] = int(time.time())
+            self._save_locked()
+
+    def page(self, number: int) -> dict[str, Any]:
+        with self._lock:
+            return dict(self.data["pages"].get(str(number), {}))
+
+    def update_page(self, number: int, **fields: Any) -> None:
+        with self._lock:
+            entry = self.data["pages"].setdefault(str(number), {})
+            entry.update(fields)
+            entry["updated_at"] = int(time.time())
+            self._save_locked()
+
+    def is_page_done(self, number: int, image_path: Path, prompt: str, model_id: str) -> bool:
+        """Return True when the stored image still matches what we would request."""
+
+        entry = self.page(number)
+        if entry.get("status") != STATUS_DONE:
+            return False
+        if entry.get("prompt") != prompt or entry.get("model_id") != model_id:
+            return False
+        if not image_path.exists():
+            return False
+        return entry.get("sha256") == file_sha256(image_path)
+
+    def mark_submitted(self, number: int, generation_id: str) -> None:
+        self.update_page(number, status=STATUS_SUBMITTED, generation_id=generation_id, error=None)
+
+    def mark_done(
+        self,
+        number: int,
+        image_path: Path,
+        prompt: str,
+        model_id: str,
+        image_url: str | None,
+        seed: int | None = None,
+        sha256: str | None = None,
+    ) -> None:
+        """Record a finished page; pass `sha256` if it is already known."""
+
+        self.update_page(
+            number,
+            status=STATUS_DONE,
+            image=image_path.name,
+            sha256=sha256 or file_sha256(image_path),
+            prompt=prompt,
+            model_id=model_id,
+            image_url=image_url,
+            seed=seed,
+            error=None,
+        )
+
+    def mark_failed(self, number: int, error: str) -> None:
+        self.update_page(number, status=STATUS_FAILED, error=error)
+
+    def pages_with_status(self, status: str) -> list[int]:
+        with self._lock:
+            return sorted(int(n) for n, e in self.data["pages"].items() if e.get("status") == status)
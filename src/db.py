@@ -1,26 +1,84 @@
+"""SQLite storage for users, auth tokens and saved story metadata.
+
+Connections are reused per thread instead of opened per call, so an auth
+check no longer pays connection setup, and sqlite3's per-connection statement
+cache keeps the hot queries prepared. The database runs in WAL mode, so
+readers don't block the writer, with `synchronous=NORMAL`, which is durable
+across application crashes and only fsyncs at checkpoints. Schema changes are
+numbered migrations tracked in `PRAGMA user_version` and applied by `init_db`.
+
+Tokens expire after `TOKEN_TTL_SECONDS`. Successful lookups are kept in a
+small in-process LRU cache for up to `TOKEN_CACHE_SECONDS`, so most
+authenticated requests never touch SQLite. `revoke_token` and `delete_user`
+invalidate the cache in this process. Other server processes may keep
+serving a revoked token for at most `TOKEN_CACHE_SECONDS`. A background
+sweeper (`start_token_sweeper`) deletes expired rows in batches.
+"""
+
 from __future__ import annotations
 
 import hashlib
+import json
+import os
+import re
 import secrets
 import sqlite3
+import threading
 import time
+from collections import OrderedDict
 from pathlib import Path
 from typing import Optional
 
 ROOT = Path(__file__).resolve().parent.parent
-DB_PATH = ROOT / "data" / "app.db"
+DB_PATH = Path(os.getenv("STORY_DB_PATH", str(ROOT / "data" / "app.db")))
+# Seconds a writer waits for the lock before raising "database is locked".
+BUSY_TIMEOUT = float(os.getenv("STORY_DB_BUSY_TIMEOUT", "5"))
+# Lifetime of a login token (default 30 days).
+TOKEN_TTL_SECONDS = int(os.getenv("STORY_TOKEN_TTL", str(30 * 24 * 3600)))
+# How long a successful token lookup is served from memory, and how many.
+TOKEN_CACHE_SECONDS = float(os.getenv("STORY_TOKEN_CACHE_SECONDS", "60"))
+TOKEN_CACHE_SIZE = int(os.getenv("STORY_TOKEN_CACHE_SIZE", "10000"))
+# Expired tokens deleted per statement, and seconds between sweeps.
+TOKEN_SWEEP_BATCH = int(os.getenv("STORY_TOKEN_SWEEP_BATCH", "500"))
+TOKEN_SWEEP_INTERVAL = float(os.getenv("STORY_TOKEN_SWEEP_INTERVAL", "3600"))
 
+_local = threading.local()
 
-def _connect() -> sqlite3.Connection:
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+
+def _open(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
     return conn
 
 
-def init_db() -> None:
-    conn = _connect()
-    cur = conn.cursor()
+def _connect() -> sqlite3.Connection:
+    """Return this thread's connection to `DB_PATH`, opening it on first use."""
+
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == DB_PATH:
+        return conn
+    if conn is not None:
+        close_connection()
+    conn = _open(DB_PATH)
+    _local.conn, _local.path = conn, DB_PATH
+    return conn
+
+
+def close_connection() -> None:
+    """Close the calling thread's connection (e.g. when a worker thread exits)."""
+
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        return
+    _local.conn = None
+    conn.close()
+
+
+def _migration_1(cur: sqlite3.Cursor) -> None:
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS users (
@@ -55,8 +113,214 @@ def init_db() -> None:
         )
         """
     )
-    conn.commit()
-    conn.close()
+
+
+def _migration_2(cur: sqlite3.Cursor) -> None:
+    # Token lookups by user (logout everywhere, cascades) and per-user or
+    # global story listings, newest first.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tokens_user_id ON tokens(user_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stories_user_created ON stories(user_id, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stories_created ON stories(created_at)")
+
+
+def _migration_3(cur: sqlite3.Cursor) -> None:
+    # Tokens issued before expiry existed get the normal lifetime from creation.
+    cur.execute("ALTER TABLE tokens ADD COLUMN expires_at INTEGER")
+    cur.execute("UPDATE tokens SET expires_at = created_at + ?", (TOKEN_TTL_SECONDS,))
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tokens_expires_at ON tokens(expires_at)")
+
+
+def _migration_4(cur: sqlite3.Cursor) -> None:
+    # External-content FTS5 index over story titles and subjects, kept in
+    # sync by triggers (cascaded deletes from `users` fire them too).
+    cur.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts
+        USING fts5(title, subject, content='stories', content_rowid='id')
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS stories_fts_insert AFTER INSERT ON stories BEGIN
+            INSERT INTO stories_fts(rowid, title, subject) VALUES (new.id, new.title, new.subject);
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS stories_fts_delete AFTER DELETE ON stories BEGIN
+            INSERT INTO stories_fts(stories_fts, rowid, title, subject)
+            VALUES ('delete', old.id, old.title, old.subject);
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS stories_fts_update AFTER UPDATE OF title, subject ON stories BEGIN
+            INSERT INTO stories_fts(stories_fts, rowid, title, subject)
+            VALUES ('delete', old.id, old.title, old.subject);
+            INSERT INTO stories_fts(rowid, title, subject) VALUES (new.id, new.title, new.subject);
+        END
+        """
+    )
+    cur.execute("INSERT INTO stories_fts(stories_fts) VALUES ('rebuild')")
+
+
+def _migration_5(cur: sqlite3.Cursor) -> None:
+    # Book jobs, shared by all server worker processes (see src/jobs.py).
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            data TEXT NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, finished_at)")
+
+
+def _migration_6(cur: sqlite3.Cursor) -> None:
+    # Generated-image cache index, shared by all server worker processes
+    # (see src/generation_cache.py). `root` is the cache directory.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS generation_cache (
+            root TEXT NOT NULL,
+            key TEXT NOT NULL,
+            file TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            image_url TEXT NOT NULL DEFAULT '',
+            last_used REAL NOT NULL,
+            PRIMARY KEY (root, key)
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_generation_cache_lru ON generation_cache(root, last_used)")
+
+
+def _migration_7(cur: sqlite3.Cursor) -> None:
+    # One row per book being generated or rebuilt; the primary key makes
+    # taking it atomic across server worker processes (see src/jobs.py).
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS book_locks (
+            book_key TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            owner_pid INTEGER NOT NULL,
+            heartbeat_at REAL NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_book_locks_owner ON book_locks(owner_pid)")
+
+
+def _migration_8(cur: sqlite3.Cursor) -> None:
+    # Leonardo webhook callbacks, relayed to whichever server worker process
+    # is waiting for the generation (see src/webhooks.py).
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            generation_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            received_at REAL NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_webhook_events_received ON webhook_events(received_at)")
+
+
+# Append new migrations; never edit or reorder applied ones.
+MIGRATIONS = [
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+    _migration_6,
+    _migration_7,
+    _migration_8,
+]
+
+
+def init_db() -> None:
+    """Create the schema or migrate it to the latest `user_version`."""
+
+    conn = _connect()
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        # Several server workers may start at once: take the write lock and
+        # re-check the version so each migration runs exactly once.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                conn.rollback()
+                continue
+            migration(conn.cursor())
+            # PRAGMA takes no parameters; `number` is an int we control.
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        print(f"Database migrated to version {number}")
+    conn.execute("PRAGMA optimize")
+
+
+class TokenCache:
+    """Thread-safe LRU of token -> user row with a per-entry deadline."""
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_SECONDS) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, sqlite3.Row]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            deadline, user = entry
+            if deadline <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def put(self, token: str, user: sqlite3.Row, expires_at: float) -> None:
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        deadline = min(time.time() + self.ttl, expires_at)
+        with self._lock:
+            self._entries[token] = (deadline, user)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token: str) -> None:
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            stale = [token for token, (_, user) in self._entries.items() if user["id"] == user_id]
+            for token in stale:
+                del self._entries[token]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+token_cache = TokenCache()
 
 
 def _hash_password(password: str) -> str:
@@ -76,51 +340,126 @@ def _check_password(password: str, stored: str) -> bool:
 
 def create_user(email: str, password: str) -> int:
     conn = _connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO users (email, password_hash, created_at) VALUES (?, ?, ?)",
-        (email, _hash_password(password), int(time.time())),
-    )
-    conn.commit()
-    user_id = cur.lastrowid
-    conn.close()
-    return user_id
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO users (email, password_hash, created_at) VALUES (?, ?, ?)",
+            (email, _hash_password(password), int(time.time())),
+        )
+    return cur.lastrowid
 
 
 def get_user_by_email(email: str) -> Optional[sqlite3.Row]:
-    conn = _connect()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE email = ?", (email,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    return _connect().execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
 
 
 def create_token(user_id: int) -> str:
     token = secrets.token_hex(24)
+    now = int(time.time())
     conn = _connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO tokens (token, user_id, created_at) VALUES (?, ?, ?)",
-        (token, user_id, int(time.time())),
-    )
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(
+            "INSERT INTO tokens (token, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            (token, user_id, now, now + TOKEN_TTL_SECONDS),
+        )
     return token
 
 
 def get_user_by_token(token: str) -> Optional[sqlite3.Row]:
-    conn = _connect()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT users.* FROM tokens JOIN users ON tokens.user_id = users.id WHERE tokens.token = ?",
-        (token,),
-    )
-    row = cur.fetchone()
-    conn.close()
+    """Return the user for a live token, from the cache when possible."""
+
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    row = _connect().execute(
+        """
+        SELECT users.*, tokens.expires_at AS token_expires_at
+        FROM tokens JOIN users ON tokens.user_id = users.id
+        WHERE tokens.token = ? AND tokens.expires_at > ?
+        """,
+        (token, int(time.time())),
+    ).fetchone()
+    if row is None:
+        return None
+    token_cache.put(token, row, row["token_expires_at"])
     return row
 
 
+def revoke_token(token: str) -> None:
+    """Log a token out."""
+
+    token_cache.invalidate(token)
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM tokens WHERE token = ?", (token,))
+
+
+def delete_user(user_id: int) -> None:
+    """Delete a user; their tokens and stories go with them (ON DELETE CASCADE)."""
+
+    token_cache.invalidate_user(user_id)
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+
+
+def sweep_expired_tokens(batch_size: int = TOKEN_SWEEP_BATCH) -> int:
+    """Delete expired tokens in short batches; return how many were removed.
+
+    Each batch is its own transaction, so the write lock is only held briefly
+    and auth lookups in other threads or processes keep flowing.
+    """
+
+    conn = _connect()
+    removed = 0
+    while True:
+        with conn:
+            cur = conn.execute(
+                """
+                DELETE FROM tokens WHERE rowid IN (
+                    SELECT rowid FROM tokens WHERE expires_at <= ? LIMIT ?
+                )
+                """,
+                (int(time.time()), batch_size),
+            )
+        removed += cur.rowcount
+        if cur.rowcount < batch_size:
+            return removed
+
+
+_sweeper: threading.Thread | None = None
+_sweeper_stop = threading.Event()
+
+
+def start_token_sweeper(interval: float = TOKEN_SWEEP_INTERVAL) -> threading.Thread:
+    """Run `sweep_expired_tokens` every `interval` seconds on a daemon thread."""
+
+    global _sweeper
+    if _sweeper is not None and _sweeper.is_alive():
+        return _sweeper
+    _sweeper_stop.clear()
+
+    def _run() -> None:
+        try:
+            while not _sweeper_stop.wait(interval):
+                try:
+                    removed = sweep_expired_tokens()
+                except sqlite3.Error as exc:
+                    print(f"Token sweep failed: {exc}")
+                    continue
+                if removed:
+                    print(f"Swept {removed} expired tokens")
+        finally:
+            close_connection()
+
+    _sweeper = threading.Thread(target=_run, name="token-sweeper", daemon=True)
+    _sweeper.start()
+    return _sweeper
+
+
+def stop_token_sweeper() -> None:
+    _sweeper_stop.set()
+
+
 def authenticate(email: str, password: str) -> Optional[int]:
     user = get_user_by_email(email)
     if not user:
@@ -132,28 +471,331 @@ def authenticate(email: str, password: str) -> Optional[int]:
 
 def save_story_meta(user_id: int, title: str, subject: str | None, path: str, page_count: int) -> None:
     conn = _connect()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO stories (user_id, title, subject, path, page_count, created_at)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        (user_id, title, subject, path, page_count, int(time.time())),
-    )
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO stories (user_id, title, subject, path, page_count, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, title, subject, path, page_count, int(time.time())),
+        )
 
 
-def list_story_meta(user_id: Optional[int] = None) -> list[dict]:
-    conn = _connect()
-    cur = conn.cursor()
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query: every word, as a prefix, must match."""
+
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+
+def _story_filters(user_id: Optional[int], query: Optional[str]) -> tuple[list[str], list]:
+    clauses: list[str] = []
+    params: list = []
     if user_id:
-        cur.execute(
-            "SELECT * FROM stories WHERE user_id = ? ORDER BY created_at DESC",
-            (user_id,),
+        clauses.append("user_id = ?")
+        params.append(user_id)
+    match = _fts_query(query) if query else ""
+    if match:
+        clauses.append("id IN (SELECT rowid FROM stories_fts WHERE stories_fts MATCH ?)")
+        params.append(match)
+    return clauses, params
+
+
+def list_story_meta(
+    user_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    before: Optional[tuple[int, int]] = None,
+    query: Optional[str] = None,
+) -> list[dict]:
+    """Return stories newest first, optionally one page at a time.
+
+    Pagination is keyset-based: pass the `(created_at, id)` of the last row
+    of the previous page as `before`. Each page is then an index range scan
+    on `stories(user_id, created_at)` (or `stories(created_at)`), whatever the
+    page number. `query` filters by title/subject words via the FTS5 index.
+    """
+
+    clauses, params = _story_filters(user_id, query)
+    if before is not None:
+        clauses.append("(created_at, id) < (?, ?)")
+        params.extend(before)
+    sql = "SELECT * FROM stories"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY created_at DESC, id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [dict(row) for row in _connect().execute(sql, params).fetchall()]
+
+
+def count_story_meta(user_id: Optional[int] = None, query: Optional[str] = None) -> int:
+    clauses, params = _story_filters(user_id, query)
+    sql = "SELECT COUNT(*) FROM stories"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    return int(_connect().execute(sql, params).fetchone()[0])
+
+
+def save_job_record(job_id: str, state: str, created_at: float, finished_at: float | None, data: dict) -> None:
+    conn = _connect()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO jobs (id, state, created_at, finished_at, data) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                state = excluded.state, finished_at = excluded.finished_at, data = excluded.data
+            """,
+            (job_id, state, created_at, finished_at, json.dumps(data)),
         )
-    else:
-        cur.execute("SELECT * FROM stories ORDER BY created_at DESC")
-    rows = [dict(row) for row in cur.fetchall()]
-    conn.close()
-    return rows
+
+
+def get_job_record(job_id: str) -> Optional[dict]:
+    row = _connect().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return json.loads(row["data"]) if row else None
+
+
+def trim_job_records(keep: int, finished_states: tuple[str, ...]) -> int:
+    """Delete all but the `keep` most recently finished jobs."""
+
+    placeholders = ", ".join("?" for _ in finished_states)
+    conn = _connect()
+    with conn:
+        cur = conn.execute(
+            f"""
+            DELETE FROM jobs WHERE state IN ({placeholders}) AND id NOT IN (
+                SELECT id FROM jobs WHERE state IN ({placeholders})
+                ORDER BY finished_at DESC LIMIT ?
+            )
+            """,
+            (*finished_states, *finished_states, keep),
+        )
+    return cur.rowcount
+
+
+def acquire_book_lock(
+    book_key: str,
+    holder: str,
+    kind: str,
+    owner_pid: int,
+    stale_before: float,
+    job_data: dict | None = None,
+) -> Optional[sqlite3.Row]:
+    """Take the lock on a book, or return the live lock that holds it.
+
+    A lock whose heartbeat is older than `stale_before` is taken over. With
+    `job_data`, the job row (ID `holder`) is inserted in the same transaction,
+    so whoever finds the lock can also load the job.
+    """
+
+    now = time.time()
+    conn = _connect()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO book_locks (book_key, holder, kind, owner_pid, heartbeat_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(book_key) DO UPDATE SET
+                holder = excluded.holder, kind = excluded.kind,
+                owner_pid = excluded.owner_pid, heartbeat_at = excluded.heartbeat_at
+            WHERE book_locks.heartbeat_at < ?
+            """,
+            (book_key, holder, kind, owner_pid, now, stale_before),
+        )
+        row = conn.execute("SELECT holder, kind FROM book_locks WHERE book_key = ?", (book_key,)).fetchone()
+        if row["holder"] != holder:
+            return row
+        if job_data is not None:
+            conn.execute(
+                "INSERT INTO jobs (id, state, created_at, finished_at, data) VALUES (?, ?, ?, NULL, ?)",
+                (holder, job_data["state"], job_data["created_at"], json.dumps(job_data)),
+            )
+    return None
+
+
+def release_book_lock(book_key: str, holder: str) -> None:
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM book_locks WHERE book_key = ? AND holder = ?", (book_key, holder))
+
+
+def touch_book_locks(owner_pid: int) -> None:
+    """Heartbeat: mark every lock held by a process as still alive."""
+
+    conn = _connect()
+    with conn:
+        conn.execute("UPDATE book_locks SET heartbeat_at = ? WHERE owner_pid = ?", (time.time(), owner_pid))
+
+
+def drop_book_locks(owner_pid: int | None = None) -> int:
+    """Release the locks of a dead process, or all locks when `owner_pid` is None."""
+
+    conn = _connect()
+    with conn:
+        if owner_pid is None:
+            cur = conn.execute("DELETE FROM book_locks")
+        else:
+            cur = conn.execute("DELETE FROM book_locks WHERE owner_pid = ?", (owner_pid,))
+    return cur.rowcount
+
+
+def fail_orphaned_jobs(active_states: tuple[str, ...], state: str, error: str, stale_before: float) -> int:
+    """Fail unfinished jobs whose book lock is gone or has a stale heartbeat."""
+
+    placeholders = ", ".join("?" for _ in active_states)
+    now = time.time()
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM book_locks WHERE heartbeat_at < ?", (stale_before,))
+        cur = conn.execute(
+            f"""
+            UPDATE jobs SET state = ?, finished_at = ?,
+                data = json_set(data, '$.state', ?, '$.error', ?, '$.finished_at', ?)
+            WHERE state IN ({placeholders}) AND id NOT IN (SELECT holder FROM book_locks)
+            """,
+            (state, now, state, error, now, *active_states),
+        )
+    return cur.rowcount
+
+
+def fail_unfinished_jobs(active_states: tuple[str, ...], state: str, error: str) -> int:
+    """Mark jobs left queued/running by a previous server run as failed."""
+
+    placeholders = ", ".join("?" for _ in active_states)
+    conn = _connect()
+    rows = conn.execute(
+        f"SELECT id, data FROM jobs WHERE state IN ({placeholders})", active_states
+    ).fetchall()
+    now = time.time()
+    with conn:
+        for row in rows:
+            data = json.loads(row["data"])
+            data.update(state=state, error=error, finished_at=now)
+            conn.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, data = ? WHERE id = ?",
+                (state, now, json.dumps(data), row["id"]),
+            )
+    return len(rows)
+
+
+def save_webhook_event(generation_id: str, data: dict, keep_since: float) -> None:
+    """Store a callback for another process; drop events received before `keep_since`."""
+
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM webhook_events WHERE received_at < ?", (keep_since,))
+        conn.execute(
+            "INSERT OR REPLACE INTO webhook_events (generation_id, data, received_at) VALUES (?, ?, ?)",
+            (generation_id, json.dumps(data), time.time()),
+        )
+
+
+def pop_webhook_event(generation_id: str) -> Optional[dict]:
+    conn = _connect()
+    row = conn.execute("SELECT data FROM webhook_events WHERE generation_id = ?", (generation_id,)).fetchone()
+    if row is None:
+        return None
+    with conn:
+        conn.execute("DELETE FROM webhook_events WHERE generation_id = ?", (generation_id,))
+    return json.loads(row["data"])
+
+
+def get_cache_entry(root: str, key: str) -> Optional[sqlite3.Row]:
+    return _connect().execute(
+        "SELECT key, file, size, image_url FROM generation_cache WHERE root = ? AND key = ?", (root, key)
+    ).fetchone()
+
+
+def touch_cache_entries(root: str, last_used: dict[str, float]) -> None:
+    """Record when cache entries were last used, in one transaction."""
+
+    conn = _connect()
+    with conn:
+        conn.executemany(
+            "UPDATE generation_cache SET last_used = MAX(last_used, ?) WHERE root = ? AND key = ?",
+            [(used, root, key) for key, used in last_used.items()],
+        )
+
+
+def save_cache_entry(
+    root: str,
+    key: str,
+    file: str,
+    size: int,
+    image_url: str,
+    last_used: float | None = None,
+    replace: bool = True,
+) -> None:
+    """Record a cached image; with `replace=False` an existing row wins."""
+
+    on_conflict = (
+        """DO UPDATE SET
+            file = excluded.file, size = excluded.size,
+            image_url = excluded.image_url, last_used = excluded.last_used"""
+        if replace
+        else "DO NOTHING"
+    )
+    conn = _connect()
+    with conn:
+        conn.execute(
+            f"""
+            INSERT INTO generation_cache (root, key, file, size, image_url, last_used)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(root, key) {on_conflict}
+            """,
+            (root, key, file, size, image_url, time.time() if last_used is None else last_used),
+        )
+
+
+def delete_cache_entries(root: str, keys: list[str]) -> None:
+    conn = _connect()
+    with conn:
+        conn.executemany("DELETE FROM generation_cache WHERE root = ? AND key = ?", [(root, key) for key in keys])
+
+
+def list_cache_entries(root: str) -> list[sqlite3.Row]:
+    return _connect().execute(
+        "SELECT key, file, size FROM generation_cache WHERE root = ?", (root,)
+    ).fetchall()
+
+
+def cache_usage(root: str) -> tuple[int, int]:
+    """(entries, bytes) recorded for a cache directory."""
+
+    row = _connect().execute(
+        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generation_cache WHERE root = ?", (root,)
+    ).fetchone()
+    return int(row[0]), int(row[1])
+
+
+def evict_cache_entries(root: str, max_bytes: int, keep: str | None = None) -> list[str]:
+    """Drop least recently used entries until `root` fits in `max_bytes`.
+
+    Runs under the write lock so concurrent workers agree on what to evict.
+    Returns the file names to delete; `keep` is never evicted.
+    """
+
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        total = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM generation_cache WHERE root = ?", (root,)
+        ).fetchone()[0]
+        evicted: list[sqlite3.Row] = []
+        if total > max_bytes:
+            rows = conn.execute(
+                "SELECT key, file, size FROM generation_cache WHERE root = ? ORDER BY last_used", (root,)
+            ).fetchall()
+            for row in rows:
+                if total <= max_bytes:
+                    break
+                if row["key"] == keep:
+                    continue
+                evicted.append(row)
+                total -= row["size"]
+            conn.executemany(
+                "DELETE FROM generation_cache WHERE root = ? AND key = ?", [(root, row["key"]) for row in evicted]
+            )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return [row["file"] for row in evicted]
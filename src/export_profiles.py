@@ -0,0 +1,130 @@
+"""Export profiles: several PDFs from one pass over the rendered pages.
+
+We ship a web preview, an email-sized PDF and a print PDF. Instead of running
+the pipeline once per product, `BookExporter` takes each rendered page once,
+encodes it per profile (DPI, JPEG quality, max dimension) and streams it into
+one `StreamingPdfWriter` per profile. Profiles that share a size and quality
+share the encoded bytes.
+
+Encoded pages are also kept on disk next to the book. When a page is
+unchanged on a later run (same source image, text and profile), its JPEG bytes
+go into the PDF as-is, with no decode, render or re-encode.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Sequence
+
+from PIL import Image
+
+from src.pdf_writer import StreamingPdfWriter
+
+
+@dataclass(frozen=True)
+class ExportProfile:
+    name: str
+    dpi: float
+    jpeg_quality: int
+    max_dimension: int | None = None
+
+    def target_size(self, width: int, height: int) -> tuple[int, int]:
+        if not self.max_dimension or max(width, height) <= self.max_dimension:
+            return width, height
+        scale = self.max_dimension / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+EXPORT_PROFILES: dict[str, ExportProfile] = {
+    # Full resolution; 1024px pages print at about 6.8 inches.
+    "print": ExportProfile("print", dpi=150, jpeg_quality=90),
+    "email": ExportProfile("email", dpi=150, jpeg_quality=72, max_dimension=1024),
+    "web": ExportProfile("web", dpi=96, jpeg_quality=60, max_dimension=640),
+}
+DEFAULT_EXPORT_PROFILES: tuple[str, ...] = tuple(
+    name.strip()
+    for name in os.getenv("STORY_EXPORT_PROFILES", "print").split(",")
+    if name.strip()
+)
+
+# An encoded page: (jpeg bytes, width, height).
+EncodedPage = tuple[bytes, int, int]
+
+
+def resolve_profiles(names: Iterable[str] | None) -> list[ExportProfile]:
+    names = list(names or DEFAULT_EXPORT_PROFILES)
+    unknown = [name for name in names if name not in EXPORT_PROFILES]
+    if unknown:
+        raise ValueError(f"Unknown export profile(s): {', '.join(unknown)}. Choose from: {list(EXPORT_PROFILES)}")
+    return [EXPORT_PROFILES[name] for name in dict.fromkeys(names)]
+
+
+def profile_pdf_path(base_pdf: Path, profile: ExportProfile) -> Path:
+    """`print` keeps the book's PDF name; other profiles get a suffix."""
+
+    if profile.name == "print":
+        return base_pdf
+    return base_pdf.with_name(f"{base_pdf.stem}_{profile.name}{base_pdf.suffix}")
+
+
+def encode_page(image: Image.Image, profiles: Sequence[ExportProfile]) -> dict[str, EncodedPage]:
+    """Encode a rendered page once per distinct (size, quality) among `profiles`."""
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    by_variant: dict[tuple[int, int, int], EncodedPage] = {}
+    encoded: dict[str, EncodedPage] = {}
+    for profile in profiles:
+        size = profile.target_size(image.width, image.height)
+        variant = (*size, profile.jpeg_quality)
+        if variant not in by_variant:
+            scaled = image if size == image.size else image.resize(size, Image.LANCZOS)
+            buf = io.BytesIO()
+            scaled.save(buf, "JPEG", quality=profile.jpeg_quality, optimize=True)
+            by_variant[variant] = (buf.getvalue(), *size)
+        encoded[profile.name] = by_variant[variant]
+    return encoded
+
+
+class BookExporter:
+    """Fan rendered pages out to one streaming PDF per export profile."""
+
+    def __init__(self, base_pdf: Path, profiles: Sequence[ExportProfile]) -> None:
+        self.profiles = list(profiles)
+        self.paths = {profile.name: profile_pdf_path(base_pdf, profile) for profile in self.profiles}
+        self._writers = {name: StreamingPdfWriter(path) for name, path in self.paths.items()}
+
+    def __enter__(self) -> "BookExporter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add_rendered_page(self, image: Image.Image, order: int) -> dict[str, EncodedPage]:
+        encoded = encode_page(image, self.profiles)
+        self.add_encoded_page(encoded, order)
+        return encoded
+
+    def add_encoded_page(self, encoded: dict[str, EncodedPage], order: int) -> None:
+        """Pass already-encoded JPEG data straight into each profile's PDF."""
+
+        for profile in self.profiles:
+            jpeg, width, height = encoded[profile.name]
+            self._writers[profile.name].add_jpeg_page(
+                jpeg, width, height, order=order, resolution=profile.dpi
+            )
+
+    def close(self) -> dict[str, Path]:
+        for writer in self._writers.values():
+            writer.close()
+        return dict(self.paths)
+
+    def abort(self) -> None:
+        for writer in self._writers.values():
+            writer.abort()
@@ -0,0 +1,159 @@
+"""Batch CLI: generate (or resume) books for one or more `pages_*.json` files.
+
+Progress for every book is checkpointed in its output manifest, so rerunning
+the same command only regenerates missing or failed pages:
+
+    python -m src.generate_book --child-name Anna
+    python -m src.generate_book --child-name Anna --pages data/pages_dragons.json --pdf-only
+"""
+
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+
+from src.generate_story import DEFAULT_ALTERNATES, DEFAULT_MAX_IN_FLIGHT, MAX_ALTERNATES, generate_story
+from src.story_catalog import DATA_DIR, TemplateCatalog, get_catalog
+
+DEFAULT_DATA_DIR = DATA_DIR
+
+
+@dataclass
+class StoryInfo:
+    key: str
+    path: Path
+    page_count: int
+
+
+def derive_story_key(
+    pages_path: Path, override: str | None = None, catalog: TemplateCatalog | None = None
+) -> str:
+    """The catalog key (`dragons_20`), as the web app uses, so both share output and cache.
+
+    Files outside the catalog's data dir fall back to the file name (`dragons`).
+    """
+
+    catalog = catalog or get_catalog()
+    if override:
+        template = catalog.get(override)
+        return template.key if template is not None else override
+    template = catalog.for_path(pages_path)
+    if template is not None:
+        return template.key
+    return pages_path.stem.lower().removeprefix("pages_")
+
+
+def list_story_files(data_dir: Path = DEFAULT_DATA_DIR) -> list[StoryInfo]:
+    """Valid story files in `data_dir` (malformed ones are reported and skipped)."""
+
+    catalog = get_catalog() if data_dir == DEFAULT_DATA_DIR else TemplateCatalog(data_dir)
+    return [
+        StoryInfo(key=t.key, path=t.path, page_count=t.page_count)
+        for t in sorted(catalog.templates(), key=lambda t: t.path)
+    ]
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Generate one or more storybooks.")
+    parser.add_argument("--child-name", help="Child name used in prompts and output names")
+    parser.add_argument("--model-key", help="Model key from config.models")
+    parser.add_argument("--model-id", help="Override Leonardo model id (optional)")
+    parser.add_argument(
+        "--pdf-only",
+        action="store_true",
+        help="Skip image generation and only build the PDF from existing PNGs.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate images even if PNGs already exist.",
+    )
+    parser.add_argument(
+        "--pages",
+        type=Path,
+        nargs="+",
+        default=None,
+        help="Path(s) to the pages JSON file(s). Defaults to all pages_*.json in data/.",
+    )
+    parser.add_argument(
+        "--story-key",
+        help="Override story key for output names. Defaults to the story's catalog key (e.g. dragons_20).",
+    )
+    parser.add_argument("--list", action="store_true", help="List available stories and exit.")
+    parser.add_argument(
+        "--style-prompt",
+        help="Optional style/model look prompt to append to every page prompt.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="append",
+        dest="profiles",
+        help="Export profile (print, email, web); repeat for several PDFs in one pass.",
+    )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="Generate low-resolution proof PDFs; rerun without it for the final books.",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help=f"How many pages to generate concurrently (default: {DEFAULT_MAX_IN_FLIGHT})",
+    )
+    parser.add_argument(
+        "--alternates",
+        type=int,
+        default=DEFAULT_ALTERNATES,
+        help=f"Extra candidate images to keep per page (0-{MAX_ALTERNATES}, default: {DEFAULT_ALTERNATES})",
+    )
+    args = parser.parse_args(argv)
+
+    if args.list:
+        stories = list_story_files()
+        if not stories:
+            print("No story files found in data/")
+        for story in stories:
+            print(f"{story.key:<20} {story.page_count:>3} pages  -> {story.path}")
+        return
+
+    if not args.child_name:
+        parser.error("--child-name is required unless --list is given")
+
+    pages_paths = args.pages or [story.path for story in list_story_files()]
+    if not pages_paths:
+        raise SystemExit("No pages JSON files found. Add pages_*.json to data/ or pass --pages.")
+
+    failures: list[str] = []
+    for pages_path in pages_paths:
+        story_key = derive_story_key(pages_path, args.story_key if len(pages_paths) == 1 else None)
+        print(f"=== Story: {story_key} ===")
+        print(f"Pages file: {pages_path}")
+        try:
+            pdf = generate_story(
+                story_key=story_key,
+                child_name=args.child_name,
+                model_key=args.model_key,
+                model_id=args.model_id,
+                max_in_flight=args.max_in_flight,
+                pages_path=pages_path,
+                style_prompt=args.style_prompt,
+                force=args.force,
+                pdf_only=args.pdf_only,
+                profiles=args.profiles,
+                preview=args.preview,
+                alternates=args.alternates,
+            )
+        except Exception as exc:  # noqa: BLE001
+            print(f"FAILED {story_key}: {exc}")
+            failures.append(story_key)
+            continue
+        print(f"PDF path  : {pdf}")
+
+    if failures:
+        raise SystemExit(f"{len(failures)} book(s) failed: {', '.join(failures)}. Rerun to resume.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,57 @@
 from __future__ import annotations
 
 import argparse
+import contextvars
+import hashlib
 import json
+import os
 import textwrap
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Sequence
+from typing import Any, Sequence
 
 from PIL import Image, ImageDraw, ImageFont
 
-from src.leonardo_client import generate_image_and_download
+from src.book_manifest import STATUS_DONE, BookManifest, file_sha256
+from src.export_profiles import BookExporter, EncodedPage, ExportProfile, resolve_profiles
+from src.leonardo_client import fetch_image, generate_image_and_download
+from src.metrics import STORY_BOOK_SECONDS, STORY_PAGES, STORY_STAGE_SECONDS, start_book_log
+from src.progress_events import bus, current_page, current_topic
+from src.render_pool import RENDER_QUEUE_DEPTH, submit_render
+from src.retry_policy import PAGE_POLICY, GenerationFailedError
+from src.story_catalog import default_title, get_catalog, template_name
+from src import text_layout
 from config.models import MODELS
 
 ROOT = Path(__file__).resolve().parent.parent
-
-STORY_TEMPLATES = {
-    "dragons_20": {
-        "title": "Dragon Valley Adventures",
-        "json_path": ROOT / "data" / "pages_dragons.json",
-    },
-    "vacation_20": {
-        "title": "Vacation Adventures",
-        "json_path": ROOT / "data" / "pages_vacation.json",
-    },
-}
+# Book folders and PDFs; the web app only serves files from here.
+OUTPUT_DIR = Path(os.getenv("STORY_OUTPUT_DIR") or ROOT / "output")
 
 DEFAULT_MODEL_KEY = next(iter(MODELS.keys())) if MODELS else None
 DEFAULT_MODEL_ID = "6bef9f1b-29cb-40c7-b9df-32b51c1f67d3"  # Platform model from Leonardo Getting Started example
 STYLE_HINT = "light-skinned girl with blond hair in a pink princess dress, holding a rose, castle softly blurred in the background"
 NEGATIVE_PROMPT = "text, logo, watermark, nsfw, blood, gore, creepy, scary, low quality"
+# How many page generations may be in flight at once. Each one is mostly
+# waiting on Leonardo, so a handful of threads is enough to overlap them.
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("STORY_MAX_IN_FLIGHT", "4"))
+# Image size (px) requested for preview proofs; finals are 1024.
+PREVIEW_SIZE = int(os.getenv("STORY_PREVIEW_SIZE", "512"))
+# Extra candidates requested per page (num_images - 1) and kept for "swap
+# this page"; 0 turns alternates off. Leonardo allows up to 4 images per call.
+DEFAULT_ALTERNATES = int(os.getenv("STORY_ALTERNATES", "0"))
+MAX_ALTERNATES = 3
+# Export profile(s) used for the proof PDF unless `profiles` is given.
+PREVIEW_PROFILES = ("web",)
+# Bump when `render_page_with_text` output changes so cached page JPEGs in
+# `<output_dir>/rendered/` are re-rendered instead of passed through.
+RENDER_VERSION = 2
 
 
 def load_pages(path: Path) -> list[dict]:
-    with open(path, "r", encoding="utf-8") as f:
-        pages = json.load(f)
-    pages = sorted(pages, key=lambda p: p["page"])
-    return pages
+    """Validated pages sorted by number, cached until the file changes."""
+
+    return get_catalog().pages_for(path)
 
 
 def build_page_prompt(child_name: str, scene: str, style_hint: str = STYLE_HINT) -> str:
@@ -46,8 +63,38 @@ def build_page_prompt(child_name: str, scene: str, style_hint: str = STYLE_HINT)
     )
 
 
+def page_seed(story_key: str, child_name: str, page_number: int) -> int:
+    """Deterministic Leonardo seed for a page, shared by the preview and final."""
+
+    digest = hashlib.sha256(f"{story_key}:{child_name.lower()}:{page_number}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") % 2**31
+
+
+def swap_in_alternate(manifest: BookManifest, number: int, image_path: Path) -> int:
+    """Make the page's next stored alternate its image; return alternates left.
+
+    The replaced image goes to the back of the list, so repeated swaps cycle
+    through every candidate. Raises ValueError when the page has none.
+    """
+
+    entry = manifest.page(number)
+    alternates = list(entry.get("alternates") or [])
+    alt_path = image_path.parent / "alternates" / alternates[0]["file"] if alternates else None
+    if entry.get("status") != STATUS_DONE or alt_path is None or not alt_path.exists() or not image_path.exists():
+        raise ValueError(f"Page {number} has no alternate images to swap in")
+    alternate = alternates.pop(0)
+    held = alt_path.with_suffix(".swap")
+    os.replace(image_path, held)
+    os.replace(alt_path, image_path)
+    os.replace(held, alt_path)
+    alternates.append({"file": alternate["file"], "image_url": entry.get("image_url"), "sha256": entry["sha256"]})
+    manifest.update_page(
+        number, image_url=alternate["image_url"], sha256=alternate["sha256"], alternates=alternates
+    )
+    return len(alternates)
+
+
 def render_page_with_text(image: Image.Image, text: str, title: str | None = None) -> Image.Image:
-    font_main = _get_font(28)
     font_title = _get_font(22)
     padding = 24
     panel_height = int(image.height * 0.26)
@@ -64,39 +111,31 @@ def render_page_with_text(image: Image.Image, text: str, title: str | None = Non
     y = padding
     if title:
         draw.text((padding, y), title, font=font_title, fill=(62, 82, 120))
-        y += font_title.getbbox("Ag")[3] - font_title.getbbox("Ag")[1] + 8
+        y += text_layout.line_height(22) + 8
 
-    max_width = image.width - padding * 2
-    lines = wrap_text(text, font_main, max_width)
-    for line in lines:
+    # Largest font size (up to 28px) whose wrapped text fits the panel.
+    block = text_layout.fit_text(text, image.width - padding * 2, panel_height - y - padding)
+    font_main = _get_font(block.font_size)
+    for line in block.lines:
         draw.text((padding, y), line, font=font_main, fill=(30, 41, 59))
-        y += font_main.getbbox("Ag")[3] - font_main.getbbox("Ag")[1] + 6
+        y += block.line_height + text_layout.LINE_SPACING
 
     canvas.paste(panel, (0, illu_height))
     return canvas
 
 
 def wrap_text(text: str, font: ImageFont.ImageFont, max_width: int) -> list[str]:
-    words = text.split()
-    lines: list[str] = []
-    line: list[str] = []
-    for word in words:
-        test = " ".join(line + [word])
-        if font.getlength(test) <= max_width:
-            line.append(word)
-        else:
-            lines.append(" ".join(line))
-            line = [word]
-    if line:
-        lines.append(" ".join(line))
-    return lines
+    """Wrap `text` to `max_width` using `font` (see `text_layout.wrap_words`)."""
+
+    size = getattr(font, "size", None)
+    if size is not None and font is text_layout.get_font(size):
+        return text_layout.wrap_words(text, size, max_width)
+    # Fonts not loaded through the layout cache are measured directly.
+    return text_layout.wrap_measured(text, font.getlength, max_width)
 
 
 def _get_font(size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
-    try:
-        return ImageFont.truetype("arial.ttf", size)
-    except OSError:
-        return ImageFont.load_default()
+    return text_layout.get_font(size)
 
 
 def _choose_model_id(candidate: str | Sequence[str] | None) -> str | None:
@@ -126,10 +165,118 @@ def generate_story(
     model_key: str | None = None,
     model_id: str | None = None,
     output_dir: Path | None = None,
+    max_in_flight: int | None = None,
+    use_cache: bool = True,
+    pages_path: Path | None = None,
+    title: str | None = None,
+    style_prompt: str | None = None,
+    force: bool = False,
+    pdf_only: bool = False,
+    book_id: str | None = None,
+    profiles: Sequence[str] | None = None,
+    preview: bool = False,
+    alternates: int | None = None,
+    swap_pages: Sequence[int] = (),
+) -> Path:
+    """Generate (or resume) a book and return the PDF path.
+
+    Progress is checkpointed in `<output_dir>/manifest.json`: pages whose image
+    still matches the recorded prompt, model and hash are reused, so a rerun
+    after a failure only regenerates the missing or failed pages. `force`
+    regenerates everything; `pdf_only` rebuilds the PDF from existing images
+    without calling Leonardo. `pages_path` allows any `pages_*.json` that is
+    not in the `data/` template catalog. With `book_id`, progress events
+    (`{"page": n, "status": ...}`) are published to that topic on
+    `progress_events.bus`.
+
+    One PDF is written per export profile (`profiles`, default from
+    `STORY_EXPORT_PROFILES`); the path of the first one is returned.
+
+    Transient Leonardo errors are retried per page (`retry_policy`). A page
+    that runs out of retries fails the book only after the other pages have
+    finished and been checkpointed.
+
+    `preview` requests small `PREVIEW_SIZE` images and writes a light
+    `*_preview.pdf` proof, checkpointed separately under `<output_dir>/preview`.
+    Every page uses the same prompt and `page_seed` in both tiers, so the
+    full-resolution run after approval keeps the look of the proof.
+
+    `alternates` (default `STORY_ALTERNATES`) asks Leonardo for that many
+    extra candidates per page in the same generation and keeps them under
+    `<output_dir>/alternates`. `swap_pages` then swaps the next candidate into
+    each listed page and rebuilds the PDF without calling Leonardo; only the
+    swapped pages are re-rendered.
+    """
+
+    # The book runs in its own context, so the topic, page and metrics log set
+    # for it don't leak into the caller.
+    context = contextvars.copy_context()
+    context.run(current_topic.set, book_id)
+    started = time.perf_counter()
+    outcome = "failed"
+    try:
+        pdf = context.run(
+            _generate_story,
+            story_key=story_key,
+            child_name=child_name,
+            model_key=model_key,
+            model_id=model_id,
+            output_dir=output_dir,
+            max_in_flight=max_in_flight,
+            use_cache=use_cache,
+            pages_path=pages_path,
+            title=title,
+            style_prompt=style_prompt,
+            force=force,
+            pdf_only=pdf_only,
+            book_id=book_id,
+            profiles=profiles,
+            preview=preview,
+            alternates=alternates,
+            swap_pages=swap_pages,
+        )
+        outcome = "complete"
+        return pdf
+    finally:
+        if not pdf_only and not swap_pages:
+            tier = "preview" if preview else "final"
+            context.run(
+                STORY_BOOK_SECONDS.observe, time.perf_counter() - started, tier=tier, outcome=outcome
+            )
+
+
+def _generate_story(
+    story_key: str,
+    child_name: str,
+    model_key: str | None,
+    model_id: str | None,
+    output_dir: Path | None,
+    max_in_flight: int | None,
+    use_cache: bool,
+    pages_path: Path | None,
+    title: str | None,
+    style_prompt: str | None,
+    force: bool,
+    pdf_only: bool,
+    book_id: str | None,
+    profiles: Sequence[str] | None,
+    preview: bool,
+    alternates: int | None,
+    swap_pages: Sequence[int],
 ) -> Path:
-    if story_key not in STORY_TEMPLATES:
-        raise ValueError(f"Unknown story key: {story_key}")
-    story = STORY_TEMPLATES[story_key]
+    def _emit(**event: Any) -> None:
+        if book_id is not None:
+            bus.publish(book_id, event)
+
+    if pages_path is None:
+        template = get_catalog().get(story_key)
+        if template is None:
+            raise ValueError(f"Unknown story key: {story_key}")
+        # "dragons" and "dragons_20" are the same book: one folder, one manifest.
+        story_key = template.key
+        pages_path = template.path
+        title = title or template.title
+    title = title or default_title(template_name(pages_path))
     # Resolve model config
     model_cfg = None
     if model_key and model_key in MODELS:
@@ -149,36 +296,270 @@ def generate_story(
     if not resolved_model_id or "<" in resolved_model_id or resolved_model_id.strip() == "":
         raise ValueError("No valid model_id set. Update config/models.py with your trained model ID.")
     style_hint = model_cfg.get("style_hint", STYLE_HINT)
-    title = story["title"]
-    pages = load_pages(story["json_path"])
-    output_dir = output_dir or (ROOT / "output" / f"{child_name.lower()}_{story_key}")
+    if preview and profiles is None:
+        profiles = PREVIEW_PROFILES
+    export_profiles = resolve_profiles(profiles)
+    alternates = DEFAULT_ALTERNATES if alternates is None else alternates
+    if not 0 <= alternates <= MAX_ALTERNATES:
+        raise ValueError(f"alternates must be between 0 and {MAX_ALTERNATES}")
+    pages = load_pages(pages_path)
+    output_dir = output_dir or (OUTPUT_DIR / f"{child_name.lower()}_{story_key}")
+    pdf_name = f"{child_name}_{title.replace(' ', '_')}"
+    image_size = 1024
+    if preview:
+        # Proofs never overwrite (or count as) final pages.
+        output_dir = output_dir / "preview"
+        pdf_name += "_preview"
+        image_size = PREVIEW_SIZE
     output_dir.mkdir(parents=True, exist_ok=True)
-    pdf_path = ROOT / "output" / f"{child_name}_{title.replace(' ', '_')}.pdf"
+    pdf_path = OUTPUT_DIR / f"{pdf_name}.pdf"
+    start_book_log(output_dir, book_id or pdf_name)
+
+    manifest = BookManifest.load(output_dir)
+    if swap_pages:
+        numbers = {page["page"] for page in pages}
+        for number in swap_pages:
+            if number not in numbers:
+                raise ValueError(f"{story_key} has no page {number}")
+            left = swap_in_alternate(manifest, number, output_dir / f"page_{number:02d}.png")
+            print(f"Page {number}: swapped in an alternate ({left} stored)")
+        pdf_only = True
+    manifest.update_book(
+        story_key=story_key,
+        child_name=child_name,
+        title=title,
+        pages_path=str(pages_path),
+        model_id=resolved_model_id,
+        page_count=len(pages),
+        status="running",
+        tier="preview" if preview else "final",
+    )
+    _emit(status="started", page_count=len(pages), preview=preview)
+
+    def _page_image(page: dict) -> Path:
+        return output_dir / f"page_{page['page']:02d}.png"
 
-    rendered_pages: list[Image.Image] = []
-    for page in pages:
+    def _page_prompt(page: dict) -> str:
         prompt = build_page_prompt(child_name, page["scene"], style_hint=style_hint)
-        out_img = output_dir / f"page_{page['page']:02d}.png"
-        generate_image_and_download(
-            prompt=prompt,
-            model_id=resolved_model_id,
-            out_path=out_img,
-            width=1024,
-            height=1024,
-            negative_prompt=NEGATIVE_PROMPT,
-            element_id=element_id,
-            dataset_id=dataset_id,
+        if style_prompt:
+            prompt = f"{prompt} Style notes: {style_prompt}."
+        return prompt
+
+    def _on_submitted(number: int, generation_id: str) -> None:
+        manifest.mark_submitted(number, generation_id)
+        _emit(page=number, status="submitted", generation_id=generation_id)
+
+    alternates_dir = output_dir / "alternates"
+
+    def _store_alternates(number: int, urls: list[str]) -> None:
+        # Prefetched now so a later swap needs no network at all. A candidate
+        # that fails to download is just skipped; the page itself is fine.
+        stored = []
+        for index, url in enumerate(urls[:alternates], start=1):
+            name = f"page_{number:02d}_alt{index}.png"
+            try:
+                sha256, _ = fetch_image(url, alternates_dir / name)
+            except RuntimeError as exc:
+                print(f"Page {number}: skipping alternate {index}: {exc}")
+                continue
+            stored.append({"file": name, "image_url": url, "sha256": sha256})
+        manifest.update_page(number, alternates=stored)
+
+    def _generate_page(page: dict) -> Path | bytes:
+        """Generate one page; return its image bytes, or its path on a cache hit."""
+
+        number = page["page"]
+        current_page.set(number)
+        prompt = _page_prompt(page)
+        seed = page_seed(story_key, child_name, number)
+        out_img = _page_image(page)
+        found: list[str] = []
+        downloaded: dict[str, Any] = {}
+
+        def _on_downloaded(sha256: str, body: bytes) -> None:
+            downloaded.update(sha256=sha256, body=body)
+
+        def _attempt() -> tuple[Path, str]:
+            found.clear()
+            downloaded.clear()
+            return generate_image_and_download(
+                prompt=prompt,
+                model_id=resolved_model_id,
+                out_path=out_img,
+                width=image_size,
+                height=image_size,
+                num_images=1 + alternates,
+                negative_prompt=NEGATIVE_PROMPT,
+                element_id=element_id,
+                dataset_id=dataset_id,
+                seed=seed,
+                use_cache=use_cache,
+                on_submitted=lambda generation_id: _on_submitted(number, generation_id),
+                on_alternates=found.extend if alternates else None,
+                on_downloaded=_on_downloaded,
+            )
+
+        try:
+            # Requests inside retry on their own (same URL, same generation ID);
+            # a new, paid generation is only started when Leonardo failed one.
+            _, image_url = PAGE_POLICY.call("generation", _attempt, retry_on=GenerationFailedError)
+        except Exception as exc:
+            manifest.mark_failed(number, str(exc))
+            STORY_PAGES.inc(status="failed")
+            _emit(page=number, status="failed", error=str(exc))
+            raise
+        manifest.mark_done(
+            number, out_img, prompt, resolved_model_id, image_url, seed=seed, sha256=downloaded.get("sha256")
         )
-        img = Image.open(out_img).convert("RGB")
-        page_img = render_page_with_text(img, page["text"], title=f"Page {page['page']}")
-        rendered_pages.append(page_img)
-
-    if not rendered_pages:
-        raise RuntimeError("No pages rendered")
-    first, *rest = rendered_pages
-    pdf_path.parent.mkdir(parents=True, exist_ok=True)
-    first.save(pdf_path, save_all=True, append_images=rest)
-    return pdf_path
+        _store_alternates(number, found)
+        STORY_PAGES.inc(status="generated")
+        _emit(page=number, status="downloaded")
+        return downloaded.get("body") or out_img
+
+    rendered_dir = output_dir / "rendered"
+
+    def _render_key(page: dict, source_sha: str, profile: ExportProfile) -> str:
+        parts = [RENDER_VERSION, source_sha, page["text"], page["page"], profile.jpeg_quality, profile.max_dimension]
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def _cached_renders(page: dict, source_sha: str) -> dict[str, EncodedPage] | None:
+        renders = manifest.page(page["page"]).get("renders") or {}
+        cached: dict[str, EncodedPage] = {}
+        for profile in export_profiles:
+            meta = renders.get(profile.name)
+            if not meta or meta.get("key") != _render_key(page, source_sha, profile):
+                return None
+            path = rendered_dir / meta["file"]
+            if not path.exists():
+                return None
+            cached[profile.name] = (path.read_bytes(), meta["width"], meta["height"])
+        return cached
+
+    def _source_sha(page: dict, image_path: Path) -> str:
+        entry = manifest.page(page["page"])
+        return entry["sha256"] if entry.get("status") == STATUS_DONE else file_sha256(image_path)
+
+    def _write_rendered(page: dict, source_sha: str, encoded: dict[str, EncodedPage], exporter: BookExporter) -> None:
+        """Write stage: stream a rendered page into the PDFs and keep its JPEGs."""
+
+        number = page["page"]
+        current_page.set(number)
+        with STORY_STAGE_SECONDS.time(stage="write"):
+            exporter.add_encoded_page(encoded, order=number)
+        rendered_dir.mkdir(parents=True, exist_ok=True)
+        renders = dict(manifest.page(number).get("renders") or {})
+        for profile in export_profiles:
+            jpeg, width, height = encoded[profile.name]
+            name = f"page_{number:02d}_{profile.name}.jpg"
+            (rendered_dir / name).write_bytes(jpeg)
+            renders[profile.name] = {
+                "file": name,
+                "key": _render_key(page, source_sha, profile),
+                "width": width,
+                "height": height,
+            }
+        manifest.update_page(number, renders=renders)
+        _emit(page=number, status="rendered")
+
+    if pdf_only:
+        missing = [page["page"] for page in pages if not _page_image(page).exists()]
+        if missing:
+            raise RuntimeError(
+                f"Missing images for pages: {', '.join(map(str, missing))}. "
+                "Run without --pdf-only to generate them."
+            )
+        todo: list[dict] = []
+    else:
+        todo = [
+            page
+            for page in pages
+            if force
+            or not manifest.is_page_done(
+                page["page"], _page_image(page), _page_prompt(page), resolved_model_id
+            )
+        ]
+    if todo and len(todo) < len(pages):
+        print(f"Resuming {story_key}: {len(pages) - len(todo)} pages reused, {len(todo)} to generate")
+
+    # The book runs as a pipeline: generate+download on a thread pool (up to
+    # `max_in_flight` pages), render on the shared process pool, and write on
+    # this thread as renders finish. At most RENDER_QUEUE_DEPTH renders are
+    # outstanding, which bounds the encoded pages held in memory. The writers
+    # order the page tree by `page` number, so pages may finish in any order.
+    # A page that still fails after its retries doesn't stop the others: they
+    # finish and are checkpointed, and the book fails once nothing is left.
+    workers = max(1, max_in_flight or DEFAULT_MAX_IN_FLIGHT)
+    rendering: dict[Future, tuple[dict, str]] = {}
+    failed: dict[int, Exception] = {}
+
+    def _finish_renders(futures: set[Future], exporter: BookExporter) -> None:
+        for future in futures:
+            page, source_sha = rendering.pop(future)
+            _write_rendered(page, source_sha, future.result(), exporter)
+
+    def _start_render(page: dict, image: Path | bytes, exporter: BookExporter) -> None:
+        # `image` is the page's file, or its bytes straight from the download.
+        current_page.set(page["page"])
+        source_sha = _source_sha(page, _page_image(page))
+        cached = None if force else _cached_renders(page, source_sha)
+        if cached is not None:
+            # Unchanged page: its JPEG bytes go into the PDFs untouched.
+            with STORY_STAGE_SECONDS.time(stage="write"):
+                exporter.add_encoded_page(cached, order=page["page"])
+            return
+        while len(rendering) >= RENDER_QUEUE_DEPTH:
+            done, _ = wait(rendering, return_when=FIRST_COMPLETED)
+            _finish_renders(done, exporter)
+        future = submit_render(
+            image, page["text"], f"Page {page['page']}", export_profiles, page_size=1024
+        )
+        rendering[future] = (page, source_sha)
+
+    with BookExporter(pdf_path, export_profiles) as exporter, ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="story-page"
+    ) as pool:
+        # Each page runs in a copy of this context so `poll_generation` can
+        # publish to the book's topic from the worker thread.
+        pending: dict[Future, dict] = {
+            pool.submit(contextvars.copy_context().run, _generate_page, page): page for page in todo
+        }
+        # Reused pages render while the new ones are still generating.
+        todo_numbers = {page["page"] for page in todo}
+        for page in pages:
+            if page["page"] not in todo_numbers:
+                _start_render(page, _page_image(page), exporter)
+                STORY_PAGES.inc(status="reused")
+                _emit(page=page["page"], status="reused")
+        while pending or rendering:
+            done, _ = wait([*pending, *rendering], return_when=FIRST_COMPLETED)
+            _finish_renders({future for future in done if future in rendering}, exporter)
+            for future in done:
+                if future not in pending:
+                    continue
+                page = pending.pop(future)
+                try:
+                    image = future.result()
+                except Exception as exc:
+                    failed[page["page"]] = exc
+                    continue
+                # Still rendered after a failure: the rerun reuses the JPEGs.
+                _start_render(page, image, exporter)
+        if failed:
+            numbers = sorted(failed)
+            first = failed[numbers[0]]
+            error = f"Page {numbers[0]} failed: {first}"
+            if len(numbers) > 1:
+                error = f"Pages {', '.join(map(str, numbers))} failed; page {numbers[0]}: {first}"
+            manifest.update_book(status="failed", error=error, failed_pages=numbers)
+            raise RuntimeError(
+                f"{error}. Finished pages are kept in {manifest.path}; rerun to resume."
+            ) from first
+
+    pdf_paths = {name: str(path) for name, path in exporter.paths.items()}
+    primary = exporter.paths[export_profiles[0].name]
+    manifest.update_book(status="complete", pdf=str(primary), pdfs=pdf_paths, error=None, failed_pages=[])
+    _emit(status="pdf_written", pdf=str(primary), pdfs=pdf_paths)
+    return primary
 
 
 def main():
@@ -188,6 +569,46 @@ def main():
     # parser.add_argument("--image-path", required=True, type=Path, help="Path to child photo")
     parser.add_argument("--model-key", help="Model key from config.models")
     parser.add_argument("--model-id", help="Override Leonardo model id (optional)")
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help=f"How many pages to generate concurrently (default: {DEFAULT_MAX_IN_FLIGHT})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always call Leonardo, even if an identical page was generated before.",
+    )
+    parser.add_argument("--force", action="store_true", help="Regenerate pages even if they are done.")
+    parser.add_argument(
+        "--profile",
+        action="append",
+        dest="profiles",
+        help="Export profile (print, email, web); repeat for several PDFs in one pass.",
+    )
+    parser.add_argument(
+        "--pdf-only", action="store_true", help="Rebuild the PDF from existing images only."
+    )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="Generate a low-resolution proof PDF; rerun without it for the final book.",
+    )
+    parser.add_argument(
+        "--alternates",
+        type=int,
+        default=DEFAULT_ALTERNATES,
+        help=f"Extra candidate images to keep per page (0-{MAX_ALTERNATES}, default: {DEFAULT_ALTERNATES})",
+    )
+    parser.add_argument(
+        "--swap-page",
+        type=int,
+        action="append",
+        dest="swap_pages",
+        default=[],
+        help="Swap a stored alternate into this page and rebuild the PDF offline (repeatable).",
+    )
     args = parser.parse_args()
     pdf = generate_story(
         story_key=args.story,
@@ -195,6 +616,14 @@ def main():
         # child_image_path=args.image_path,
         model_key=args.model_key,
         model_id=args.model_id,
+        max_in_flight=args.max_in_flight,
+        use_cache=not args.no_cache,
+        force=args.force,
+        pdf_only=args.pdf_only,
+        profiles=args.profiles,
+        preview=args.preview,
+        alternates=args.alternates,
+        swap_pages=args.swap_pages,
     )
     print(f"Saved PDF: {pdf}")
 
@@ -0,0 +1,253 @@
+"""On-disk cache of generated images keyed by the full `/generations` payload.
+
+Rerunning a book for the same child, template and model sends byte-identical
+payloads (prompt, modelId, size, negative prompt, elements), so the image we
+already paid for can be reused. Images live in `data/cache/generations/`;
+the index (size and last use per entry) is the `generation_cache` table in
+the app database, so every server worker sees and trims the same cache to
+`STORY_CACHE_MAX_MB`. Files found on disk without an index row (from a crash
+or the old `index.json`) are adopted at startup so they count toward the cap.
+Concurrent requests for the same payload in one process share a single
+Leonardo generation.
+
+Lookups only read the index. Hits are written back as `last_used` in
+batches (every `TOUCH_FLUSH_SECONDS`, or before evicting), so a cache probe
+never waits on a SQLite write.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable
+
+from src import db
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CACHE_DIR = Path(os.getenv("STORY_CACHE_DIR") or ROOT / "data" / "cache" / "generations")
+CACHE_MAX_BYTES = int(float(os.getenv("STORY_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+# Temp files older than this are leftovers of a crashed write.
+STALE_TEMP_SECONDS = 3600
+# Cache hits are saved as `last_used` this often, or once this many pile up.
+TOUCH_FLUSH_SECONDS = 30.0
+TOUCH_BATCH = 64
+
+
+def payload_key(payload: dict[str, Any]) -> str:
+    """Return a stable SHA-256 of a generation payload."""
+
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """Size-bounded LRU cache of generated images with request coalescing."""
+
+    def __init__(self, root: Path = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, Future] = {}
+        self._counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+        # Hits not yet written to the index: key -> time of use.
+        self._touched: dict[str, float] = {}
+        self._touched_flushed = time.monotonic()
+        self._root_key = str(root.resolve())
+        db.init_db()
+        self._reconcile()
+
+    def _reconcile(self) -> None:
+        """Match the index to the directory: drop rows without files, adopt stray files."""
+
+        legacy = self.root / "index.json"
+        try:
+            entries = json.loads(legacy.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            entries = []
+        for entry in entries:
+            if (self.root / entry["file"]).exists():
+                db.save_cache_entry(
+                    self._root_key,
+                    entry["key"],
+                    entry["file"],
+                    entry["size"],
+                    entry.get("image_url", ""),
+                    entry.get("last_used", 0),
+                )
+        legacy.unlink(missing_ok=True)
+
+        indexed = {row["file"]: row["key"] for row in db.list_cache_entries(self._root_key)}
+        on_disk: dict[str, os.stat_result] = {}
+        if self.root.is_dir():
+            now = time.time()
+            for path in self.root.iterdir():
+                if not path.is_file():
+                    continue
+                stat = path.stat()
+                if path.name.endswith(".tmp") or path.name.startswith("."):
+                    if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                        path.unlink(missing_ok=True)
+                    continue
+                on_disk[path.name] = stat
+        db.delete_cache_entries(self._root_key, [key for name, key in indexed.items() if name not in on_disk])
+        for name, stat in on_disk.items():
+            if name not in indexed:
+                # Unknown URL; the oldest use time makes it the first to go.
+                db.save_cache_entry(
+                    self._root_key, Path(name).stem, name, stat.st_size, "", stat.st_mtime, replace=False
+                )
+        self._evict()
+
+    def _touch(self, key: str) -> None:
+        with self._lock:
+            self._touched[key] = time.time()
+            due = (
+                len(self._touched) >= TOUCH_BATCH
+                or time.monotonic() - self._touched_flushed >= TOUCH_FLUSH_SECONDS
+            )
+        if due:
+            self._flush_touches()
+
+    def _flush_touches(self) -> None:
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touched_flushed = time.monotonic()
+        if touched:
+            db.touch_cache_entries(self._root_key, touched)
+
+    def _evict(self, keep: str | None = None) -> None:
+        # This process's recent hits must count before anything is evicted.
+        self._flush_touches()
+        for name in db.evict_cache_entries(self._root_key, self.max_bytes, keep):
+            (self.root / name).unlink(missing_ok=True)
+            with self._lock:
+                self._counters["evictions"] += 1
+
+    def _lookup(self, key: str) -> dict[str, Any] | None:
+        entry = db.get_cache_entry(self._root_key, key)
+        if entry is None:
+            return None
+        if not (self.root / entry["file"]).exists():
+            db.delete_cache_entries(self._root_key, [key])
+            return None
+        return dict(entry)
+
+    def _store(self, key: str, source: Path, image_url: str) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        name = f"{key}{source.suffix or '.png'}"
+        tmp = self.root / f".{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(source, tmp)
+            os.replace(tmp, self.root / name)
+        finally:
+            tmp.unlink(missing_ok=True)
+        size = (self.root / name).stat().st_size
+        db.save_cache_entry(self._root_key, key, name, size, image_url)
+        self._evict(keep=key)
+
+    def fetch(
+        self,
+        payload: dict[str, Any],
+        out_path: Path,
+        produce: Callable[[Path], tuple[Path, str]],
+    ) -> tuple[Path, str]:
+        """Place the image for `payload` at `out_path`, generating it on a miss.
+
+        `produce(out_path)` runs the real generation and returns
+        `(path, image_url)`. Callers asking for a payload that is already being
+        produced wait for that result instead of starting a second generation.
+        """
+
+        key = payload_key(payload)
+        entry = self._lookup(key)
+        leader: Future | None = None
+        future: Future | None = None
+        if entry is None:
+            with self._lock:
+                leader = self._in_flight.get(key)
+                if leader is None:
+                    future = self._in_flight[key] = Future()
+        if future is not None:
+            # A leader may have stored the image after our lookup and left
+            # `_in_flight` before we took the lock: look again as the leader.
+            entry = self._lookup(key)
+            if entry is not None:
+                future.set_result((self.root / entry["file"], entry["image_url"]))
+                with self._lock:
+                    self._in_flight.pop(key, None)
+        with self._lock:
+            outcome = "hits" if entry is not None else "coalesced" if leader is not None else "misses"
+            self._counters[outcome] += 1
+
+        if entry is not None:
+            self._touch(key)
+            try:
+                return _copy_to(self.root / entry["file"], out_path), entry["image_url"]
+            except FileNotFoundError:
+                # Evicted between lookup and copy; treat it as a miss.
+                return self.fetch(payload, out_path, produce)
+
+        if leader is not None:
+            source, image_url = leader.result()
+            return _copy_to(source, out_path), image_url
+
+        try:
+            path, image_url = produce(out_path)
+            self._store(key, path, image_url)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result((path, image_url))
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+        return path, image_url
+
+    def stats(self) -> dict[str, Any]:
+        entries, total_bytes = db.cache_usage(self._root_key)
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"] + self._counters["coalesced"]
+            saved = self._counters["hits"] + self._counters["coalesced"]
+            return {
+                **self._counters,
+                "entries": entries,
+                "bytes": total_bytes,
+                "max_bytes": self.max_bytes,
+                "in_flight": len(self._in_flight),
+                "hit_ratio": round(saved / lookups, 3) if lookups else 0.0,
+            }
+
+
+def _copy_to(source: Path, out_path: Path) -> Path:
+    if source.resolve() != out_path.resolve():
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        # Copy beside the target and rename, so a crash never leaves half a page.
+        tmp = out_path.with_name(f".{out_path.name}.{os.getpid()}.{threading.get_ident()}.part")
+        try:
+            shutil.copyfile(source, tmp)
+            os.replace(tmp, out_path)
+        finally:
+            tmp.unlink(missing_ok=True)
+    return out_path
+
+
+_cache: GenerationCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_generation_cache() -> GenerationCache:
+    """Return the process-wide cache, creating it on first use."""
+
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GenerationCache()
+        return _cache
@@ -0,0 +1,136 @@
+"""Shared keep-alive HTTP sessions for Leonardo traffic.
+
+Every poll and download used to open a fresh TCP+TLS connection. The sessions
+here are created once per process, sized per host, and reused by the blocking
+client, the CLI and the diagnostics helper. API sessions carry the auth headers
+so callers only pass the URL and body; downloads use a separate session so the
+API key is never sent to the CDN.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from typing import Any
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_HOST = "cloud.leonardo.ai"
+CDN_HOST = "cdn.leonardo.ai"
+
+# Connections kept open per host. Size these to the number of pages that can
+# be in flight at once across all books in the process.
+API_POOL_SIZE = int(os.getenv("LEONARDO_API_POOL_SIZE", "32"))
+CDN_POOL_SIZE = int(os.getenv("LEONARDO_CDN_POOL_SIZE", "32"))
+DEFAULT_POOL_SIZE = int(os.getenv("LEONARDO_DEFAULT_POOL_SIZE", "8"))
+
+_lock = threading.Lock()
+_api_sessions: dict[str, requests.Session] = {}
+_download_session: requests.Session | None = None
+# Counters reported by AsyncLeonardoClient, which pools through aiohttp.
+_async_counts: dict[str, dict[str, int]] = {}
+
+
+def _mount_adapters(session: requests.Session) -> None:
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=DEFAULT_POOL_SIZE))
+    session.mount(f"https://{API_HOST}/", HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_SIZE))
+    session.mount(f"https://{CDN_HOST}/", HTTPAdapter(pool_connections=1, pool_maxsize=CDN_POOL_SIZE))
+    # A LEONARDO_BASE_URL stand-in serves both the API and the images.
+    standin = urlsplit(os.getenv("LEONARDO_BASE_URL") or "")
+    if standin.netloc and standin.hostname != API_HOST:
+        session.mount(
+            f"{standin.scheme}://{standin.netloc}/", HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_SIZE)
+        )
+
+
+def api_session(api_key: str) -> requests.Session:
+    """Return the shared session for Leonardo API calls with auth preset."""
+
+    with _lock:
+        session = _api_sessions.get(api_key)
+        if session is None:
+            session = requests.Session()
+            _mount_adapters(session)
+            session.headers.update(
+                {
+                    "accept": "application/json",
+                    "content-type": "application/json",
+                    "authorization": f"Bearer {api_key}",
+                }
+            )
+            _api_sessions[api_key] = session
+        return session
+
+
+def download_session() -> requests.Session:
+    """Return the shared session for image downloads (no auth headers)."""
+
+    global _download_session
+    with _lock:
+        if _download_session is None:
+            _download_session = requests.Session()
+            _mount_adapters(_download_session)
+        return _download_session
+
+
+def record_async_request(url: str, reused: bool) -> None:
+    host = urlsplit(url).hostname or "unknown"
+    with _lock:
+        counts = _async_counts.setdefault(host, {"requests": 0, "connections": 0})
+        counts["requests"] += 1
+        if not reused:
+            counts["connections"] += 1
+
+
+def pool_stats() -> dict[str, dict[str, Any]]:
+    """Return per-host request/connection counts and the connection reuse ratio."""
+
+    totals: dict[str, dict[str, int]] = {}
+
+    def _add(host: str, requests_made: int, connections: int) -> None:
+        entry = totals.setdefault(host, {"requests": 0, "connections": 0})
+        entry["requests"] += requests_made
+        entry["connections"] += connections
+
+    with _lock:
+        sessions = list(_api_sessions.values())
+        if _download_session is not None:
+            sessions.append(_download_session)
+        for host, counts in _async_counts.items():
+            _add(host, counts["requests"], counts["connections"])
+
+    for session in sessions:
+        for adapter in session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    _add(pool.host, pool.num_requests, pool.num_connections)
+
+    stats: dict[str, dict[str, Any]] = {}
+    for host, entry in totals.items():
+        made = entry["requests"]
+        reused = max(0, made - entry["connections"])
+        stats[host] = {
+            **entry,
+            "reused": reused,
+            "reuse_ratio": round(reused / made, 3) if made else 0.0,
+        }
+    return stats
+
+
+def close_sessions() -> None:
+    """Close every pooled connection (used on shutdown and in diagnostics)."""
+
+    global _download_session
+    with _lock:
+        sessions = list(_api_sessions.values())
+        _api_sessions.clear()
+        if _download_session is not None:
+            sessions.append(_download_session)
+        _download_session = None
+        _async_counts.clear()
+    for session in sessions:
+        session.close()
@@ -0,0 +1,426 @@
+"""Background book jobs for the HTTP API.
+
+`/api/generate` used to run `generate_story` inside the request, holding a
+Flask worker (and any proxy in front of it) open for minutes. Jobs are now
+queued on a bounded worker pool and reported through `/api/jobs/<id>`. Each
+job's ID doubles as its topic on `progress_events.bus`; the manager listens
+there for page progress and publishes the final `complete`/`failed` event.
+
+A preview job renders a low-resolution proof; `approve` queues the
+full-resolution book for it with the same story, child and model.
+`swap_page` puts a stored alternate image into a finished book and rebuilds
+its PDF in the request, without calling Leonardo.
+
+With a `JobStore`, every state change is also written to SQLite. A job then
+stays visible to all server worker processes, not only the one running it,
+and to the next server run.
+
+Jobs for the same child, story and tier share one output folder and manifest,
+so `submit` hands back the job already queued or running for that book
+instead of starting a second one. Across processes this goes through a lock
+row per book in the database. Each process refreshes its locks every
+`JOB_HEARTBEAT_SECONDS`; a lock left by a dead worker goes stale, and its job
+is marked failed (at once when gunicorn reports the worker's exit).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, fields
+from pathlib import Path
+from typing import Any, Callable
+
+from src import db
+from src.progress_events import bus
+
+# Books generated at once; each book also fans out its own page requests.
+JOB_WORKERS = int(os.getenv("STORY_JOB_WORKERS", "2"))
+# Finished jobs kept in memory for status lookups.
+JOB_HISTORY_LIMIT = int(os.getenv("STORY_JOB_HISTORY", "200"))
+# Seconds between heartbeats on this process's book locks. A lock without a
+# heartbeat for JOB_STALE_SECONDS belongs to a dead worker: it no longer
+# blocks the book and its job is marked failed.
+JOB_HEARTBEAT_SECONDS = float(os.getenv("STORY_JOB_HEARTBEAT_SECONDS", "15"))
+JOB_STALE_SECONDS = float(os.getenv("STORY_JOB_STALE_SECONDS", "90"))
+
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_COMPLETE = "complete"
+STATE_FAILED = "failed"
+# Page statuses that count towards `pages_done`.
+PAGE_DONE_STATUSES = ("rendered", "reused", "swapped")
+
+# What holds a book lock.
+LOCK_JOB = "job"
+LOCK_SWAP = "swap"
+
+
+@dataclass
+class Job:
+    id: str
+    story_key: str
+    child_name: str
+    model_key: str | None = None
+    preview: bool = False
+    # For a preview: the full-resolution job queued when it was approved.
+    final_job_id: str | None = None
+    state: str = STATE_QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    page_count: int | None = None
+    pages: dict[int, str] = field(default_factory=dict)
+    result: dict[str, Any] | None = None
+    error: str | None = None
+    # Server-side location of the finished PDF; never sent to clients.
+    pdf_path: str | None = None
+
+    @property
+    def book_key(self) -> tuple[str, str, bool]:
+        """Jobs with the same key write the same output folder."""
+
+        return self.story_key, self.child_name.lower(), self.preview
+
+    def to_dict(self) -> dict[str, Any]:
+        data = asdict(self)
+        del data["pdf_path"]
+        data["pages"] = {str(number): status for number, status in sorted(self.pages.items())}
+        data["pages_done"] = sum(1 for status in self.pages.values() if status in PAGE_DONE_STATUSES)
+        return data
+
+    def to_record(self) -> dict[str, Any]:
+        data = asdict(self)
+        data["pages"] = {str(number): status for number, status in self.pages.items()}
+        return data
+
+    @classmethod
+    def from_record(cls, data: dict[str, Any]) -> "Job":
+        known = {f.name for f in fields(cls)}
+        job = cls(**{key: value for key, value in data.items() if key in known})
+        job.pages = {int(number): status for number, status in job.pages.items()}
+        return job
+
+
+class JobStore:
+    """Job records in the app database, shared by all server processes."""
+
+    def save(self, job: Job) -> None:
+        db.save_job_record(job.id, job.state, job.created_at, job.finished_at, job.to_record())
+
+    def load(self, job_id: str) -> Job | None:
+        data = db.get_job_record(job_id)
+        return Job.from_record(data) if data else None
+
+    def claim(self, job: Job) -> Any:
+        """Lock the job's book and save the job; return the blocking lock instead if held."""
+
+        return db.acquire_book_lock(
+            json.dumps(job.book_key),
+            job.id,
+            LOCK_JOB,
+            os.getpid(),
+            time.time() - JOB_STALE_SECONDS,
+            job_data=job.to_record(),
+        )
+
+    def claim_book(self, book_key: tuple[str, str, bool], holder: str, kind: str) -> Any:
+        """Lock a book without a job (e.g. for a page swap)."""
+
+        return db.acquire_book_lock(json.dumps(book_key), holder, kind, os.getpid(), time.time() - JOB_STALE_SECONDS)
+
+    def release(self, book_key: tuple[str, str, bool], holder: str) -> None:
+        db.release_book_lock(json.dumps(book_key), holder)
+
+    def heartbeat(self) -> int:
+        """Refresh this process's locks; fail jobs whose worker has died."""
+
+        db.touch_book_locks(os.getpid())
+        return self.fail_orphaned()
+
+    def fail_orphaned(self, error: str = "Its server worker died; submit it again to resume") -> int:
+        return db.fail_orphaned_jobs(
+            (STATE_QUEUED, STATE_RUNNING), STATE_FAILED, error, time.time() - JOB_STALE_SECONDS
+        )
+
+    def release_worker(self, pid: int) -> int:
+        """Fail the jobs of a worker process that has exited (gunicorn `child_exit`)."""
+
+        db.drop_book_locks(pid)
+        return self.fail_orphaned()
+
+    def trim(self, keep: int = JOB_HISTORY_LIMIT) -> None:
+        db.trim_job_records(keep, (STATE_COMPLETE, STATE_FAILED))
+
+    def fail_unfinished(self, error: str = "Interrupted by a server restart; submit it again to resume") -> int:
+        """Call once at startup, before any worker runs jobs."""
+
+        db.drop_book_locks()
+        return db.fail_unfinished_jobs((STATE_QUEUED, STATE_RUNNING), STATE_FAILED, error)
+
+
+class JobManager:
+    """Runs book jobs on a bounded thread pool and tracks their progress."""
+
+    def __init__(
+        self,
+        run_book: Callable[..., Any],
+        max_workers: int = JOB_WORKERS,
+        store: JobStore | None = None,
+    ) -> None:
+        self._run_book = run_book
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="book-job")
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._store = store
+        # Books being rebuilt by `swap_page` in this process.
+        self._swapping: set[tuple[str, str, bool]] = set()
+        self._heartbeat: threading.Thread | None = None
+        self._stopping = threading.Event()
+
+    def _persist(self, job: Job) -> None:
+        if self._store is None:
+            return
+        with self._lock:
+            record = Job.from_record(job.to_record())
+        try:
+            self._store.save(record)
+        except Exception as exc:  # noqa: BLE001
+            # Progress must not fail a book; other workers just see it late.
+            print(f"Could not save job {job.id}: {exc}")
+
+    def _local_active_job(self, book_key: tuple[str, str, bool]) -> Job | None:
+        # Caller holds the lock.
+        for job in self._jobs.values():
+            if job.book_key == book_key and job.state in (STATE_QUEUED, STATE_RUNNING):
+                return job
+        return None
+
+    def _add(self, job: Job) -> None:
+        # Caller holds the lock.
+        self._jobs[job.id] = job
+        self._trim_history()
+
+    def submit(
+        self, story_key: str, child_name: str, model_key: str | None = None, preview: bool = False
+    ) -> Job:
+        """Queue a book, or return the job already queued or running for it."""
+
+        job = Job(
+            id=uuid.uuid4().hex,
+            story_key=story_key,
+            child_name=child_name,
+            model_key=model_key,
+            preview=preview,
+        )
+        with self._lock:
+            running = self._local_active_job(job.book_key)
+            if running is not None:
+                return running
+            if job.book_key in self._swapping:
+                raise ValueError("A page of this book is being swapped; try again shortly")
+            if self._store is None:
+                self._add(job)
+        if self._store is not None:
+            lock = self._store.claim(job)
+            if lock is not None:
+                if lock["kind"] == LOCK_SWAP:
+                    raise ValueError("A page of this book is being swapped; try again shortly")
+                running = self.get(lock["holder"])
+                if running is None:
+                    raise ValueError("This book is being generated; try again shortly")
+                return running
+            with self._lock:
+                self._add(job)
+            self._start_heartbeat()
+            self._store.trim()
+        self._pool.submit(self._run, job)
+        return job
+
+    def approve(self, job_id: str) -> Job:
+        """Queue the final book for a completed preview job (idempotent)."""
+
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if not job.preview:
+            raise ValueError("Only preview jobs can be approved")
+        if job.state != STATE_COMPLETE:
+            raise ValueError(f"Preview is {job.state}; wait for it to complete")
+        if job.final_job_id:
+            existing = self.get(job.final_job_id)
+            if existing is not None:
+                return existing
+        final = self.submit(job.story_key, job.child_name, model_key=job.model_key)
+        with self._lock:
+            job.final_job_id = final.id
+        self._persist(job)
+        return final
+
+    def swap_page(self, job_id: str, page_number: int) -> Job:
+        """Swap the next alternate into a page of a finished book and rebuild it.
+
+        Raises KeyError for an unknown job and ValueError when the book is not
+        finished, is already being rebuilt, or the page has no alternates.
+        """
+
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job.state != STATE_COMPLETE:
+            raise ValueError(f"Book is {job.state}; wait for it to complete")
+        with self._lock:
+            if job.book_key in self._swapping:
+                raise ValueError("This book is already being rebuilt")
+            if self._local_active_job(job.book_key) is not None:
+                raise ValueError("This book is being generated again; wait for it to complete")
+            self._swapping.add(job.book_key)
+        try:
+            # Same lock as `submit`, so no other worker rebuilds or regenerates
+            # the book (and writes its manifest) meanwhile.
+            holder = uuid.uuid4().hex
+            if self._store is not None:
+                lock = self._store.claim_book(job.book_key, holder, LOCK_SWAP)
+                if lock is not None:
+                    if lock["kind"] == LOCK_SWAP:
+                        raise ValueError("This book is already being rebuilt")
+                    raise ValueError("This book is being generated again; wait for it to complete")
+                self._start_heartbeat()
+            try:
+                self._run_book(
+                    story_key=job.story_key,
+                    child_name=job.child_name,
+                    model_key=job.model_key,
+                    preview=job.preview,
+                    swap_pages=[page_number],
+                )
+            finally:
+                if self._store is not None:
+                    self._store.release(job.book_key, holder)
+        finally:
+            with self._lock:
+                self._swapping.discard(job.book_key)
+        with self._lock:
+            job.pages[page_number] = "swapped"
+        self._persist(job)
+        return job
+
+    def is_local(self, job_id: str) -> bool:
+        """True when this process runs the job (so its events are on `bus`)."""
+
+        with self._lock:
+            return job_id in self._jobs
+
+    def get(self, job_id: str) -> Job | None:
+        """This process's job, else a read-only copy from the store."""
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self._store is not None:
+            job = self._store.load(job_id)
+        return job
+
+    def snapshot(self, job_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.to_dict()
+        job = self._store.load(job_id) if self._store is not None else None
+        return job.to_dict() if job else None
+
+    def active_count(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.state in (STATE_QUEUED, STATE_RUNNING))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting jobs; with `wait`, let in-flight books finish."""
+
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+        self._stopping.set()
+
+    def _start_heartbeat(self) -> None:
+        with self._lock:
+            if self._heartbeat is not None and self._heartbeat.is_alive():
+                return
+            self._heartbeat = threading.Thread(target=self._beat, name="job-heartbeat", daemon=True)
+            self._heartbeat.start()
+
+    def _beat(self) -> None:
+        try:
+            while not self._stopping.wait(JOB_HEARTBEAT_SECONDS):
+                try:
+                    failed = self._store.heartbeat()
+                except Exception as exc:  # noqa: BLE001
+                    print(f"Job heartbeat failed: {exc}")
+                    continue
+                if failed:
+                    print(f"Marked {failed} job(s) of a dead worker as failed")
+        finally:
+            db.close_connection()
+
+    def _trim_history(self) -> None:
+        # Caller holds the lock.
+        finished = [job for job in self._jobs.values() if job.state in (STATE_COMPLETE, STATE_FAILED)]
+        excess = len(self._jobs) - JOB_HISTORY_LIMIT
+        for job in sorted(finished, key=lambda j: j.finished_at or 0)[: max(0, excess)]:
+            del self._jobs[job.id]
+
+    def _on_progress(self, job: Job, event: dict[str, Any]) -> None:
+        changed = False
+        with self._lock:
+            if "page_count" in event:
+                job.page_count = event["page_count"]
+                changed = True
+            if "page" in event and event.get("status") != "poll":
+                job.pages[int(event["page"])] = event["status"]
+                changed = True
+        if changed:
+            self._persist(job)
+
+    def _run(self, job: Job) -> None:
+        with self._lock:
+            job.state = STATE_RUNNING
+            job.started_at = time.time()
+        self._persist(job)
+        bus.publish(job.id, {"status": STATE_RUNNING})
+        token = bus.subscribe(job.id, lambda event: self._on_progress(job, event))
+        try:
+            pdf_path = self._run_book(
+                story_key=job.story_key,
+                child_name=job.child_name,
+                model_key=job.model_key,
+                book_id=job.id,
+                preview=job.preview,
+            )
+        except Exception as exc:  # noqa: BLE001
+            with self._lock:
+                job.state = STATE_FAILED
+                job.error = str(exc)
+                job.finished_at = time.time()
+            self._finish(job)
+            bus.publish(job.id, {"status": STATE_FAILED, "error": job.error})
+            return
+        finally:
+            bus.unsubscribe(job.id, token)
+        with self._lock:
+            job.state = STATE_COMPLETE
+            job.pdf_path = str(pdf_path)
+            job.result = {"pdf": Path(pdf_path).name, "download_url": f"/api/jobs/{job.id}/pdf"}
+            job.finished_at = time.time()
+        self._finish(job)
+        bus.publish(job.id, {"status": STATE_COMPLETE, "result": job.result})
+
+    def _finish(self, job: Job) -> None:
+        # Save the final state before unlocking, so the book is never unlocked
+        # while its job still reads as running.
+        self._persist(job)
+        if self._store is None:
+            return
+        try:
+            self._store.release(job.book_key, job.id)
+        except Exception as exc:  # noqa: BLE001
+            print(f"Could not unlock book for job {job.id}: {exc}")
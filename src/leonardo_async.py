@@ -0,0 +1,320 @@
+"""Asyncio-native Leonardo client.
+
+`AsyncLeonardoClient` mirrors the blocking helpers in `src.leonardo_client`
+(submit, await completion, download, list models) but waits on the event loop
+instead of parking a thread between polls, so a single event
+loop can drive hundreds of generations across many books. Request payloads,
+response parsing and error messages are shared with the blocking helpers.
+
+Example::
+
+    async with AsyncLeonardoClient() as client:
+        paths = await asyncio.gather(
+            *(client.generate_image_and_download(p, model_id, out) for p, out in jobs)
+        )
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+
+from src.http_session import API_POOL_SIZE, record_async_request
+from src.leonardo_client import (
+    BASE_URL,
+    DOWNLOAD_CHUNK_SIZE,
+    POLL_INTERVAL_SECONDS,
+    _ImageWriter,
+    _check_generation_status,
+    _download_error,
+    _extract_generation_id,
+    _extract_platform_models,
+    _parse_json_body,
+    _request_error,
+    build_generation_payload,
+    build_headers,
+    check_image_url,
+    get_api_key,
+    get_first_image_url,
+    poll_attempts,
+)
+from src.metrics import LEONARDO_DOWNLOAD_BYTES, LEONARDO_POLLS, LEONARDO_STAGE_SECONDS
+from src.rate_limit import DOWNLOAD, POLL, SUBMIT, limiter, note_throttled, throttle_delay
+from src.retry_policy import REQUEST_POLICY, GenerationTimeoutError, RetryableError
+from src.webhooks import async_wait_for_generation, poll_interval
+
+
+def _reuse_trace_config() -> aiohttp.TraceConfig:
+    """Report new vs reused connections to `http_session.pool_stats`."""
+
+    async def _on_request_start(session, ctx, params) -> None:
+        ctx.url = str(params.url)
+        ctx.reused = False
+
+    async def _on_reuse(session, ctx, params) -> None:
+        ctx.reused = True
+
+    async def _on_request_end(session, ctx, params) -> None:
+        record_async_request(ctx.url, ctx.reused)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_connection_reuseconn.append(_on_reuse)
+    trace_config.on_request_end.append(_on_request_end)
+    return trace_config
+
+
+class AsyncLeonardoClient:
+    """Non-blocking Leonardo client built on a shared `aiohttp` session.
+
+    Create one client per event loop and reuse it; the underlying connector
+    keeps connections to Leonardo and its CDN alive between calls.
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        base_url: str = BASE_URL,
+        max_connections: int = 100,
+        max_connections_per_host: int = API_POOL_SIZE,
+        timeout_seconds: float = 60,
+    ) -> None:
+        self._api_key = api_key
+        self._base_url = base_url
+        self._max_connections = max_connections
+        self._max_connections_per_host = max_connections_per_host
+        self._timeout = aiohttp.ClientTimeout(total=timeout_seconds)
+        self._session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self) -> "AsyncLeonardoClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self._max_connections,
+                    limit_per_host=self._max_connections_per_host,
+                    keepalive_timeout=60,
+                ),
+                timeout=self._timeout,
+                trace_configs=[_reuse_trace_config()],
+            )
+        return self._session
+
+    def _headers(self) -> dict:
+        return build_headers(self._api_key or get_api_key())
+
+    async def _fetch(
+        self,
+        kind: str,
+        method: str,
+        url: str,
+        read: Callable[[aiohttp.ClientResponse], Awaitable[Any]] | None = None,
+        **kwargs: Any,
+    ) -> tuple[int, str, Any]:
+        """Send a request within `kind`'s rate limit; return (status, content type, body).
+
+        The body is the response text, or whatever `read(resp)` returns.
+        Throttled responses pause the shared bucket and are retried, as in
+        `leonardo_client._send`.
+        """
+
+        retries = 0
+        while True:
+            await limiter(kind).acquire_async()
+            async with self._get_session().request(method, url, **kwargs) as resp:
+                delay = throttle_delay(resp.status, resp.headers, retries)
+                if delay is None:
+                    body = await (read(resp) if read is not None else resp.text())
+                    return resp.status, resp.headers.get("content-type", ""), body
+            note_throttled(kind, resp.status, delay, retries)
+            retries += 1
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def start_generation(
+        self,
+        prompt: str,
+        model_id: str,
+        width: int = 1024,
+        height: int = 1024,
+        num_images: int = 1,
+        negative_prompt: str | None = None,
+        elements: list[dict] | None = None,
+        dataset_id: str | None = None,
+        seed: int | None = None,
+    ) -> str:
+        """Submit a generation and return its ID (see `leonardo_client.start_generation`)."""
+
+        payload = build_generation_payload(
+            prompt=prompt,
+            model_id=model_id,
+            width=width,
+            height=height,
+            num_images=num_images,
+            negative_prompt=negative_prompt,
+            elements=elements,
+            dataset_id=dataset_id,
+            seed=seed,
+        )
+        print("POST /generations payload:")
+        print(json.dumps(payload, indent=2))
+
+        async def _submit() -> str:
+            try:
+                status, content_type, body = await self._fetch(
+                    SUBMIT, "POST", f"{self._base_url}/generations", headers=self._headers(), json=payload
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                raise RetryableError(
+                    "Could not reach Leonardo. Check your internet connection, VPN/proxy, or DNS settings."
+                ) from exc
+            if status >= 400:
+                raise _request_error(status, body, payload)
+            data = _parse_json_body(content_type, body, "Leonardo generation response")
+            return _extract_generation_id(data)
+
+        return await REQUEST_POLICY.call_async("submit", _submit)
+
+    async def poll_generation(
+        self,
+        generation_id: str,
+        max_attempts: int | None = None,
+        interval_seconds: float = POLL_INTERVAL_SECONDS,
+    ) -> dict:
+        """Wait for a generation to finish without blocking the event loop."""
+
+        url = f"{self._base_url}/generations/{generation_id}"
+        headers = self._headers()
+        interval = poll_interval(interval_seconds)
+
+        async def _get() -> tuple[int, str, str]:
+            try:
+                # Throttled GETs are retried inside `_fetch` and cost no attempt.
+                return await self._fetch(POLL, "GET", url, headers=headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                raise RetryableError(
+                    "Could not reach Leonardo while polling. Check connectivity, VPN/proxy, or DNS."
+                ) from exc
+
+        gets = 0
+        for attempt in range(1, poll_attempts(max_attempts, interval_seconds) + 1):
+            pushed = await async_wait_for_generation(generation_id, timeout=interval)
+            if pushed is not None:
+                print(f"Webhook received for {generation_id}")
+                gen = _check_generation_status(pushed, attempt)
+                if gen is not None:
+                    LEONARDO_POLLS.observe(gets)
+                    return gen
+            status_code, content_type, body = await REQUEST_POLICY.call_async("poll", _get)
+            gets += 1
+            if status_code >= 400:
+                print(f"Poll {attempt}: error {status_code} {body}")
+                continue
+            try:
+                data = _parse_json_body(content_type, body, "Leonardo poll response")
+            except RuntimeError as exc:
+                # Keep the classification (a Cloudflare page is still retryable).
+                raise type(exc)(f"Polling failed: {exc}") from exc
+            gen = _check_generation_status(data, attempt)
+            if gen is not None:
+                LEONARDO_POLLS.observe(gets)
+                return gen
+        raise GenerationTimeoutError("Polling ended without COMPLETE status")
+
+    async def download_image(self, url: str, out_path: Path) -> Path:
+        """Stream the image to `out_path` atomically (see `leonardo_client.fetch_image`)."""
+
+        check_image_url(url)
+
+        async def _stream(resp: aiohttp.ClientResponse) -> None:
+            if resp.status >= 400:
+                return
+            writer = await asyncio.to_thread(_ImageWriter, out_path)
+            try:
+                async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    await asyncio.to_thread(writer.write, chunk)
+            except BaseException:
+                writer.abort()
+                raise
+            await asyncio.to_thread(writer.commit, resp.headers)
+
+        async def _download() -> None:
+            try:
+                status, _, _ = await self._fetch(
+                    DOWNLOAD, "GET", url, read=_stream, timeout=aiohttp.ClientTimeout(total=120)
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                raise RetryableError(
+                    "Could not download image from Leonardo. Check connectivity, VPN/proxy, or DNS."
+                ) from exc
+            if status >= 400:
+                raise _download_error(status)
+
+        await REQUEST_POLICY.call_async("download", _download)
+        return out_path
+
+    async def list_platform_models(self, limit: int = 15) -> list[dict[str, Any]]:
+        try:
+            status, content_type, body = await self._fetch(
+                POLL,
+                "GET",
+                f"{self._base_url}/platformModels",
+                headers=self._headers(),
+                params={"page": 1, "perPage": max(1, limit)},
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            raise RuntimeError(
+                "Could not reach Leonardo platformModels. Check connectivity, VPN/proxy, or DNS."
+            ) from exc
+        if status >= 400:
+            raise _request_error(status, body, payload={})
+        data = _parse_json_body(content_type, body, "Leonardo platformModels response")
+        return _extract_platform_models(data, limit)
+
+    async def generate_image_and_download(
+        self,
+        prompt: str,
+        model_id: str,
+        out_path: Path,
+        width: int = 1024,
+        height: int = 1024,
+        num_images: int = 1,
+        negative_prompt: str | None = None,
+        element_id: str | None = None,
+        dataset_id: str | None = None,
+        seed: int | None = None,
+    ) -> tuple[Path, str]:
+        elements = [{"id": element_id, "weight": 1.0}] if element_id else None
+        with LEONARDO_STAGE_SECONDS.time(stage="submit", model_id=model_id):
+            generation_id = await self.start_generation(
+                prompt=prompt,
+                model_id=model_id,
+                width=width,
+                height=height,
+                num_images=num_images,
+                negative_prompt=negative_prompt,
+                elements=elements,
+                dataset_id=dataset_id,
+                seed=seed,
+            )
+        with LEONARDO_STAGE_SECONDS.time(stage="generation", model_id=model_id):
+            result = await REQUEST_POLICY.call_async(
+                "poll", lambda: self.poll_generation(generation_id), retry_on=GenerationTimeoutError
+            )
+        image_url = get_first_image_url(result)
+        with LEONARDO_STAGE_SECONDS.time(stage="download", model_id=model_id):
+            local_path = await self.download_image(image_url, out_path)
+        LEONARDO_DOWNLOAD_BYTES.inc(local_path.stat().st_size, model_id=model_id)
+        return local_path, image_url
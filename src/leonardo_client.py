@@ -1,18 +1,45 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import math
 import os
-import time
+import re
+import uuid
 from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Mapping
+from urllib.parse import urlsplit
 
 import requests
 from dotenv import load_dotenv
 
+from src.generation_cache import get_generation_cache
+from src.http_session import CDN_HOST, api_session, download_session
+from src.metrics import LEONARDO_DOWNLOAD_BYTES, LEONARDO_POLLS, LEONARDO_STAGE_SECONDS
+from src.progress_events import publish_current
+from src.rate_limit import DOWNLOAD, POLL, SUBMIT, limiter, note_throttled, throttle_delay
+from src.retry_policy import (
+    REQUEST_POLICY,
+    GenerationFailedError,
+    GenerationTimeoutError,
+    RetryableError,
+)
+from src.webhooks import poll_interval, wait_for_generation
+
 ROOT = Path(__file__).resolve().parent.parent
 
-BASE_URL = "https://cloud.leonardo.ai/api/rest/v1"
+# Point at a stand-in (`python -m src.leonardo_standin`) for local runs and benchmarks.
+BASE_URL = os.getenv("LEONARDO_BASE_URL", "https://cloud.leonardo.ai/api/rest/v1").rstrip("/")
+# Images are only fetched from Leonardo's CDN (or from the stand-in's host).
+IMAGE_ORIGINS = frozenset({("https", CDN_HOST), (urlsplit(BASE_URL).scheme, urlsplit(BASE_URL).hostname)})
+# Seconds between status GETs, and how long to poll before a generation counts as lost.
+POLL_INTERVAL_SECONDS = float(os.getenv("LEONARDO_POLL_INTERVAL", "5"))
+POLL_TIMEOUT_SECONDS = float(os.getenv("LEONARDO_POLL_TIMEOUT", "150"))
+# Bytes read from the network per write while streaming an image to disk.
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# S3/CloudFront ETags of single-part uploads are the body's MD5.
+_MD5_ETAG = re.compile(r'^"?([0-9a-f]{32})"?$')
 
 
 @lru_cache(maxsize=1)
@@ -44,20 +71,25 @@ def build_headers(api_key: str) -> dict:
     }
 
 
-def _raise_request_error(resp: requests.Response, payload: dict[str, Any]) -> None:
-    """Raise a RuntimeError with detailed context from a Leonardo response."""
+def _request_error(status_code: int, body: str, payload: dict[str, Any]) -> RuntimeError:
+    """Build a RuntimeError with detailed context from a Leonardo error body.
+
+    Shared by the blocking helpers and `AsyncLeonardoClient` so both surface the
+    same hints regardless of which HTTP library produced the response. Server
+    errors (5xx) come back as `RetryableError`.
+    """
 
-    error_detail: str | None = None
+    error_detail: Any
     try:
-        data = resp.json()
+        data = json.loads(body)
         error_detail = data.get("error") or data.get("message") or data
     except Exception:
-        error_detail = resp.text
+        error_detail = body
 
     hints = []
-    if resp.status_code == 401:
+    if status_code == 401:
         hints.append("Check LEONARDO_API_KEY; the key may be missing or invalid.")
-    if resp.status_code == 400:
+    if status_code == 400:
         hints.append(
             "Verify modelId, width/height limits, and that the prompt is not empty."
         )
@@ -66,32 +98,45 @@ def _raise_request_error(resp: requests.Response, payload: dict[str, Any]) -> No
                 "Model IDs come from Leonardo > Models > (select model) > ID in the URL."
             )
     hint_text = f" Hints: {' '.join(hints)}" if hints else ""
-    raise RuntimeError(
-        f"Leonardo request failed ({resp.status_code}). Details: {error_detail}.{hint_text}"
+    error_class = RetryableError if status_code >= 500 else RuntimeError
+    return error_class(
+        f"Leonardo request failed ({status_code}). Details: {error_detail}.{hint_text}"
     )
 
 
-def _parse_json_response(resp: requests.Response, context: str) -> dict:
-    """Return response JSON or raise a helpful error when parsing fails."""
+def _raise_request_error(resp: requests.Response, payload: dict[str, Any]) -> None:
+    """Raise a RuntimeError with detailed context from a Leonardo response."""
+
+    raise _request_error(resp.status_code, resp.text, payload)
+
+
+def _parse_json_body(content_type: str, body: str, context: str) -> dict:
+    """Return parsed JSON or raise a helpful error when parsing fails."""
 
-    content_type = resp.headers.get("content-type", "")
     if "text/html" in content_type.lower():
-        raise RuntimeError(
-            f"{context}: Unexpected HTML from Leonardo (Cloudflare). Body: {resp.text[:300]}"
+        # Cloudflare challenge or error page; these clear up on their own.
+        raise RetryableError(
+            f"{context}: Unexpected HTML from Leonardo (Cloudflare). Body: {body[:300]}"
         )
     if "json" not in content_type.lower():
         raise RuntimeError(
-            f"{context}: Expected JSON response but got content-type '{content_type}'. Body: {resp.text[:300]}"
+            f"{context}: Expected JSON response but got content-type '{content_type}'. Body: {body[:300]}"
         )
     try:
-        return resp.json()
+        return json.loads(body)
     except ValueError as exc:
         raise RuntimeError(
-            f"{context}: Could not parse JSON response. Body: {resp.text[:300]}"
+            f"{context}: Could not parse JSON response. Body: {body[:300]}"
         ) from exc
 
 
-def start_generation(
+def _parse_json_response(resp: requests.Response, context: str) -> dict:
+    """Return response JSON or raise a helpful error when parsing fails."""
+
+    return _parse_json_body(resp.headers.get("content-type", ""), resp.text, context)
+
+
+def build_generation_payload(
     prompt: str,
     model_id: str,
     width: int = 1024,
@@ -100,16 +145,10 @@ def start_generation(
     negative_prompt: str | None = None,
     elements: list[dict] | None = None,
     dataset_id: str | None = None,
-) -> str:
-    """Kick off a Leonardo generation using the official `/generations` shape.
+    seed: int | None = None,
+) -> dict:
+    """Return the `/generations` request body used by every client."""
 
-    The payload mirrors the Getting Started example (prompt, modelId, width,
-    height, optional num_images) and intentionally omits unsupported training
-    fields such as `datasetId`. Use the `/elements` endpoint separately if you
-    need to train custom models.
-    """
-    api_key = get_api_key()
-    headers = build_headers(api_key)
     payload: dict = {
         "prompt": prompt,
         "modelId": model_id,
@@ -123,56 +162,165 @@ def start_generation(
         payload["elements"] = elements
     if dataset_id:
         payload["datasetId"] = dataset_id
-    print("POST /generations payload:")
-    print(json.dumps(payload, indent=2))
+    if seed is not None:
+        payload["seed"] = seed
+    return payload
 
-    try:
-        resp = requests.post(
-            f"{BASE_URL}/generations",
-            headers=headers,
-            json=payload,
-            timeout=60,
-        )
-    except requests.exceptions.RequestException as exc:
-        raise RuntimeError(
-            "Could not reach Leonardo. Check your internet connection, VPN/proxy, or DNS settings."
-        ) from exc
-    if not resp.ok:
-        _raise_request_error(resp, payload)
-    data = _parse_json_response(resp, "Leonardo generation response")
+
+def _send(kind: str, send: Callable[[], requests.Response]) -> requests.Response:
+    """Send a request within `kind`'s rate limit, backing off while throttled.
+
+    A 429 (or 503 with `Retry-After`) pauses the shared bucket and the
+    request is retried instead of being reported as a failure.
+    """
+
+    retries = 0
+    while True:
+        limiter(kind).acquire()
+        resp = send()
+        delay = throttle_delay(resp.status_code, resp.headers, retries)
+        if delay is None:
+            return resp
+        resp.close()
+        note_throttled(kind, resp.status_code, delay, retries)
+        retries += 1
+
+
+def _extract_generation_id(data: dict) -> str:
     # Leonardo returns sdGenerationJob.generationId; if missing, surface error
     if "sdGenerationJob" not in data or "generationId" not in data["sdGenerationJob"]:
         raise RuntimeError(f"Unexpected response from Leonardo: {data}")
     return data["sdGenerationJob"]["generationId"]
 
 
-def poll_generation(generation_id: str, max_attempts: int = 30, interval_seconds: int = 5) -> dict:
+def _check_generation_status(data: dict, attempt: int) -> dict | None:
+    """Return the generation once COMPLETE, None while it is still running."""
+
+    gen = data.get("generations_by_pk") or data
+    status = gen.get("status")
+    print(f"Poll {attempt} status: {status}")
+    publish_current(status="poll", attempt=attempt, generation_status=status)
+    if status == "COMPLETE":
+        return gen
+    if status == "FAILED":
+        raise GenerationFailedError(f"Generation failed with status: {status}")
+    if status == "CANCELLED":
+        raise RuntimeError(f"Generation failed with status: {status}")
+    return None
+
+
+def _extract_platform_models(data: dict, limit: int) -> list[dict[str, Any]]:
+    models = data.get("data") or data
+    if not isinstance(models, list):
+        raise RuntimeError(f"Unexpected platformModels response: {data}")
+    return models[:limit]
+
+
+def start_generation(
+    prompt: str,
+    model_id: str,
+    width: int = 1024,
+    height: int = 1024,
+    num_images: int = 1,
+    negative_prompt: str | None = None,
+    elements: list[dict] | None = None,
+    dataset_id: str | None = None,
+    seed: int | None = None,
+) -> str:
+    """Kick off a Leonardo generation using the official `/generations` shape.
+
+    The payload mirrors the Getting Started example (prompt, modelId, width,
+    height, optional num_images) and intentionally omits unsupported training
+    fields such as `datasetId`. Use the `/elements` endpoint separately if you
+    need to train custom models.
+    """
+    session = api_session(get_api_key())
+    payload = build_generation_payload(
+        prompt=prompt,
+        model_id=model_id,
+        width=width,
+        height=height,
+        num_images=num_images,
+        negative_prompt=negative_prompt,
+        elements=elements,
+        dataset_id=dataset_id,
+        seed=seed,
+    )
+    print("POST /generations payload:")
+    print(json.dumps(payload, indent=2))
+
+    def _submit() -> str:
+        try:
+            resp = _send(SUBMIT, lambda: session.post(f"{BASE_URL}/generations", json=payload, timeout=60))
+        except requests.exceptions.RequestException as exc:
+            raise RetryableError(
+                "Could not reach Leonardo. Check your internet connection, VPN/proxy, or DNS settings."
+            ) from exc
+        if not resp.ok:
+            _raise_request_error(resp, payload)
+        data = _parse_json_response(resp, "Leonardo generation response")
+        return _extract_generation_id(data)
+
+    return REQUEST_POLICY.call("submit", _submit)
+
+
+def poll_attempts(max_attempts: int | None, interval_seconds: float) -> int:
+    """Status checks to make: `max_attempts`, or enough to cover `POLL_TIMEOUT_SECONDS`."""
+
+    if max_attempts is not None:
+        return max_attempts
+    return max(1, math.ceil(POLL_TIMEOUT_SECONDS / max(interval_seconds, 0.01)))
+
+
+def poll_generation(
+    generation_id: str, max_attempts: int | None = None, interval_seconds: float = POLL_INTERVAL_SECONDS
+) -> dict:
+    """Wait for a generation to finish and return its `generations_by_pk` body.
+
+    Between status GETs we wait on the webhook registry rather than sleeping,
+    so a completion delivered to `/api/leonardo/webhook` returns immediately.
+    When webhooks are enabled the GETs fall back to a slow interval. A GET
+    that cannot reach Leonardo is retried under `REQUEST_POLICY`; the
+    generation itself keeps running either way.
+    """
+
     url = f"{BASE_URL}/generations/{generation_id}"
-    api_key = get_api_key()
-    headers = build_headers(api_key)
-    for attempt in range(1, max_attempts + 1):
-        time.sleep(interval_seconds)
+    session = api_session(get_api_key())
+    interval = poll_interval(interval_seconds)
+
+    def _get() -> requests.Response:
         try:
-            resp = requests.get(url, headers=headers, timeout=60)
+            # Throttled GETs are retried inside `_send` and cost no attempt.
+            return _send(POLL, lambda: session.get(url, timeout=60))
         except requests.exceptions.RequestException as exc:
-            raise RuntimeError(
+            raise RetryableError(
                 "Could not reach Leonardo while polling. Check connectivity, VPN/proxy, or DNS."
             ) from exc
+
+    gets = 0
+    for attempt in range(1, poll_attempts(max_attempts, interval_seconds) + 1):
+        pushed = wait_for_generation(generation_id, timeout=interval)
+        if pushed is not None:
+            print(f"Webhook received for {generation_id}")
+            gen = _check_generation_status(pushed, attempt)
+            if gen is not None:
+                LEONARDO_POLLS.observe(gets)
+                return gen
+        resp = REQUEST_POLICY.call("poll", _get)
+        gets += 1
         if resp.status_code >= 400:
             print(f"Poll {attempt}: error {resp.status_code} {resp.text}")
             continue
         try:
             data = _parse_json_response(resp, "Leonardo poll response")
         except RuntimeError as exc:
-            raise RuntimeError(f"Polling failed: {exc}") from exc
-        gen = data.get("generations_by_pk") or data
-        status = gen.get("status")
-        print(f"Poll {attempt} status: {status}")
-        if status == "COMPLETE":
+            # Keep the classification (a Cloudflare page is still retryable).
+            raise type(exc)(f"Polling failed: {exc}") from exc
+        gen = _check_generation_status(data, attempt)
+        if gen is not None:
+            LEONARDO_POLLS.observe(gets)
             return gen
-        if status in ("FAILED", "CANCELLED"):
-            raise RuntimeError(f"Generation failed with status: {status}")
-    raise RuntimeError("Polling ended without COMPLETE status")
+    raise GenerationTimeoutError("Polling ended without COMPLETE status")
 
 
 def get_first_image_url(result_json: dict) -> str:
@@ -185,17 +333,131 @@ def get_first_image_url(result_json: dict) -> str:
     return url
 
 
+def get_image_urls(result_json: dict) -> list[str]:
+    """Every image URL of a generation, in Leonardo's order (`num_images` > 1)."""
+
+    return [image["url"] for image in result_json.get("generated_images") or [] if image.get("url")]
+
+
+def is_image_url_allowed(url: str) -> bool:
+    parts = urlsplit(url)
+    return (parts.scheme, parts.hostname) in IMAGE_ORIGINS
+
+
+def check_image_url(url: str) -> str:
+    """Return `url`, or raise if it does not point at Leonardo's image host.
+
+    Image URLs can arrive through the webhook, so they are never fetched from
+    arbitrary hosts.
+    """
+
+    if not is_image_url_allowed(url):
+        raise RuntimeError(f"Refusing to download an image from outside Leonardo's CDN: {url}")
+    return url
+
+
+def _download_error(status_code: int) -> RuntimeError:
+    # Image URLs are public CDN links: a 5xx or a not-yet-propagated 403/404
+    # usually clears up, anything else will not.
+    error_class = RetryableError if status_code >= 500 or status_code in (403, 404, 408) else RuntimeError
+    return error_class(f"Could not download image from Leonardo (HTTP {status_code}).")
+
+
+class _ImageWriter:
+    """Write a streamed image to a temp file and move it into place when whole.
+
+    The SHA-256 is computed while writing, so callers need not read the file
+    back. `commit` checks the byte count against Content-Length and the MD5
+    against an S3-style ETag; a short or corrupt body raises `RetryableError`
+    and never replaces `out_path`. With `keep_bytes` the body is also kept in
+    memory for the renderer.
+    """
+
+    def __init__(self, out_path: Path, keep_bytes: bool = False) -> None:
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        self.out_path = out_path
+        self._tmp = out_path.with_name(f".{out_path.name}.{uuid.uuid4().hex[:8]}.part")
+        self._file = open(self._tmp, "wb")
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5(usedforsecurity=False)
+        self._size = 0
+        self._buffer = bytearray() if keep_bytes else None
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self._sha256.update(chunk)
+        self._md5.update(chunk)
+        self._size += len(chunk)
+        if self._buffer is not None:
+            self._buffer += chunk
+
+    def commit(self, headers: Mapping[str, str]) -> tuple[str, bytes | None]:
+        """Verify, fsync and rename; return (sha256, body or None)."""
+
+        try:
+            encoded = headers.get("Content-Encoding", "identity").lower() not in ("", "identity")
+            expected = headers.get("Content-Length")
+            if not encoded and expected is not None and expected.isdigit() and int(expected) != self._size:
+                raise RetryableError(f"Image download was cut short ({self._size} of {expected} bytes).")
+            etag = _MD5_ETAG.match(headers.get("ETag", ""))
+            if not encoded and etag and etag.group(1) != self._md5.hexdigest():
+                raise RetryableError("Downloaded image does not match its checksum (ETag).")
+            if not self._size:
+                raise RetryableError("Leonardo returned an empty image.")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.replace(self._tmp, self.out_path)
+        except BaseException:
+            self.abort()
+            raise
+        data = bytes(self._buffer) if self._buffer is not None else None
+        return self._sha256.hexdigest(), data
+
+    def abort(self) -> None:
+        self._file.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+def fetch_image(url: str, out_path: Path, keep_bytes: bool = False) -> tuple[str, bytes | None]:
+    """Stream the image at `url` to `out_path` atomically; return (sha256, body).
+
+    The body is only returned with `keep_bytes`. Failed or incomplete
+    downloads leave `out_path` untouched and are retried against the same URL
+    under `REQUEST_POLICY`.
+    """
+
+    check_image_url(url)
+
+    def _download() -> tuple[str, bytes | None]:
+        try:
+            resp = _send(DOWNLOAD, lambda: download_session().get(url, timeout=120, stream=True))
+        except requests.exceptions.RequestException as exc:
+            raise RetryableError(
+                "Could not download image from Leonardo. Check connectivity, VPN/proxy, or DNS."
+            ) from exc
+        with resp:
+            if resp.status_code >= 400:
+                raise _download_error(resp.status_code)
+            writer = _ImageWriter(out_path, keep_bytes)
+            try:
+                for chunk in resp.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    writer.write(chunk)
+            except requests.exceptions.RequestException as exc:
+                writer.abort()
+                raise RetryableError("Image download from Leonardo was interrupted.") from exc
+            except BaseException:
+                writer.abort()
+                raise
+            return writer.commit(resp.headers)
+
+    return REQUEST_POLICY.call("download", _download)
+
+
 def download_image(url: str, out_path: Path) -> Path:
-    try:
-        resp = requests.get(url, timeout=120)
-    except requests.exceptions.RequestException as exc:
-        raise RuntimeError(
-            "Could not download image from Leonardo. Check connectivity, VPN/proxy, or DNS."
-        ) from exc
-    resp.raise_for_status()
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_path, "wb") as f:
-        f.write(resp.content)
+    """Save the image at `url`, retrying the same URL under `REQUEST_POLICY`."""
+
+    fetch_image(url, out_path)
     return out_path
 
 
@@ -208,14 +470,15 @@ def list_platform_models(limit: int = 15) -> list[dict[str, Any]]:
     for generation requests.
     """
 
-    api_key = get_api_key()
-    headers = build_headers(api_key)
+    session = api_session(get_api_key())
     try:
-        resp = requests.get(
-            f"{BASE_URL}/platformModels",
-            headers=headers,
-            params={"page": 1, "perPage": max(1, limit)},
-            timeout=60,
+        resp = _send(
+            POLL,
+            lambda: session.get(
+                f"{BASE_URL}/platformModels",
+                params={"page": 1, "perPage": max(1, limit)},
+                timeout=60,
+            ),
         )
     except requests.exceptions.RequestException as exc:
         raise RuntimeError(
@@ -224,10 +487,7 @@ def list_platform_models(limit: int = 15) -> list[dict[str, Any]]:
     if not resp.ok:
         _raise_request_error(resp, payload={})
     data = _parse_json_response(resp, "Leonardo platformModels response")
-    models = data.get("data") or data
-    if not isinstance(models, list):
-        raise RuntimeError(f"Unexpected platformModels response: {data}")
-    return models[:limit]
+    return _extract_platform_models(data, limit)
 
 
 def generate_image_and_download(
@@ -240,9 +500,26 @@ def generate_image_and_download(
     negative_prompt: str | None = None,
     element_id: str | None = None,
     dataset_id: str | None = None,
+    seed: int | None = None,
+    use_cache: bool = True,
+    on_submitted: Callable[[str], None] | None = None,
+    on_alternates: Callable[[list[str]], None] | None = None,
+    on_downloaded: Callable[[str, bytes], None] | None = None,
 ) -> tuple[Path, str]:
+    """Generate one image and save it to `out_path`.
+
+    With `use_cache` the result is looked up by the full request payload in
+    the on-disk generation cache first, and identical concurrent requests
+    share one Leonardo generation. `on_submitted` is called with the
+    generation ID as soon as Leonardo accepts the request. With
+    `num_images` > 1 the first image is saved and `on_alternates` receives
+    the other URLs (only on a cache miss; the cache keeps one image).
+    `on_downloaded(sha256, body)` hands a freshly downloaded image to the
+    caller so it need not read the file back; it is not called on cache hits.
+    """
+
     elements = [{"id": element_id, "weight": 1.0}] if element_id else None
-    generation_id = start_generation(
+    payload = build_generation_payload(
         prompt=prompt,
         model_id=model_id,
         width=width,
@@ -251,8 +528,40 @@ def generate_image_and_download(
         negative_prompt=negative_prompt,
         elements=elements,
         dataset_id=dataset_id,
+        seed=seed,
     )
-    result = poll_generation(generation_id)
-    image_url = get_first_image_url(result)
-    local_path = download_image(image_url, out_path)
-    return local_path, image_url
+
+    def _produce(target: Path) -> tuple[Path, str]:
+        with LEONARDO_STAGE_SECONDS.time(stage="submit", model_id=model_id):
+            generation_id = start_generation(
+                prompt=prompt,
+                model_id=model_id,
+                width=width,
+                height=height,
+                num_images=num_images,
+                negative_prompt=negative_prompt,
+                elements=elements,
+                dataset_id=dataset_id,
+                seed=seed,
+            )
+        if on_submitted is not None:
+            on_submitted(generation_id)
+        with LEONARDO_STAGE_SECONDS.time(stage="generation", model_id=model_id):
+            # A generation that outlives the polling window is polled again,
+            # never submitted again.
+            result = REQUEST_POLICY.call(
+                "poll", lambda: poll_generation(generation_id), retry_on=GenerationTimeoutError
+            )
+        image_url = get_first_image_url(result)
+        with LEONARDO_STAGE_SECONDS.time(stage="download", model_id=model_id):
+            sha256, body = fetch_image(image_url, target, keep_bytes=on_downloaded is not None)
+        LEONARDO_DOWNLOAD_BYTES.inc(target.stat().st_size, model_id=model_id)
+        if on_downloaded is not None:
+            on_downloaded(sha256, body)
+        if on_alternates is not None:
+            on_alternates(get_image_urls(result)[1:])
+        return target, image_url
+
+    if not use_cache:
+        return _produce(out_path)
+    return get_generation_cache().fetch(payload, out_path, _produce)
@@ -1,5 +1,3 @@
-from __future__ import annotations
-
 """Leonardo connectivity and model ID helper.
 
 Run this module to verify your API key and pull valid model IDs directly from
@@ -9,20 +7,21 @@ https://docs.leonardo.ai/docs/connect-to-leonardoai-mcp so you don't need to
 guess or copy stale IDs.
 """
 
+from __future__ import annotations
+
 from typing import Any
 
-from src.leonardo_client import BASE_URL, build_headers, get_api_key, list_platform_models
-import requests
+from src.http_session import api_session, pool_stats
+from src.leonardo_client import BASE_URL, get_api_key, list_platform_models
 
 
 def _check_api_key() -> str:
     """Validate that the API key exists and has basic access."""
 
     api_key = get_api_key()
-    headers = build_headers(api_key)
     # The platformModels call is lightweight and confirms the key works.
     try:
-        resp = requests.get(f"{BASE_URL}/platformModels?page=1&perPage=1", headers=headers, timeout=30)
+        resp = api_session(api_key).get(f"{BASE_URL}/platformModels?page=1&perPage=1", timeout=30)
         resp.raise_for_status()
     except Exception as exc:  # noqa: BLE001
         raise RuntimeError(
@@ -67,6 +66,11 @@ def main() -> None:
         print(
             "API key looks OK. To fetch model IDs, rerun with --list-platform-models",
         )
+    for host, stats in pool_stats().items():
+        print(
+            f"{host}: {stats['requests']} requests over {stats['connections']} connections "
+            f"(reuse ratio {stats['reuse_ratio']})"
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,273 @@
+"""Local stand-in for the Leonardo REST API.
+
+Answers the calls the clients make (`POST /generations`,
+`GET /generations/{id}` and `GET /platformModels`) and serves the images it
+"generates", so whole books can run offline and be benchmarked without
+credits. Queue time, failures, throttling and image size are configurable:
+
+    python -m src.leonardo_standin --port 5055 --latency 8 --jitter 2 --throttle-rate 0.05
+    LEONARDO_BASE_URL=http://127.0.0.1:5055/api/rest/v1 LEONARDO_API_KEY=standin \\
+        python -m src.generate_book --pages data/pages_dragons.json --child-name Zed
+
+`GET /stats` returns request counters. Generations live in memory until the
+server stops.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any
+
+from flask import Flask, Response, jsonify, request
+from PIL import Image
+
+API_PREFIX = "/api/rest/v1"
+DEFAULT_PORT = 5055
+# Distinct images per size, so alternates of a page differ.
+IMAGE_VARIANTS = 4
+_TINTS = ((255, 170, 120), (120, 200, 255), (150, 240, 140), (240, 200, 90))
+
+
+@dataclass
+class StandinSettings:
+    # Seconds from submit until a generation is COMPLETE (uniform +/- jitter).
+    latency: float = 5.0
+    jitter: float = 1.0
+    # Share of generations that end FAILED.
+    fail_rate: float = 0.0
+    # Share of API requests answered with a 500.
+    error_rate: float = 0.0
+    # Share of API requests answered with a 429 and `Retry-After: retry_after`.
+    throttle_rate: float = 0.0
+    retry_after: float = 1.0
+    # Share of image downloads answered with a 503.
+    download_error_rate: float = 0.0
+    # Edge of the served images in pixels; None uses the requested width/height.
+    image_size: int | None = None
+    seed: int | None = None
+
+
+@dataclass
+class _Generation:
+    id: str
+    ready_at: float
+    failed: bool
+    width: int
+    height: int
+    num_images: int
+    prompt: str
+    model_id: str
+    created_at: str = field(default_factory=lambda: time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+
+@lru_cache(maxsize=16)
+def render_image(width: int, height: int, variant: int) -> bytes:
+    """A noisy tinted PNG, about as hard to compress as a real illustration."""
+
+    noise = Image.effect_noise((width, height), 64).point(lambda value: 64 + value // 2)
+    tint = _TINTS[variant % len(_TINTS)]
+    channels = [noise.point(lambda value, scale=scale: value * scale // 255) for scale in tint]
+    buffer = io.BytesIO()
+    Image.merge("RGB", channels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def create_app(settings: StandinSettings | None = None) -> Flask:
+    settings = settings or StandinSettings()
+    app = Flask(__name__)
+    rng = random.Random(settings.seed)
+    lock = threading.Lock()
+    generations: dict[str, _Generation] = {}
+    stats = {
+        "submitted": 0,
+        "polls": 0,
+        "downloads": 0,
+        "download_bytes": 0,
+        "failed_generations": 0,
+        "errors": 0,
+        "throttled": 0,
+    }
+
+    def _roll(rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with lock:
+            return rng.random() < rate
+
+    def _count(key: str, amount: int = 1) -> None:
+        with lock:
+            stats[key] += amount
+
+    def _injected_failure() -> Response | None:
+        if _roll(settings.throttle_rate):
+            _count("throttled")
+            resp = jsonify({"error": "Too many requests"})
+            resp.status_code = 429
+            resp.headers["Retry-After"] = f"{settings.retry_after:g}"
+            return resp
+        if _roll(settings.error_rate):
+            _count("errors")
+            resp = jsonify({"error": "Internal server error (injected)"})
+            resp.status_code = 500
+            return resp
+        return None
+
+    def _authorized() -> bool:
+        return request.headers.get("Authorization", "").startswith("Bearer ")
+
+    def _image_urls(gen: _Generation) -> list[dict[str, Any]]:
+        base = request.host_url.rstrip("/")
+        return [
+            {"id": f"{gen.id}-{index}", "url": f"{base}/images/{gen.id}/{index}.png", "nsfw": False}
+            for index in range(gen.num_images)
+        ]
+
+    @app.before_request
+    def _check_request():
+        if not request.path.startswith(API_PREFIX):
+            return None
+        if not _authorized():
+            return jsonify({"error": "Invalid authentication token"}), 401
+        return _injected_failure()
+
+    @app.post(f"{API_PREFIX}/generations")
+    def submit_generation():
+        body = request.get_json(silent=True) or {}
+        if not body.get("prompt") or not body.get("modelId"):
+            return jsonify({"error": "prompt and modelId are required"}), 400
+        size = settings.image_size
+        with lock:
+            jitter = rng.uniform(-settings.jitter, settings.jitter)
+        gen = _Generation(
+            id=str(uuid.uuid4()),
+            ready_at=time.monotonic() + max(0.0, settings.latency + jitter),
+            failed=_roll(settings.fail_rate),
+            width=size or int(body.get("width") or 1024),
+            height=size or int(body.get("height") or 1024),
+            num_images=max(1, min(8, int(body.get("num_images") or 1))),
+            prompt=str(body["prompt"]),
+            model_id=str(body["modelId"]),
+        )
+        with lock:
+            generations[gen.id] = gen
+            stats["submitted"] += 1
+            stats["failed_generations"] += gen.failed
+        return jsonify({"sdGenerationJob": {"generationId": gen.id, "apiCreditCost": 0}})
+
+    @app.get(f"{API_PREFIX}/generations/<generation_id>")
+    def get_generation(generation_id: str):
+        _count("polls")
+        with lock:
+            gen = generations.get(generation_id)
+        if gen is None:
+            return jsonify({"generations_by_pk": None})
+        status = "PENDING"
+        images: list[dict[str, Any]] = []
+        if time.monotonic() >= gen.ready_at:
+            status = "FAILED" if gen.failed else "COMPLETE"
+            images = [] if gen.failed else _image_urls(gen)
+        return jsonify(
+            {
+                "generations_by_pk": {
+                    "id": gen.id,
+                    "status": status,
+                    "prompt": gen.prompt,
+                    "modelId": gen.model_id,
+                    "imageWidth": gen.width,
+                    "imageHeight": gen.height,
+                    "createdAt": gen.created_at,
+                    "generated_images": images,
+                }
+            }
+        )
+
+    @app.get(f"{API_PREFIX}/platformModels")
+    def platform_models():
+        return jsonify({"data": [{"id": "standin-model", "name": "Stand-in", "description": "Noise images"}]})
+
+    @app.get("/images/<generation_id>/<int:index>.png")
+    def get_image(generation_id: str, index: int):
+        with lock:
+            gen = generations.get(generation_id)
+        if gen is None or gen.failed or index >= gen.num_images:
+            return jsonify({"error": "Not found"}), 404
+        if _roll(settings.download_error_rate):
+            _count("errors")
+            return jsonify({"error": "Service unavailable (injected)"}), 503
+        # Page-dependent variant: consecutive generations and alternates differ.
+        variant = (int(generation_id[:8], 16) + index) % IMAGE_VARIANTS
+        body = render_image(gen.width, gen.height, variant)
+        with lock:
+            stats["downloads"] += 1
+            stats["download_bytes"] += len(body)
+        resp = Response(body, mimetype="image/png")
+        resp.headers["ETag"] = f'"{hashlib.md5(body).hexdigest()}"'
+        return resp
+
+    @app.get("/stats")
+    def get_stats():
+        with lock:
+            return jsonify({**stats, "generations": len(generations)})
+
+    return app
+
+
+def start_standin(
+    settings: StandinSettings | None = None, host: str = "127.0.0.1", port: int = 0
+) -> tuple[Any, str]:
+    """Serve the stand-in on a daemon thread; return (server, API base URL).
+
+    `port=0` picks a free port. Stop it with `server.shutdown()`.
+    """
+
+    from werkzeug.serving import make_server
+
+    server = make_server(host, port, create_app(settings), threaded=True)
+    threading.Thread(target=server.serve_forever, name="leonardo-standin", daemon=True).start()
+    return server, f"http://{host}:{server.port}{API_PREFIX}"
+
+
+def main() -> None:
+    import argparse
+
+    defaults = StandinSettings()
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Leonardo API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="Seconds until COMPLETE")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="+/- seconds on --latency")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of generations that end FAILED")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of API requests answered 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of API requests answered 429")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after, help="Retry-After on 429s")
+    parser.add_argument(
+        "--download-error-rate", type=float, default=0.0, help="Share of image downloads answered 503"
+    )
+    parser.add_argument("--image-size", type=int, help="Image edge in pixels (default: the requested size)")
+    parser.add_argument("--seed", type=int, help="Seed for the injected failures")
+    args = parser.parse_args()
+
+    settings = StandinSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        fail_rate=args.fail_rate,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        download_error_rate=args.download_error_rate,
+        image_size=args.image_size,
+        seed=args.seed,
+    )
+    print(f"Leonardo stand-in on http://{args.host}:{args.port}{API_PREFIX}")
+    create_app(settings).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""In-process counters and histograms for the book pipeline.
+
+Each stage of a book (submit, Leonardo queue time, download, render, PDF
+write) is timed into a histogram, and `/metrics` serves everything in the
+Prometheus text format. Metrics live in the process that records them:
+under `python -m src.serve` with several workers, each scrape reports the
+worker that answered it.
+
+With `STORY_METRICS_JSONL=1`, every observation made while a book runs is
+also appended to `<output_dir>/metrics.jsonl`, one JSON object per line
+tagged with the book and page, for looking at a single run in detail.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator, Sequence
+
+from src.progress_events import current_page
+
+METRICS_JSONL = (os.getenv("STORY_METRICS_JSONL") or "").strip().lower() in ("1", "true", "yes", "on")
+
+# Seconds: from a fast render up to a slow Leonardo queue.
+TIME_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+_registry: list["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+class BookLog:
+    """Appends this book's observations to a JSON-lines file."""
+
+    def __init__(self, path: Path, book: str) -> None:
+        self.path = path
+        self.book = book
+        self._lock = threading.Lock()
+
+    def write(self, metric: str, value: float, labels: dict[str, str]) -> None:
+        record = {"ts": round(time.time(), 3), "book": self.book, "page": current_page.get(), "metric": metric}
+        record.update(labels)
+        record["value"] = round(value, 6)
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+current_book_log: contextvars.ContextVar[BookLog | None] = contextvars.ContextVar("current_book_log", default=None)
+
+
+def start_book_log(output_dir: Path, book: str) -> BookLog | None:
+    """Send later observations in this context to `<output_dir>/metrics.jsonl`.
+
+    A no-op unless `STORY_METRICS_JSONL` is set. `generate_story` calls it
+    inside the context that runs the book, so the log ends with the book.
+    """
+
+    if not METRICS_JSONL:
+        return None
+    log = BookLog(output_dir / "metrics.jsonl", book)
+    current_book_log.set(log)
+    return log
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _log(self, value: float, labels: dict[str, Any]) -> None:
+        log = current_book_log.get()
+        if log is not None:
+            log.write(self.name, value, {name: str(labels[name]) for name in self.labelnames})
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self._log(amount, labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = TIME_BUCKETS
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label set: [per-bucket counts..., sum, count].
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+        self._log(value, labels)
+
+    @contextlib.contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observe the wall time of the `with` block (also when it raises)."""
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, hits in zip(self.buckets, state):
+                cumulative += hits
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {int(cumulative)}")
+            labels = _label_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {int(state[-1])}")
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read when scraped, from `read()` -> {label values: value}."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        read: Callable[[], dict[tuple[str, ...], float]],
+        labelnames: Sequence[str] = (),
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._read = read
+
+    def _samples(self) -> list[str]:
+        try:
+            values = self._read()
+        except Exception as exc:  # noqa: BLE001
+            # A broken reader must not take the whole scrape down.
+            print(f"Could not read gauge {self.name}: {exc}")
+            return []
+        return [
+            f"{self.name}{_label_text(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+def render_prometheus() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+
+    with _registry_lock:
+        metrics = list(_registry)
+    lines: list[str] = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Leonardo calls. The model ID is a label so models can be compared.
+LEONARDO_STAGE_SECONDS = Histogram(
+    "leonardo_stage_seconds",
+    "Time per Leonardo stage: submit, generation (queue until COMPLETE) and download.",
+    ("stage", "model_id"),
+)
+LEONARDO_POLLS = Histogram(
+    "leonardo_polls_per_generation",
+    "Status GETs needed before a generation completed.",
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34),
+)
+LEONARDO_DOWNLOAD_BYTES = Counter(
+    "leonardo_download_bytes_total", "Image bytes downloaded from Leonardo.", ("model_id",)
+)
+LEONARDO_THROTTLED = Counter(
+    "leonardo_throttled_total", "Throttled (429/503) Leonardo responses.", ("kind",)
+)
+REQUEST_RETRIES = Counter(
+    "story_retries_total", "Retried steps after a transient failure.", ("step",)
+)
+# Local work on a book.
+STORY_STAGE_SECONDS = Histogram(
+    "story_stage_seconds",
+    "Time per local stage of a page: render (in the render pool) and write (into the PDFs).",
+    ("stage",),
+)
+STORY_PAGES = Counter(
+    "story_pages_total", "Pages by outcome: generated, reused or failed.", ("status",)
+)
+STORY_BOOK_SECONDS = Histogram(
+    "story_book_seconds",
+    "Wall time of a whole book.",
+    ("tier", "outcome"),
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600),
+)
+# HTTP API.
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "API response time by route and status (streaming bodies excluded).",
+    ("method", "route", "status"),
+)
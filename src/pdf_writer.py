@@ -0,0 +1,162 @@
+"""Incremental PDF writer for storybooks.
+
+Pillow's `save(save_all=True, append_images=...)` needs every page bitmap in
+memory at once (~3 MB of raw RGB per 1024px page, plus copies). This writer
+appends each page to the output file as soon as it is rendered, as a
+JPEG-compressed image XObject, and keeps only object offsets in memory. Pages
+may be added in any order; the page tree written on `close()` orders them by
+their page number.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import uuid
+from pathlib import Path
+from types import TracebackType
+
+from PIL import Image
+
+# Matches what Pillow used when we saved the PDF through `Image.save`.
+DEFAULT_JPEG_QUALITY = 75
+DEFAULT_RESOLUTION = 72.0
+
+_CATALOG_ID = 1
+_PAGES_ID = 2
+
+
+class StreamingPdfWriter:
+    """Write image pages to a PDF one at a time with flat memory use.
+
+    The file is written to a temp file beside `path`, unique per writer, and
+    renamed into place on `close()`, so readers never see a half-written book
+    and two writers never share a temp file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.part")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self._tmp_path, "wb")
+        self._offsets: dict[int, int] = {}
+        self._next_id = _PAGES_ID + 1
+        self._pages: list[tuple[int, int]] = []  # (order, page object id)
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self) -> "StreamingPdfWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pages)
+
+    def _alloc(self) -> int:
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id: int, body: bytes, stream: bytes | None = None) -> None:
+        self._offsets[obj_id] = self._file.tell()
+        self._file.write(f"{obj_id} 0 obj\n".encode("ascii"))
+        self._file.write(body)
+        if stream is not None:
+            self._file.write(b"\nstream\n")
+            self._file.write(stream)
+            self._file.write(b"\nendstream")
+        self._file.write(b"\nendobj\n")
+
+    def add_image_page(
+        self,
+        image: Image.Image,
+        order: int | None = None,
+        quality: int = DEFAULT_JPEG_QUALITY,
+        resolution: float = DEFAULT_RESOLUTION,
+    ) -> None:
+        """JPEG-encode `image` and append it as a full-bleed page."""
+
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        buf = io.BytesIO()
+        image.save(buf, "JPEG", quality=quality)
+        self.add_jpeg_page(buf.getvalue(), image.width, image.height, order=order, resolution=resolution)
+
+    def add_jpeg_page(
+        self,
+        jpeg: bytes,
+        width: int,
+        height: int,
+        order: int | None = None,
+        resolution: float = DEFAULT_RESOLUTION,
+    ) -> None:
+        """Append already-encoded baseline RGB JPEG data as a page."""
+
+        image_id, content_id, page_id = self._alloc(), self._alloc(), self._alloc()
+        page_w = width * 72.0 / resolution
+        page_h = height * 72.0 / resolution
+        self._write_object(
+            image_id,
+            (
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode "
+                f"/Length {len(jpeg)} >>"
+            ).encode("ascii"),
+            jpeg,
+        )
+        content = f"q {page_w:.2f} 0 0 {page_h:.2f} 0 0 cm /Im0 Do Q".encode("ascii")
+        self._write_object(content_id, f"<< /Length {len(content)} >>".encode("ascii"), content)
+        self._write_object(
+            page_id,
+            (
+                f"<< /Type /Page /Parent {_PAGES_ID} 0 R /MediaBox [0 0 {page_w:.2f} {page_h:.2f}] "
+                f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+            ).encode("ascii"),
+        )
+        self._pages.append((len(self._pages) if order is None else order, page_id))
+
+    def close(self) -> Path:
+        """Write the page tree and cross-reference table, then publish the file."""
+
+        if self._file.closed:
+            return self.path
+        if not self._pages:
+            self.abort()
+            raise RuntimeError("No pages rendered")
+        kids = " ".join(f"{page_id} 0 R" for _, page_id in sorted(self._pages))
+        self._write_object(
+            _PAGES_ID, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>".encode("ascii")
+        )
+        self._write_object(_CATALOG_ID, f"<< /Type /Catalog /Pages {_PAGES_ID} 0 R >>".encode("ascii"))
+
+        xref_offset = self._file.tell()
+        self._file.write(f"xref\n0 {self._next_id}\n".encode("ascii"))
+        self._file.write(b"0000000000 65535 f \n")
+        for obj_id in range(1, self._next_id):
+            self._file.write(f"{self._offsets[obj_id]:010d} 00000 n \n".encode("ascii"))
+        self._file.write(
+            (
+                f"trailer\n<< /Size {self._next_id} /Root {_CATALOG_ID} 0 R >>\n"
+                f"startxref\n{xref_offset}\n%%EOF\n"
+            ).encode("ascii")
+        )
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        """Discard the partially written file."""
+
+        if not self._file.closed:
+            self._file.close()
+        self._tmp_path.unlink(missing_ok=True)
@@ -0,0 +1,104 @@
+"""Lightweight in-process pub/sub for book progress events.
+
+`generate_story` publishes per-page events (submitted, poll, downloaded,
+rendered, pdf_written) to a topic named after the book/job ID, and
+`poll_generation` adds the status of each poll. The job manager and the
+Server-Sent Events endpoint subscribe to those topics, so any number of
+browsers can watch a book without polling the server.
+
+Code running inside a book (including its page worker threads) publishes
+with `publish_current`, which reads the topic and page from context
+variables set by `generate_story`.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+
+# Late subscribers get the tail of a topic so they can catch up.
+HISTORY_PER_TOPIC = 200
+# Topics with no activity for this long are forgotten.
+TOPIC_TTL_SECONDS = 3600
+
+current_topic: contextvars.ContextVar[str | None] = contextvars.ContextVar("current_topic", default=None)
+current_page: contextvars.ContextVar[int | None] = contextvars.ContextVar("current_page", default=None)
+
+
+class EventBus:
+    """Thread-safe topic → subscriber fan-out with a short replay history."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, dict[int, Callable[[dict], None]]] = {}
+        self._history: dict[str, deque] = {}
+        self._touched: dict[str, float] = {}
+        self._ids = itertools.count(1)
+
+    def publish(self, topic: str, event: dict[str, Any]) -> None:
+        event = {"ts": time.time(), **event}
+        with self._lock:
+            self._history.setdefault(topic, deque(maxlen=HISTORY_PER_TOPIC)).append(event)
+            self._touched[topic] = event["ts"]
+            callbacks = list(self._subscribers.get(topic, {}).values())
+            self._forget_stale_locked(event["ts"])
+        for callback in callbacks:
+            callback(event)
+
+    def subscribe(self, topic: str, callback: Callable[[dict], None], replay: bool = False) -> int:
+        """Call `callback(event)` for every event on `topic`; returns a token."""
+
+        with self._lock:
+            token = next(self._ids)
+            self._subscribers.setdefault(topic, {})[token] = callback
+            history = list(self._history.get(topic, ())) if replay else []
+        for event in history:
+            callback(event)
+        return token
+
+    def unsubscribe(self, topic: str, token: int) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.pop(token, None)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def open_queue(self, topic: str, replay: bool = True, maxsize: int = 1000) -> tuple[int, queue.Queue]:
+        """Subscribe with a bounded queue (for streaming responses)."""
+
+        events: queue.Queue = queue.Queue(maxsize=maxsize)
+
+        def _put(event: dict) -> None:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                pass  # A stalled client must not block the book.
+
+        return self.subscribe(topic, _put, replay=replay), events
+
+    def _forget_stale_locked(self, now: float) -> None:
+        for topic, touched in list(self._touched.items()):
+            if now - touched > TOPIC_TTL_SECONDS and topic not in self._subscribers:
+                self._history.pop(topic, None)
+                del self._touched[topic]
+
+
+bus = EventBus()
+
+
+def publish_current(**event: Any) -> None:
+    """Publish to the book running in this context; a no-op outside a book."""
+
+    topic = current_topic.get()
+    if topic is None:
+        return
+    page = current_page.get()
+    if page is not None and "page" not in event:
+        event["page"] = page
+    bus.publish(topic, event)
@@ -0,0 +1,209 @@
+"""Process-wide rate limits for Leonardo calls.
+
+Every book fans out page requests of its own, so several books at once can
+burst far past Leonardo's quota. Each kind of call draws from its own token
+bucket (`submit`, `poll`, `download`) shared by all threads and event loops
+in the process. A 429 (or a 503 with `Retry-After`) pauses that bucket for
+the advertised time, and the caller retries instead of failing the book.
+A `Retry-After` longer than `LEONARDO_MAX_RETRY_AFTER` fails the call instead,
+so one response cannot stall every book in the process for an hour.
+
+Buckets hand out reservations: `reserve()` returns how long the caller must
+wait for its turn. Waiting is then a plain `time.sleep` or `asyncio.sleep`,
+so the blocking and asyncio clients share one budget.
+
+    LEONARDO_SUBMIT_RPS=0.5 LEONARDO_SUBMIT_BURST=3   # generations per second
+    LEONARDO_POLL_RPS=4     LEONARDO_POLL_BURST=8     # status GETs per second
+    LEONARDO_DOWNLOAD_RPS=8 LEONARDO_DOWNLOAD_BURST=16
+
+A rate of 0 disables that bucket.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import os
+import threading
+import time
+from typing import Any, Mapping
+
+from src.metrics import LEONARDO_THROTTLED
+
+SUBMIT = "submit"
+POLL = "poll"
+DOWNLOAD = "download"
+
+_DEFAULTS = {
+    SUBMIT: (0.5, 3),
+    POLL: (4.0, 8),
+    DOWNLOAD: (8.0, 16),
+}
+# Throttled responses retried per call before the book fails.
+MAX_THROTTLE_RETRIES = int(os.getenv("LEONARDO_MAX_THROTTLE_RETRIES", "8"))
+# Backoff when a 429 carries no Retry-After: 2, 4, 8 ... seconds, capped.
+MAX_BACKOFF_SECONDS = float(os.getenv("LEONARDO_MAX_BACKOFF", "60"))
+# Longest server-sent Retry-After honoured; a longer one fails the call.
+MAX_RETRY_AFTER_SECONDS = float(os.getenv("LEONARDO_MAX_RETRY_AFTER", "300"))
+
+
+class TokenBucket:
+    """Thread-safe token bucket that hands out wait times (may go into debt)."""
+
+    def __init__(self, name: str, rate: float, burst: int) -> None:
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = 0
+        self._throttled = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        # Caller holds the lock. No refill while paused by the server.
+        start = max(self._updated, self._paused_until)
+        if now > start:
+            self._tokens = min(self.burst, self._tokens + (now - start) * self.rate)
+        self._updated = max(now, self._updated)
+
+    def reserve(self) -> float:
+        """Take one token and return the seconds to wait before using it."""
+
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = max(0.0, self._paused_until - now)
+            if self._tokens < 0:
+                wait += -self._tokens / self.rate
+            return wait
+
+    def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            self._enter_wait()
+            try:
+                time.sleep(wait)
+            finally:
+                self._leave_wait()
+
+    async def acquire_async(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            self._enter_wait()
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._leave_wait()
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller back for `seconds` (the server said slow down)."""
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._throttled += 1
+
+    def _enter_wait(self) -> None:
+        with self._lock:
+            self._waiting += 1
+
+    def _leave_wait(self) -> None:
+        with self._lock:
+            self._waiting -= 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                "rate_per_second": self.rate,
+                "burst": self.burst,
+                "tokens": round(self._tokens, 2),
+                "queue_depth": self._waiting,
+                "paused_for": round(max(0.0, self._paused_until - now), 2),
+                "throttled_responses": self._throttled,
+            }
+
+
+def _bucket_from_env(kind: str) -> TokenBucket:
+    rate, burst = _DEFAULTS[kind]
+    prefix = f"LEONARDO_{kind.upper()}"
+    return TokenBucket(
+        kind,
+        rate=float(os.getenv(f"{prefix}_RPS", str(rate))),
+        burst=int(os.getenv(f"{prefix}_BURST", str(burst))),
+    )
+
+
+_buckets = {kind: _bucket_from_env(kind) for kind in _DEFAULTS}
+
+
+def limiter(kind: str) -> TokenBucket:
+    return _buckets[kind]
+
+
+def limiter_stats() -> dict[str, dict[str, Any]]:
+    return {kind: bucket.stats() for kind, bucket in _buckets.items()}
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds from a `Retry-After` header (delta-seconds or HTTP-date)."""
+
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def throttle_delay(status_code: int, headers: Mapping[str, str], retries: int) -> float | None:
+    """Backoff for a throttled response, or None if it was not throttled.
+
+    429 always counts; 503 only when the server names a `Retry-After`.
+    """
+
+    retry_after = parse_retry_after(headers.get("Retry-After"))
+    if status_code == 429 or (status_code == 503 and retry_after is not None):
+        if retry_after is None:
+            retry_after = min(MAX_BACKOFF_SECONDS, 2.0 ** (retries + 1))
+        return retry_after
+    return None
+
+
+def note_throttled(kind: str, status_code: int, delay: float, retries: int) -> None:
+    """Pause `kind` after a throttled response, or give up.
+
+    Gives up after `MAX_THROTTLE_RETRIES`, or when the server asks for a wait
+    longer than `MAX_RETRY_AFTER_SECONDS`; the bucket then pauses only for
+    that maximum.
+    """
+
+    if retries >= MAX_THROTTLE_RETRIES:
+        raise RuntimeError(
+            f"Leonardo kept rate limiting {kind} requests ({status_code}) after "
+            f"{retries} retries. Lower LEONARDO_{kind.upper()}_RPS or try again later."
+        )
+    if delay > MAX_RETRY_AFTER_SECONDS:
+        LEONARDO_THROTTLED.inc(kind=kind)
+        limiter(kind).pause(MAX_RETRY_AFTER_SECONDS)
+        raise RuntimeError(
+            f"Leonardo kept rate limiting {kind} requests ({status_code}) and asked to wait "
+            f"{delay:.0f}s, longer than LEONARDO_MAX_RETRY_AFTER ({MAX_RETRY_AFTER_SECONDS:.0f}s). "
+            "Try again later."
+        )
+    print(f"Leonardo throttled a {kind} request ({status_code}); backing off {delay:.1f}s")
+    LEONARDO_THROTTLED.inc(kind=kind)
+    limiter(kind).pause(delay)
@@ -0,0 +1,143 @@
+"""Process pool for the CPU-bound render stage of the book pipeline.
+
+Decoding the downloaded PNG, drawing the text panel and JPEG-encoding each
+export profile is pure Pillow work. Running it inline serialized it with the
+network waits and kept it on one core. `submit_render` runs it in a shared
+process pool instead, so rendering overlaps with generation and a server
+building several books uses every core. Workers return only the encoded JPEG
+bytes, which are much smaller than the bitmaps.
+
+Render time is recorded in `story_stage_seconds{stage="render"}` as measured
+inside the worker, so it excludes time spent queued for a worker.
+
+A freshly downloaded page is submitted as the encoded image bytes already in
+memory, so the worker decodes from a buffer instead of reading the file back.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Sequence
+
+from src.export_profiles import EncodedPage, ExportProfile
+from src.metrics import STORY_STAGE_SECONDS
+
+# 0 renders inline on the calling thread (useful for debugging).
+RENDER_WORKERS = int(os.getenv("STORY_RENDER_WORKERS", str(os.cpu_count() or 1)))
+# Rendered-but-unwritten pages allowed per book before the pipeline waits.
+RENDER_QUEUE_DEPTH = int(os.getenv("STORY_RENDER_QUEUE_DEPTH", str(max(2, RENDER_WORKERS * 2))))
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def render_page_job(
+    image: str | bytes,
+    text: str,
+    title: str,
+    profiles: Sequence[ExportProfile],
+    page_size: int | None = None,
+) -> dict[str, EncodedPage]:
+    """Render one page and encode it for each profile (runs in a worker).
+
+    `image` is a file path or the encoded image itself. Smaller source
+    images (preview proofs) are scaled up to `page_size` first so the text
+    panel lays out exactly as it will in the final book.
+    """
+
+    from PIL import Image
+
+    from src.export_profiles import encode_page
+    from src.generate_story import render_page_with_text
+
+    with Image.open(io.BytesIO(image) if isinstance(image, bytes) else image) as source:
+        img = source.convert("RGB")
+    if page_size and img.width < page_size:
+        img = img.resize((page_size, round(img.height * page_size / img.width)), Image.LANCZOS)
+    page_img = render_page_with_text(img, text, title=title)
+    return encode_page(page_img, profiles)
+
+
+def _timed_render_job(*args) -> tuple[dict[str, EncodedPage], float]:
+    started = time.perf_counter()
+    encoded = render_page_job(*args)
+    return encoded, time.perf_counter() - started
+
+
+def get_render_pool() -> ProcessPoolExecutor | None:
+    """Return the process-wide render pool (None when rendering inline)."""
+
+    global _pool
+    if RENDER_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # "spawn" avoids forking a process that already runs threads.
+            _pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def submit_render(
+    image: Path | bytes,
+    text: str,
+    title: str,
+    profiles: Sequence[ExportProfile],
+    page_size: int | None = None,
+) -> Future:
+    args = (image if isinstance(image, bytes) else str(image), text, title, list(profiles), page_size)
+    # The metric is recorded in the caller's context so it reaches the book's log.
+    context = contextvars.copy_context()
+    future: Future = Future()
+
+    def _resolve(job: Future) -> None:
+        try:
+            encoded, seconds = job.result()
+        except BaseException as exc:  # noqa: BLE001
+            future.set_exception(exc)
+            return
+        context.run(STORY_STAGE_SECONDS.observe, seconds, stage="render")
+        future.set_result(encoded)
+
+    pool = get_render_pool()
+    if pool is not None:
+        try:
+            job = pool.submit(_timed_render_job, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a fresh pool once.
+            _discard_pool(pool)
+            job = get_render_pool().submit(_timed_render_job, *args)
+        job.add_done_callback(_resolve)
+        return future
+    job = Future()
+    try:
+        job.set_result(_timed_render_job(*args))
+    except Exception as exc:  # noqa: BLE001
+        job.set_exception(exc)
+    _resolve(job)
+    return future
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_render_pool(wait: bool = True) -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait)
@@ -0,0 +1,116 @@
+"""Retry policies for transient Leonardo failures.
+
+Errors worth another try (a 5xx, a dropped connection, a CDN hiccup, a
+generation that came back `FAILED`) are raised as `RetryableError`; anything
+else (a bad key, a rejected prompt) is not retried. Because
+`RetryableError` is a `RuntimeError`, callers that only catch `RuntimeError`
+keep working.
+
+Each step retries on its own: a failed download fetches the same image URL
+again, and a lost poll or a poll that runs out of time re-checks the same
+generation, so neither buys a new image. Only a generation that Leonardo
+itself failed (`GenerationFailedError`) is started over under `PAGE_POLICY`;
+a page whose download or polling still fails after that is marked failed.
+
+    LEONARDO_RETRY_ATTEMPTS=3       # tries per request (submit, poll, download)
+    LEONARDO_RETRY_BASE_DELAY=1     # first backoff in seconds, doubled per try
+    LEONARDO_RETRY_MAX_DELAY=30
+    STORY_PAGE_ATTEMPTS=3           # full generations per page before the book fails
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, TypeVar
+
+from src.metrics import REQUEST_RETRIES
+from src.progress_events import current_page, publish_current
+
+T = TypeVar("T")
+
+
+class RetryableError(RuntimeError):
+    """A failure that may succeed if the same step is tried again."""
+
+
+class GenerationFailedError(RetryableError):
+    """Leonardo reported the generation FAILED; only a new generation can help."""
+
+
+class GenerationTimeoutError(RetryableError):
+    """Polling gave up while the generation was still running; poll it again."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    return isinstance(exc, RetryableError)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+
+    def delay(self, attempt: int) -> float:
+        """Backoff after failed `attempt` (1-based): full jitter, doubling, capped."""
+
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    def call(
+        self, step: str, func: Callable[[], T], retry_on: type[RetryableError] = RetryableError
+    ) -> T:
+        """Run `func`, retrying `retry_on` errors up to `attempts` times in total."""
+
+        attempt = 1
+        while True:
+            try:
+                return func()
+            except retry_on as exc:
+                if attempt >= self.attempts:
+                    raise
+                delay = self._note_retry(step, attempt, exc)
+            time.sleep(delay)
+            attempt += 1
+
+    async def call_async(
+        self, step: str, func: Callable[[], Awaitable[T]], retry_on: type[RetryableError] = RetryableError
+    ) -> T:
+        attempt = 1
+        while True:
+            try:
+                return await func()
+            except retry_on as exc:
+                if attempt >= self.attempts:
+                    raise
+                delay = self._note_retry(step, attempt, exc)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _note_retry(self, step: str, attempt: int, exc: Exception) -> float:
+        delay = self.delay(attempt)
+        page = current_page.get()
+        where = f"Page {page}: " if page is not None else ""
+        reason = str(exc).rstrip(". ")
+        print(f"{where}{step} failed (attempt {attempt}/{self.attempts}): {reason}. Retrying in {delay:.1f}s")
+        REQUEST_RETRIES.inc(step=step)
+        publish_current(status="retrying", step=step, attempt=attempt, error=str(exc))
+        return delay
+
+
+def _policy_from_env(attempts_var: str, default_attempts: int) -> RetryPolicy:
+    return RetryPolicy(
+        attempts=max(1, int(os.getenv(attempts_var, str(default_attempts)))),
+        base_delay=float(os.getenv("LEONARDO_RETRY_BASE_DELAY", "1")),
+        max_delay=float(os.getenv("LEONARDO_RETRY_MAX_DELAY", "30")),
+    )
+
+
+# One Leonardo request: submit, a poll GET or an image download.
+REQUEST_POLICY = _policy_from_env("LEONARDO_RETRY_ATTEMPTS", 3)
+# A whole page (new generation), only when Leonardo fails the generation itself.
+PAGE_POLICY = _policy_from_env("STORY_PAGE_ATTEMPTS", 3)
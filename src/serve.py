@@ -0,0 +1,215 @@
+"""Production entry point for the web app: `python -m src.serve`.
+
+`src.server.main` is the Flask development server (one process, reloader and
+debugger on). This module serves the same app with:
+
+- gunicorn (Linux/macOS): `STORY_SERVE_WORKERS` processes, each with
+  `STORY_SERVE_THREADS` threads (gthread workers);
+- waitress (Windows, or when gunicorn is not installed): one process with
+  `STORY_SERVE_THREADS` threads.
+
+On SIGTERM/SIGINT the server stops accepting connections, finishes in-flight
+requests and then drains running book jobs for up to
+`STORY_SERVE_DRAIN_TIMEOUT` seconds. Job state lives in SQLite, so status,
+events and downloads work from any worker. A book cut off by the drain limit
+resumes from its manifest when it is submitted again. When a worker dies, the
+arbiter marks its unfinished jobs failed so their books can be submitted again.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import signal
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+
+@dataclass
+class ServeSettings:
+    bind: str = "127.0.0.1:5000"
+    workers: int = 2
+    threads: int = 8
+    # gunicorn: heartbeat timeout. The arbiter kills a worker process whose
+    # main loop has not checked in for this long. With gthread workers a slow
+    # request on a worker thread does not trip it; there is no per-request limit.
+    # waitress: close connections that have been idle this long.
+    timeout: int = 60
+    keepalive: int = 5
+    # Seconds to let running book jobs finish on shutdown.
+    drain_timeout: int = 600
+    backend: str = "auto"
+
+    @classmethod
+    def from_env(cls) -> "ServeSettings":
+        defaults = cls()
+        return cls(
+            bind=os.getenv("STORY_SERVE_BIND", defaults.bind),
+            workers=int(os.getenv("STORY_SERVE_WORKERS", str(defaults.workers))),
+            threads=int(os.getenv("STORY_SERVE_THREADS", str(defaults.threads))),
+            timeout=int(os.getenv("STORY_SERVE_TIMEOUT", str(defaults.timeout))),
+            keepalive=int(os.getenv("STORY_SERVE_KEEPALIVE", str(defaults.keepalive))),
+            drain_timeout=int(os.getenv("STORY_SERVE_DRAIN_TIMEOUT", str(defaults.drain_timeout))),
+            backend=os.getenv("STORY_SERVE_BACKEND", defaults.backend).strip().lower(),
+        )
+
+    @property
+    def host_port(self) -> tuple[str, int]:
+        host, _, port = self.bind.rpartition(":")
+        return host or "127.0.0.1", int(port)
+
+
+def _choose_backend(requested: str) -> str:
+    if requested not in ("auto", "gunicorn", "waitress"):
+        raise ValueError(f"Unknown STORY_SERVE_BACKEND: {requested}")
+    if requested != "auto":
+        return requested
+    if sys.platform != "win32":
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            return "gunicorn"
+    return "waitress"
+
+
+def _limit_render_workers(processes: int) -> None:
+    # Every server process gets its own render pool; share the cores out
+    # instead of starting cpu_count render processes per worker.
+    per_process = max(1, (os.cpu_count() or 1) // max(1, processes))
+    os.environ.setdefault("STORY_RENDER_WORKERS", str(per_process))
+
+
+def _fail_unfinished_jobs() -> None:
+    from src.db import close_connection, init_db
+    from src.jobs import JobStore
+
+    init_db()
+    failed = JobStore().fail_unfinished()
+    if failed:
+        print(f"Marked {failed} job(s) from the previous run as failed")
+    # Don't carry this thread's SQLite connection into forked workers.
+    close_connection()
+
+
+def _fail_worker_jobs(pid: int) -> None:
+    from src.db import close_connection
+    from src.jobs import JobStore
+
+    try:
+        failed = JobStore().release_worker(pid)
+    except Exception as exc:  # noqa: BLE001
+        print(f"Could not release the jobs of worker {pid}: {exc}")
+        return
+    finally:
+        close_connection()
+    if failed:
+        print(f"Marked {failed} job(s) of worker {pid} as failed")
+
+
+def run_gunicorn(settings: ServeSettings) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    def on_starting(server) -> None:
+        _fail_unfinished_jobs()
+
+    def post_worker_init(worker) -> None:
+        from src.server import start_background
+
+        start_background()
+
+    def worker_exit(server, worker) -> None:
+        from src.server import shutdown
+
+        shutdown(drain=True)
+
+    def child_exit(server, worker) -> None:
+        # Runs in the arbiter, also when a worker was killed (heartbeat
+        # timeout, OOM) and never reached `worker_exit`.
+        _fail_worker_jobs(worker.pid)
+
+    options = {
+        "bind": settings.bind,
+        "workers": settings.workers,
+        "threads": settings.threads,
+        "worker_class": "gthread",
+        "timeout": settings.timeout,
+        "graceful_timeout": settings.drain_timeout,
+        "keepalive": settings.keepalive,
+        "on_starting": on_starting,
+        "post_worker_init": post_worker_init,
+        "worker_exit": worker_exit,
+        "child_exit": child_exit,
+        "accesslog": os.getenv("STORY_SERVE_ACCESS_LOG") or None,
+    }
+
+    class StoryApplication(BaseApplication):
+        def load_config(self) -> None:
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from src.server import app
+
+            return app
+
+    StoryApplication().run()
+
+
+def run_waitress(settings: ServeSettings) -> None:
+    try:
+        import waitress
+    except ImportError as exc:
+        raise RuntimeError("No production server installed. Run: pip install -r requirements.txt") from exc
+
+    _fail_unfinished_jobs()
+    from src.server import app, shutdown, start_background
+
+    if settings.workers > 1:
+        print("waitress runs a single process; STORY_SERVE_WORKERS is ignored")
+    # waitress stops on KeyboardInterrupt; treat SIGTERM the same way.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    start_background()
+    host, port = settings.host_port
+    try:
+        waitress.serve(
+            app,
+            host=host,
+            port=port,
+            threads=settings.threads,
+            channel_timeout=settings.timeout,
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown(drain=True)
+
+
+def main(argv: list[str] | None = None) -> None:
+    settings = ServeSettings.from_env()
+    parser = argparse.ArgumentParser(description="Serve the storybook web app in production.")
+    parser.add_argument("--bind", default=settings.bind, help=f"host:port (default: {settings.bind})")
+    parser.add_argument("--workers", type=int, default=settings.workers, help="Worker processes (gunicorn)")
+    parser.add_argument("--threads", type=int, default=settings.threads, help="Threads per worker")
+    parser.add_argument("--backend", default=settings.backend, choices=["auto", "gunicorn", "waitress"])
+    args = parser.parse_args(argv)
+    settings.bind, settings.workers, settings.threads = args.bind, max(1, args.workers), max(1, args.threads)
+
+    backend = _choose_backend(args.backend)
+    print(f"Serving on {settings.bind} with {backend}: {settings.workers} worker(s) x {settings.threads} threads")
+    if backend == "gunicorn":
+        _limit_render_workers(settings.workers)
+        run_gunicorn(settings)
+    else:
+        _limit_render_workers(1)
+        run_waitress(settings)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,148 @@
 from __future__ import annotations
 
+import json
+import os
+import queue
+import secrets
 import sys
 import time
 from pathlib import Path
+from urllib.parse import quote
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_file, send_from_directory, stream_with_context
 
 ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
-from src.generate_story import generate_story, STORY_TEMPLATES
+from src.db import (
+    close_connection,
+    count_story_meta,
+    get_user_by_token,
+    init_db,
+    list_story_meta,
+    start_token_sweeper,
+    stop_token_sweeper,
+)
+from src.generate_story import OUTPUT_DIR, generate_story
+from src.generation_cache import get_generation_cache
+from src.http_session import close_sessions
+from src.jobs import STATE_COMPLETE, STATE_FAILED, JobManager, JobStore
+from src.leonardo_client import is_image_url_allowed
+from src.metrics import HTTP_REQUEST_SECONDS, Gauge, render_prometheus
+from src.progress_events import bus
+from src.rate_limit import limiter_stats
+from src.render_pool import shutdown_render_pool
+from src.story_catalog import get_catalog
+from src.webhooks import extract_generation, notify_generation, webhook_secret
 from config.models import MODELS
 
 app = Flask(__name__, static_folder=str(ROOT / "frontend"), static_url_path="")
+# Apache mod_xsendfile / lighttpd: let the front server send file bodies.
+app.config["USE_X_SENDFILE"] = os.getenv("STORY_X_SENDFILE", "").strip().lower() in ("1", "true", "yes")
+init_db()
+jobs = JobManager(generate_story, store=JobStore())
+
+# Comment lines sent on idle streams so proxies keep the connection open.
+SSE_HEARTBEAT_SECONDS = 15
+# How often a stream re-reads a job that another worker process is running.
+SSE_STORE_POLL_SECONDS = 1.0
+# Story library page sizes.
+STORY_PAGE_SIZE = 20
+STORY_PAGE_MAX = 100
+# nginx: internal location mapped to OUTPUT_DIR (e.g. "/protected-books/").
+# When set, downloads are handed off with X-Accel-Redirect.
+ACCEL_REDIRECT_PREFIX = os.getenv("STORY_X_ACCEL_PREFIX", "").strip()
+# Bearer token for the all-users library; the admin API is off when unset.
+ADMIN_TOKEN = os.getenv("STORY_ADMIN_TOKEN", "").strip()
+
+
+Gauge("story_jobs_active", "Book jobs queued or running in this process.", lambda: {(): jobs.active_count()})
+Gauge(
+    "leonardo_limiter_queue_depth",
+    "Calls waiting for a Leonardo rate-limit token.",
+    lambda: {(kind,): stats["queue_depth"] for kind, stats in limiter_stats().items()},
+    ("kind",),
+)
+
+
+@app.before_request
+def _start_timer() -> None:
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response: Response) -> Response:
+    started = g.get("request_started")
+    if started is not None:
+        # The route pattern, not the path, keeps job IDs out of the labels.
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started, method=request.method, route=route, status=response.status_code
+        )
+    return response
+
+
+def _bearer_token() -> str:
+    auth = request.headers.get("Authorization", "")
+    return (auth[7:] if auth.lower().startswith("bearer ") else auth).strip()
+
+
+def _token_matches(token: str, expected: str) -> bool:
+    # Compare bytes: compare_digest raises TypeError on non-ASCII str.
+    return secrets.compare_digest(token.encode("utf-8"), expected.encode("utf-8"))
+
+
+def _story_page(user_id: int | None):
+    """One keyset page of the story library: `?q=&limit=&cursor=`."""
+
+    try:
+        limit = min(max(int(request.args.get("limit", STORY_PAGE_SIZE)), 1), STORY_PAGE_MAX)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    before = None
+    cursor = request.args.get("cursor", "").strip()
+    if cursor:
+        try:
+            created_at, story_id = (int(part) for part in cursor.split(".", 1))
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        before = (created_at, story_id)
+    query = request.args.get("q", "").strip() or None
+
+    # One extra row tells us whether another page exists.
+    stories = list_story_meta(user_id, limit=limit + 1, before=before, query=query)
+    next_cursor = None
+    if len(stories) > limit:
+        stories = stories[:limit]
+        next_cursor = f"{stories[-1]['created_at']}.{stories[-1]['id']}"
+    return jsonify(
+        {
+            "stories": stories,
+            "next_cursor": next_cursor,
+            "total": count_story_meta(user_id, query=query),
+        }
+    )
 
 
 @app.route("/api/templates", methods=["GET"])
 def api_templates():
-    templates = [
-        {"key": key, "title": meta["title"], "json": str(meta["json_path"])}
-        for key, meta in STORY_TEMPLATES.items()
-    ]
-    return jsonify({"templates": templates})
+    """Story templates from `data/`, revalidated with an ETag."""
+
+    catalog = get_catalog()
+    etag = catalog.version()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        templates = [
+            {"key": t.key, "title": t.title, "json": str(t.path), "page_count": t.page_count}
+            for t in catalog.templates()
+        ]
+        response = jsonify({"templates": templates})
+    response.set_etag(etag)
+    # Let browsers cache but check back every time; the check is a 304.
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route("/api/models", methods=["GET"])
@@ -34,6 +154,44 @@ def api_models():
     return jsonify({"models": models})
 
 
+@app.route("/api/cache/stats", methods=["GET"])
+def api_cache_stats():
+    return jsonify(get_generation_cache().stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Counters and per-stage histograms in the Prometheus text format."""
+
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/leonardo/limits", methods=["GET"])
+def api_leonardo_limits():
+    """Per-bucket rate limit state, including how many calls are queued."""
+
+    return jsonify(limiter_stats())
+
+
+@app.route("/api/stories", methods=["GET"])
+def api_stories():
+    """The signed-in user's saved stories (bearer token from login)."""
+
+    user = get_user_by_token(_bearer_token())
+    if user is None:
+        return jsonify({"error": "Login required"}), 401
+    return _story_page(int(user["id"]))
+
+
+@app.route("/api/admin/stories", methods=["GET"])
+def api_admin_stories():
+    """Every user's stories, for the admin view (`STORY_ADMIN_TOKEN`)."""
+
+    if not ADMIN_TOKEN or not _token_matches(_bearer_token(), ADMIN_TOKEN):
+        return jsonify({"error": "Admin token required"}), 403
+    return _story_page(None)
+
+
 @app.route("/api/generate", methods=["POST"])
 def api_generate():
     def _coerce_value(field: str) -> str:
@@ -45,24 +203,198 @@ def api_generate():
     story_key = _coerce_value("story").strip().lower()
     model_key = _coerce_value("model").strip()
     child_name = _coerce_value("child_name").strip()
+    preview = _coerce_value("preview").strip().lower() in ("1", "true", "on", "yes")
     # no image upload in this flow
 
-    if story_key not in STORY_TEMPLATES:
+    template = get_catalog().get(story_key)
+    if template is None:
         return jsonify({"error": "Invalid story key"}), 400
     if not child_name:
         return jsonify({"error": "Child name required"}), 400
+    story_key = template.key
 
     try:
-        pdf_path = generate_story(
-            story_key=story_key,
-            child_name=child_name,
-            # child_image_path=img_path,
-            model_key=model_key or None,
+        job = jobs.submit(
+            story_key=story_key, child_name=child_name, model_key=model_key or None, preview=preview
         )
-    except Exception as exc:
-        return jsonify({"error": str(exc)}), 500
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 409
+    return (
+        jsonify({"ok": True, "job_id": job.id, "status_url": f"/api/jobs/{job.id}"}),
+        202,
+        {"Location": f"/api/jobs/{job.id}"},
+    )
 
-    return jsonify({"ok": True, "pdf": str(pdf_path)})
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def api_job_status(job_id: str):
+    snapshot = jobs.snapshot(job_id)
+    if snapshot is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(snapshot)
+
+
+@app.route("/api/jobs/<job_id>/approve", methods=["POST"])
+def api_job_approve(job_id: str):
+    """Queue the full-resolution book for a finished preview job."""
+
+    try:
+        final = jobs.approve(job_id)
+    except KeyError:
+        return jsonify({"error": "Unknown job"}), 404
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 409
+    return (
+        jsonify({"ok": True, "job_id": final.id, "status_url": f"/api/jobs/{final.id}"}),
+        202,
+        {"Location": f"/api/jobs/{final.id}"},
+    )
+
+
+@app.route("/api/jobs/<job_id>/pages/<int:page>/swap", methods=["POST"])
+def api_job_swap_page(job_id: str, page: int):
+    """Swap a stored alternate image into one page and rebuild the PDF."""
+
+    try:
+        job = jobs.swap_page(job_id, page)
+    except KeyError:
+        return jsonify({"error": "Unknown job"}), 404
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 409
+    return jsonify({"ok": True, "page": page, **(job.result or {})})
+
+
+@app.route("/api/jobs/<job_id>/pdf", methods=["GET", "HEAD"])
+def api_job_pdf(job_id: str):
+    """Download a finished book (`?inline=1` to view it in the browser).
+
+    Served with a strong ETag and Last-Modified; Range, If-Range,
+    If-None-Match and If-Modified-Since are handled by `send_file`, and the
+    body is streamed from disk rather than read into the worker. PDFs are
+    replaced atomically, so mtime and size identify the content.
+    """
+
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if not job.pdf_path:
+        return jsonify({"error": f"Book is {job.state}"}), 409
+    path = Path(job.pdf_path).resolve()
+    if not path.is_relative_to(OUTPUT_DIR.resolve()) or not path.is_file():
+        return jsonify({"error": "PDF is no longer available"}), 410
+
+    stat = path.stat()
+    etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    as_attachment = request.args.get("inline", "").lower() not in ("1", "true", "yes")
+    if ACCEL_REDIRECT_PREFIX:
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            relative = quote(path.relative_to(OUTPUT_DIR.resolve()).as_posix())
+            response = Response(mimetype="application/pdf")
+            response.headers["X-Accel-Redirect"] = f"{ACCEL_REDIRECT_PREFIX.rstrip('/')}/{relative}"
+            try:
+                path.name.encode("ascii")
+                names = {"filename": path.name}
+            except UnicodeEncodeError:
+                names = {"filename*": f"UTF-8''{quote(path.name)}"}
+            response.headers.set("Content-Disposition", "attachment" if as_attachment else "inline", **names)
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        return response
+    return send_file(
+        path,
+        mimetype="application/pdf",
+        as_attachment=as_attachment,
+        download_name=path.name,
+        conditional=True,
+        etag=etag,
+        last_modified=stat.st_mtime,
+        max_age=0,
+    )
+
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def api_job_events(job_id: str):
+    """Stream a job's progress as Server-Sent Events until it finishes."""
+
+    snapshot = jobs.snapshot(job_id)
+    if snapshot is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    def _format(event_type: str, data: dict) -> str:
+        return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+    def _stream_from_store():
+        # Another worker process runs this job, so its events never reach
+        # this process's bus: follow the stored snapshot instead.
+        last = None
+        idle = 0.0
+        while True:
+            current = jobs.snapshot(job_id) or snapshot
+            if current != last:
+                yield _format("snapshot", current)
+                if current["state"] in (STATE_COMPLETE, STATE_FAILED):
+                    return
+                last, idle = current, 0.0
+            elif idle >= SSE_HEARTBEAT_SECONDS:
+                yield ": keep-alive\n\n"
+                idle = 0.0
+            time.sleep(SSE_STORE_POLL_SECONDS)
+            idle += SSE_STORE_POLL_SECONDS
+
+    def _stream():
+        if not jobs.is_local(job_id):
+            yield from _stream_from_store()
+            return
+        token, events = bus.open_queue(job_id, replay=False)
+        try:
+            # Current state first, so late subscribers don't need the history.
+            current = jobs.snapshot(job_id) or snapshot
+            yield _format("snapshot", current)
+            if current["state"] in (STATE_COMPLETE, STATE_FAILED):
+                return
+            while True:
+                try:
+                    event = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _format("progress", event)
+                if event.get("status") in (STATE_COMPLETE, STATE_FAILED):
+                    return
+        finally:
+            bus.unsubscribe(job_id, token)
+
+    return Response(
+        stream_with_context(_stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/leonardo/webhook", methods=["POST"])
+def api_leonardo_webhook():
+    """Receive generation-complete callbacks and wake the waiting page task.
+
+    Off (404) unless `LEONARDO_WEBHOOK_SECRET` is set: an unauthenticated
+    callback could otherwise hand a page any image URL.
+    """
+
+    secret = webhook_secret()
+    if not secret:
+        return jsonify({"error": "Not found"}), 404
+    if not _token_matches(_bearer_token(), secret):
+        return jsonify({"error": "Invalid webhook secret"}), 401
+
+    generation = extract_generation(request.get_json(silent=True) or {})
+    if generation is None:
+        return jsonify({"error": "Payload has no generation id"}), 400
+    urls = [image.get("url") for image in generation.get("generated_images") or [] if isinstance(image, dict)]
+    if not all(isinstance(url, str) and is_image_url_allowed(url) for url in urls if url):
+        return jsonify({"error": "Image URLs must point at Leonardo's CDN"}), 400
+    woken = notify_generation(generation)
+    return jsonify({"ok": True, "generation_id": generation["id"], "woken": woken})
 
 
 @app.route("/", defaults={"path": "index.html"})
@@ -71,7 +403,29 @@ def serve_frontend(path: str):
     return send_from_directory(app.static_folder, path)
 
 
+def start_background() -> None:
+    """Start per-process housekeeping (call once in each serving process)."""
+
+    start_token_sweeper()
+
+
+def shutdown(drain: bool = True) -> None:
+    """Stop taking jobs, let running books finish (`drain`), release resources."""
+
+    active = jobs.active_count()
+    if drain and active:
+        print(f"Draining {active} book job(s) before exit...")
+    jobs.shutdown(wait=drain)
+    shutdown_render_pool(wait=drain)
+    stop_token_sweeper()
+    close_sessions()
+    close_connection()
+
+
 def main() -> None:
+    """Development server (reloader and debugger on). Use `python -m src.serve` in production."""
+
+    JobStore().fail_unfinished()
     app.run(debug=True)
 
 
@@ -0,0 +1,193 @@
+"""Story template catalog discovered from `data/pages_*.json`.
+
+Each file is parsed, validated (every page needs an integer `page`, plus
+`text` and `scene` strings) and sorted once, then kept in memory. It is
+re-parsed only when its mtime or size changes, so adding or editing a story
+file needs no code change or restart. Keys follow the original
+`<name>_<page count>` scheme (`dragons_20`); the bare name (`dragons`) also
+resolves.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+DATA_DIR = ROOT / "data"
+# Seconds between directory rescans; lookups in between use the cached view.
+RECHECK_SECONDS = float(os.getenv("STORY_TEMPLATE_RECHECK", "2"))
+
+# Titles for stories whose PDFs predate the catalog; others derive from the name.
+KNOWN_TITLES = {
+    "dragons": "Dragon Valley Adventures",
+    "vacation": "Vacation Adventures",
+}
+REQUIRED_FIELDS = {"page": int, "text": str, "scene": str}
+
+
+@dataclass(frozen=True)
+class StoryTemplate:
+    key: str
+    name: str
+    title: str
+    path: Path
+    pages: tuple[dict, ...]
+    mtime_ns: int
+    size: int
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+
+def template_name(path: Path) -> str:
+    return path.stem.lower().removeprefix("pages_")
+
+
+def default_title(name: str) -> str:
+    return KNOWN_TITLES.get(name) or name.replace("_", " ").title()
+
+
+def parse_pages(path: Path) -> list[dict]:
+    """Read and validate a pages file; raise ValueError if it is malformed."""
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            pages = json.load(f)
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"{path.name}: invalid JSON ({exc})") from exc
+    if not isinstance(pages, list) or not pages:
+        raise ValueError(f"{path.name}: expected a non-empty list of pages")
+    seen: set[int] = set()
+    for index, page in enumerate(pages):
+        if not isinstance(page, dict):
+            raise ValueError(f"{path.name}: entry {index} is not an object")
+        for field, kind in REQUIRED_FIELDS.items():
+            value = page.get(field)
+            if not isinstance(value, kind) or isinstance(value, bool) or (kind is str and not value.strip()):
+                raise ValueError(f"{path.name}: entry {index} needs a {kind.__name__} '{field}'")
+        if page["page"] in seen:
+            raise ValueError(f"{path.name}: page {page['page']} appears twice")
+        seen.add(page["page"])
+    return sorted(pages, key=lambda p: p["page"])
+
+
+class TemplateCatalog:
+    """Thread-safe, mtime-checked cache of parsed pages files."""
+
+    def __init__(self, data_dir: Path = DATA_DIR, recheck_seconds: float = RECHECK_SECONDS) -> None:
+        self.data_dir = data_dir
+        self.recheck_seconds = recheck_seconds
+        # Parsed files by path (catalog files and any `pages_for` path).
+        self._parsed: dict[Path, StoryTemplate] = {}
+        # Valid `pages_*.json` files found by the last scan.
+        self._members: set[Path] = set()
+        self._errors: dict[Path, str] = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, path: Path, stat: os.stat_result) -> StoryTemplate:
+        # Caller holds the lock.
+        cached = self._parsed.get(path)
+        if cached is not None and (cached.mtime_ns, cached.size) == (stat.st_mtime_ns, stat.st_size):
+            return cached
+        pages = parse_pages(path)
+        name = template_name(path)
+        template = StoryTemplate(
+            key=f"{name}_{len(pages)}",
+            name=name,
+            title=default_title(name),
+            path=path,
+            pages=tuple(pages),
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+        )
+        self._parsed[path] = template
+        return template
+
+    def refresh(self, force: bool = False) -> None:
+        """Rescan `data_dir`, re-parsing only new or changed files."""
+
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._checked_at < self.recheck_seconds:
+                return
+            self._checked_at = now
+            members: set[Path] = set()
+            errors: dict[Path, str] = {}
+            for path in sorted(self.data_dir.resolve().glob("pages_*.json")):
+                try:
+                    self._load(path, path.stat())
+                except (OSError, ValueError) as exc:
+                    if self._errors.get(path) != str(exc):
+                        print(f"Skipping story file: {exc}")
+                    errors[path] = str(exc)
+                    self._parsed.pop(path, None)
+                else:
+                    members.add(path)
+            for path in self._members - members:
+                self._parsed.pop(path, None)
+            self._members, self._errors = members, errors
+
+    def templates(self) -> list[StoryTemplate]:
+        self.refresh()
+        with self._lock:
+            return sorted((self._parsed[path] for path in self._members), key=lambda t: t.key)
+
+    def get(self, key: str) -> StoryTemplate | None:
+        key = key.strip().lower()
+        for template in self.templates():
+            if key in (template.key, template.name):
+                return template
+        return None
+
+    def for_path(self, path: Path) -> StoryTemplate | None:
+        """The catalog template read from `path`, if it is one of its files."""
+
+        path = Path(path).resolve()
+        for template in self.templates():
+            if template.path == path:
+                return template
+        return None
+
+    def errors(self) -> dict[str, str]:
+        self.refresh()
+        with self._lock:
+            return {path.name: error for path, error in self._errors.items()}
+
+    def pages_for(self, path: Path) -> list[dict]:
+        """Parsed pages for any pages file, cached until it changes on disk."""
+
+        path = Path(path).resolve()
+        with self._lock:
+            return list(self._load(path, path.stat()).pages)
+
+    def version(self) -> str:
+        """Return an ETag for the current catalog.
+
+        There is deliberately no Last-Modified: removing a template changes
+        the catalog without making any remaining file newer.
+        """
+
+        digest = hashlib.sha256()
+        for template in self.templates():
+            digest.update(f"{template.key}|{template.title}|{template.mtime_ns}|{template.size}\n".encode("utf-8"))
+        return digest.hexdigest()[:32]
+
+
+_catalog: TemplateCatalog | None = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> TemplateCatalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = TemplateCatalog()
+        return _catalog
@@ -0,0 +1,109 @@
+"""Cached text layout for the page text panels.
+
+Fonts are loaded once per size, word widths are memoized, and wrapping sums
+per-word widths in a single pass instead of re-measuring the whole line for
+every word. `fit_text` picks the largest font size (by binary search) whose
+wrapped text fits the panel, so long pages shrink instead of overflowing.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable
+
+from PIL import ImageFont
+
+FONT_CANDIDATES = ("arial.ttf", "Arial.ttf", "DejaVuSans.ttf")
+# Extra vertical space between wrapped lines, in pixels.
+LINE_SPACING = 6
+
+
+@dataclass(frozen=True)
+class TextBlock:
+    font_size: int
+    lines: tuple[str, ...]
+    line_height: int
+
+    @property
+    def height(self) -> int:
+        if not self.lines:
+            return 0
+        return len(self.lines) * (self.line_height + LINE_SPACING) - LINE_SPACING
+
+
+@lru_cache(maxsize=64)
+def get_font(size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
+    """Return the panel font at `size`, loading it from disk only once."""
+
+    for candidate in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:  # Pillow < 10.1 has no scalable default font
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=64)
+def line_height(size: int) -> int:
+    bbox = get_font(size).getbbox("Ag")
+    return bbox[3] - bbox[1]
+
+
+@lru_cache(maxsize=65536)
+def word_width(size: int, word: str) -> float:
+    return get_font(size).getlength(word)
+
+
+def wrap_words(text: str, size: int, max_width: float) -> list[str]:
+    """Greedy word wrap in one pass over the words, using memoized widths."""
+
+    return wrap_measured(text, lambda word: word_width(size, word), max_width)
+
+
+def wrap_measured(text: str, measure: Callable[[str], float], max_width: float) -> list[str]:
+    """Greedy word wrap that measures each word once and sums the widths."""
+
+    space = measure(" ")
+    lines: list[str] = []
+    line: list[str] = []
+    width = 0.0
+    for word in text.split():
+        w = measure(word)
+        if line and width + space + w > max_width:
+            lines.append(" ".join(line))
+            line, width = [word], w
+        else:
+            width = w if not line else width + space + w
+            line.append(word)
+    if line:
+        lines.append(" ".join(line))
+    return lines
+
+
+@lru_cache(maxsize=1024)
+def fit_text(
+    text: str,
+    max_width: int,
+    max_height: int,
+    max_size: int = 28,
+    min_size: int = 14,
+) -> TextBlock:
+    """Return the largest layout of `text` (down to `min_size`) that fits the box."""
+
+    def _layout(size: int) -> TextBlock:
+        return TextBlock(size, tuple(wrap_words(text, size, max_width)), line_height(size))
+
+    best = _layout(min_size)
+    low, high = min_size + 1, max_size
+    while low <= high:
+        mid = (low + high) // 2
+        block = _layout(mid)
+        if block.height <= max_height:
+            best, low = block, mid + 1
+        else:
+            high = mid - 1
+    return best
@@ -0,0 +1,68 @@
+"""Local stand-in for Leonardo's generation-complete webhook.
+
+POSTs the same `generations_by_pk` shape that `GET /generations/{id}` returns
+to a running server, so the webhook path can be exercised without a Leonardo
+account:
+
+    python -m src.webhook_standin <generation_id> --image-url https://...
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Any
+
+import requests
+
+DEFAULT_URL = "http://127.0.0.1:5000/api/leonardo/webhook"
+
+
+def build_payload(generation_id: str, image_urls: list[str], status: str = "COMPLETE") -> dict[str, Any]:
+    return {
+        "generations_by_pk": {
+            "id": generation_id,
+            "status": status,
+            "generated_images": [
+                {"id": f"{generation_id}-{index}", "url": url} for index, url in enumerate(image_urls)
+            ],
+        }
+    }
+
+
+def send_completion(
+    generation_id: str,
+    image_urls: list[str],
+    url: str = DEFAULT_URL,
+    status: str = "COMPLETE",
+    secret: str | None = None,
+) -> dict:
+    headers = {"authorization": f"Bearer {secret}"} if secret else {}
+    resp = requests.post(
+        url, json=build_payload(generation_id, image_urls, status), headers=headers, timeout=10
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="POST a fake generation-complete webhook")
+    parser.add_argument("generation_id", help="Generation ID the server is waiting on")
+    parser.add_argument("--image-url", action="append", default=[], help="Image URL (repeatable)")
+    parser.add_argument("--status", default="COMPLETE", help="Generation status to report")
+    parser.add_argument("--url", default=DEFAULT_URL, help=f"Webhook endpoint (default: {DEFAULT_URL})")
+    args = parser.parse_args()
+
+    result = send_completion(
+        args.generation_id,
+        args.image_url,
+        url=args.url,
+        status=args.status,
+        secret=os.getenv("LEONARDO_WEBHOOK_SECRET"),
+    )
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Generation-complete notifications pushed by Leonardo webhooks.
+
+`poll_generation` used to sleep a fixed interval before every status GET. It
+now waits on this registry instead: when `/api/leonardo/webhook` receives a
+completion for a generation, the waiting page task wakes immediately and
+polling only runs as a slow fallback for callbacks that never arrive.
+
+A callback can land on any server worker process. One that nobody in the
+receiving process waits for is stored in the app database, and waiters check
+there every `WEBHOOK_RELAY_CHECK_SECONDS`, so the page still wakes within about
+a second.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+from src import db
+
+# With webhooks configured, polls are only a safety net for lost callbacks.
+WEBHOOK_FALLBACK_INTERVAL = float(os.getenv("LEONARDO_WEBHOOK_FALLBACK_INTERVAL", "30"))
+# How often a waiter looks for callbacks received by another process.
+WEBHOOK_RELAY_CHECK_SECONDS = float(os.getenv("LEONARDO_WEBHOOK_RELAY_CHECK", "1"))
+# Relayed callbacks nobody picked up are dropped after this long.
+WEBHOOK_RELAY_KEEP_SECONDS = 3600
+# Completions that arrive before anyone waits (e.g. right after submit).
+_RECENT_LIMIT = 512
+
+_lock = threading.Lock()
+_waiters: dict[str, list[Callable[[dict], None]]] = {}
+_recent: OrderedDict[str, dict] = OrderedDict()
+
+
+def webhooks_enabled() -> bool:
+    """Return True when Leonardo is configured to call our webhook endpoint."""
+
+    flag = (os.getenv("LEONARDO_WEBHOOK_ENABLED") or "").strip().lower()
+    return flag in {"1", "true", "yes"} or bool(webhook_secret())
+
+
+def webhook_secret() -> str | None:
+    secret = (os.getenv("LEONARDO_WEBHOOK_SECRET") or "").strip()
+    return secret or None
+
+
+def poll_interval(interval_seconds: float) -> float:
+    """Return the delay between status GETs, stretched when webhooks are on."""
+
+    if webhooks_enabled():
+        return max(interval_seconds, WEBHOOK_FALLBACK_INTERVAL)
+    return interval_seconds
+
+
+def extract_generation(payload: dict[str, Any]) -> dict | None:
+    """Normalize a callback body into the `generations_by_pk` shape.
+
+    Accepts the poll response shape (`{"generations_by_pk": {...}}`), a bare
+    generation object, or Leonardo's webhook envelope
+    (`{"type": ..., "data": {"object": {...}}}`).
+    """
+
+    if not isinstance(payload, dict):
+        return None
+    gen = payload.get("generations_by_pk")
+    if gen is None and isinstance(payload.get("data"), dict):
+        gen = payload["data"].get("object")
+    if gen is None:
+        gen = payload
+    if not isinstance(gen, dict) or not gen.get("id"):
+        return None
+    gen = dict(gen)
+    if "generated_images" not in gen and isinstance(gen.get("images"), list):
+        gen["generated_images"] = gen["images"]
+    if not gen.get("status") and str(payload.get("type", "")).endswith(".complete"):
+        gen["status"] = "COMPLETE"
+    return gen
+
+
+def notify_generation(generation: dict) -> bool:
+    """Hand a finished generation to its waiters. Returns True if any woke."""
+
+    generation_id = generation["id"]
+    with _lock:
+        callbacks = _waiters.pop(generation_id, [])
+        if not callbacks:
+            _recent[generation_id] = generation
+            _recent.move_to_end(generation_id)
+            while len(_recent) > _RECENT_LIMIT:
+                _recent.popitem(last=False)
+    for callback in callbacks:
+        callback(generation)
+    if not callbacks:
+        _relay(generation)
+    return bool(callbacks)
+
+
+def _relay(generation: dict) -> None:
+    try:
+        db.save_webhook_event(generation["id"], generation, time.time() - WEBHOOK_RELAY_KEEP_SECONDS)
+    except sqlite3.Error as exc:
+        print(f"Could not relay webhook for {generation['id']}: {exc}")
+
+
+def _relayed(generation_id: str) -> dict | None:
+    """A callback for `generation_id` received by another process, if any."""
+
+    if not webhooks_enabled():
+        return None
+    try:
+        return db.pop_webhook_event(generation_id)
+    except sqlite3.Error:
+        # No app database here (e.g. a CLI run): only local callbacks count.
+        return None
+
+
+def _register(generation_id: str, callback: Callable[[dict], None]) -> dict | None:
+    with _lock:
+        early = _recent.pop(generation_id, None)
+        if early is None:
+            _waiters.setdefault(generation_id, []).append(callback)
+        return early
+
+
+def _unregister(generation_id: str, callback: Callable[[dict], None]) -> None:
+    with _lock:
+        callbacks = _waiters.get(generation_id)
+        if callbacks and callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del _waiters[generation_id]
+
+
+def wait_for_generation(generation_id: str, timeout: float) -> dict | None:
+    """Block up to `timeout` seconds for a webhook; None if none arrived."""
+
+    event = threading.Event()
+    received: list[dict] = []
+
+    def _callback(generation: dict) -> None:
+        received.append(generation)
+        event.set()
+
+    early = _register(generation_id, _callback)
+    if early is not None:
+        return early
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            relayed = _relayed(generation_id)
+            if relayed is not None:
+                return relayed
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or event.wait(min(remaining, WEBHOOK_RELAY_CHECK_SECONDS)):
+                break
+    finally:
+        _unregister(generation_id, _callback)
+    return received[0] if received else None
+
+
+async def async_wait_for_generation(generation_id: str, timeout: float) -> dict | None:
+    """Asyncio flavour of `wait_for_generation` for `AsyncLeonardoClient`."""
+
+    loop = asyncio.get_running_loop()
+    future: asyncio.Future = loop.create_future()
+
+    def _callback(generation: dict) -> None:
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(generation))
+
+    early = _register(generation_id, _callback)
+    if early is not None:
+        return early
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            relayed = _relayed(generation_id)
+            if relayed is not None:
+                return relayed
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), min(remaining, WEBHOOK_RELAY_CHECK_SECONDS))
+            except asyncio.TimeoutError:
+                continue
+    finally:
+        _unregister(generation_id, _callback)